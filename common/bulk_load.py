@@ -0,0 +1,506 @@
+import io
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.types import Integer
+import metrics
+from chunk_sizing import observe
+from indexes import drop_secondary_indexes, build_indexes
+
+
+def is_integer_type(sql_type):
+    """Indique si un type SQLAlchemy (classe ou instance) est un entier"""
+    if isinstance(sql_type, type):
+        return issubclass(sql_type, Integer)
+    return isinstance(sql_type, Integer)
+
+
+def format_timestamps(column):
+    """
+    Écrit une colonne de dates avec fuseau au format ISO 8601 UTC.
+
+    La conversion est vectorisée par NumPy, bien plus rapide que le
+    formatage ligne par ligne de to_csv. Les dates manquantes deviennent
+    des valeurs nulles.
+
+    L'unité est fixe (la microseconde, précision de PostgreSQL) : avec
+    unit="auto", minuit serait écrit comme une date seule, sans heure ni
+    "Z", et lu dans le fuseau de la session.
+    """
+    values = column.dt.tz_convert("UTC").dt.tz_localize(None).to_numpy()
+    text_values = np.datetime_as_string(values, unit="us", timezone="UTC")
+    return pd.Series(
+        np.where(column.isna().to_numpy(), None, text_values),
+        index=column.index,
+    )
+
+
+def prepare_chunk(chunk, dtype_dict):
+    """
+    Adapte un chunk au format texte attendu par COPY.
+
+    pandas lit une colonne entière contenant des valeurs manquantes en float
+    ("123.0"), ce que PostgreSQL refuse pour une colonne INTEGER lors d'un
+    COPY. Ces colonnes sont converties en entiers nullables. Les dates avec
+    fuseau sont mises en texte d'avance par format_timestamps.
+
+    Args:
+        chunk (DataFrame): Le chunk à charger.
+        dtype_dict (dict): Les types SQL des colonnes.
+
+    Returns:
+        DataFrame: Le chunk prêt à être sérialisé.
+    """
+    for column, sql_type in dtype_dict.items():
+        if column not in chunk.columns or not is_integer_type(sql_type):
+            continue
+        if pd.api.types.is_float_dtype(chunk[column]):
+            chunk[column] = chunk[column].astype("Int64")
+
+    for column in chunk.columns:
+        if isinstance(chunk[column].dtype, pd.DatetimeTZDtype):
+            chunk[column] = format_timestamps(chunk[column])
+    return chunk
+
+
+def create_table(engine, table_name, chunk, dtype_dict, if_exists="replace"):
+    """Crée la table à partir des colonnes du chunk, sans insérer de lignes"""
+    chunk.head(0).to_sql(
+        table_name, engine, if_exists=if_exists,
+        index=False, dtype=dtype_dict
+    )
+
+
+def frame_size(chunk):
+    """Taille d'un chunk en mémoire, en octets"""
+    return int(chunk.memory_usage(index=False, deep=True).sum())
+
+
+def rows_read(chunk):
+    """Lignes lues pour produire un chunk (plus que len si filtré)"""
+    return chunk.attrs.get("rows_read", len(chunk))
+
+
+def serialize_chunk(chunk, dtype_dict):
+    """Écrit un chunk au format CSV de COPY dans un buffer en mémoire"""
+    buffer = io.StringIO()
+    prepare_chunk(chunk, dtype_dict).to_csv(buffer, index=False, header=False)
+    return buffer
+
+
+def copy_chunk(cursor, table_name, columns, buffer):
+    """
+    Envoie un buffer CSV dans la table avec COPY ... FROM STDIN.
+
+    Args:
+        cursor: Un curseur psycopg2.
+        table_name (str): La table cible (déjà créée).
+        columns (list): Les colonnes du buffer, dans l'ordre.
+        buffer (StringIO): Les lignes au format CSV.
+
+    Returns:
+        int: La taille des données envoyées, en caractères.
+    """
+    buffer.seek(0)
+    cursor.copy_expert(
+        f"COPY {table_name} ({', '.join(columns)}) FROM STDIN "
+        "WITH (FORMAT csv)",
+        buffer,
+    )
+    return buffer.tell()
+
+
+def put_until_stopped(chunk_queue, item, stop):
+    """
+    Ajoute un élément à la file en attendant qu'une place se libère.
+
+    Returns:
+        bool: False si le chargement a été arrêté entre-temps.
+    """
+    while not stop.is_set():
+        try:
+            chunk_queue.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def get_until_stopped(chunk_queue, stop):
+    """Prend le prochain élément de la file (None si arrêt ou fin)"""
+    while not stop.is_set():
+        try:
+            return chunk_queue.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return None
+
+
+def produce_buffers(chunk, parse_seconds, chunks, dtype_dict, chunk_queue,
+                    stop, writers, stats, sizer=None):
+    """
+    Lit et sérialise les chunks dans la file bornée (thread lecteur).
+
+    Le DataFrame est libéré dès qu'il est sérialisé : la file ne contient
+    que les buffers prêts pour COPY. put bloque quand la file est pleine,
+    ce qui ralentit la lecture au rythme de l'écriture.
+    """
+    index = 0
+    rows_total = 0
+    read_total = 0
+    try:
+        while chunk is not None and not stop.is_set():
+            frame_bytes = frame_size(chunk) if sizer is not None else 0
+            start = time.perf_counter()
+            buffer = serialize_chunk(chunk, dtype_dict)
+            serialize_seconds = time.perf_counter() - start
+            rows_total += len(chunk)
+            read_total += rows_read(chunk)
+            item = {
+                "index": index,
+                "rows": len(chunk),
+                "rows_read": rows_read(chunk),
+                "rows_total": rows_total,
+                "read_total": read_total,
+                "columns": list(chunk.columns),
+                "buffer": buffer,
+                "parse_seconds": parse_seconds,
+                "serialize_seconds": serialize_seconds,
+                "frame_bytes": frame_bytes,
+            }
+            chunk = None
+            stats["read_seconds"] += parse_seconds + serialize_seconds
+
+            start = time.perf_counter()
+            if not put_until_stopped(chunk_queue, item, stop):
+                return
+            stats["queue_full_seconds"] += time.perf_counter() - start
+            index += 1
+
+            start = time.perf_counter()
+            chunk = next(chunks, None)
+            parse_seconds = time.perf_counter() - start
+    finally:
+        # Un marqueur de fin par écrivain
+        for _ in range(writers):
+            put_until_stopped(chunk_queue, None, stop)
+
+
+def write_buffers(engine, table_name, chunk_queue, stop, turn, checkpoint,
+                  stats, sizer=None):
+    """
+    Envoie les buffers de la file avec COPY (thread écrivain).
+
+    Chaque écrivain a sa propre connexion. Les COPY se font en parallèle,
+    mais les commits se font dans l'ordre des chunks : les lignes validées
+    forment toujours un début du fichier, et le point de reprise du
+    manifeste reste exact.
+    """
+    raw_connection = engine.raw_connection()
+    try:
+        with raw_connection.cursor() as cursor:
+            while True:
+                start = time.perf_counter()
+                item = get_until_stopped(chunk_queue, stop)
+                empty_seconds = time.perf_counter() - start
+                if item is None:
+                    return
+
+                start = time.perf_counter()
+                size = copy_chunk(
+                    cursor, table_name, item["columns"], item["buffer"]
+                )
+                item["buffer"] = None
+                copy_seconds = time.perf_counter() - start
+
+                with turn:
+                    while turn.next_index != item["index"]:
+                        if stop.is_set():
+                            raw_connection.rollback()
+                            return
+                        turn.wait(0.1)
+                    start = time.perf_counter()
+                    if checkpoint is not None:
+                        checkpoint(
+                            cursor, item["rows_total"], item["read_total"]
+                        )
+                    raw_connection.commit()
+                    copy_seconds += time.perf_counter() - start
+                    turn.next_index += 1
+                    turn.rows_committed = item["rows_total"]
+                    turn.notify_all()
+
+                    stats["write_seconds"] += copy_seconds
+                    stats["queue_empty_seconds"] += empty_seconds
+                    if sizer is not None:
+                        observe(
+                            sizer, item["rows_read"],
+                            item["parse_seconds"] + item["serialize_seconds"]
+                            + copy_seconds,
+                            item["frame_bytes"], size,
+                        )
+                metrics.record_chunk(
+                    table_name, item["rows"], item["parse_seconds"],
+                    item["serialize_seconds"], copy_seconds, size,
+                )
+    except Exception:
+        stop.set()
+        raise
+    finally:
+        raw_connection.close()
+
+
+def overlap_report(stats, elapsed):
+    """
+    Calcule le recouvrement obtenu entre lecture et écriture.
+
+    En séquentiel, la durée serait la somme du temps de lecture et du
+    temps d'écriture ; le recouvrement est la part du plus court des deux
+    qui a été cachée derrière l'autre (100 % : la durée totale est celle
+    de la plus longue des deux activités).
+
+    Returns:
+        dict: Les temps mesurés, le recouvrement et le gain.
+    """
+    serial = stats["read_seconds"] + stats["write_seconds"]
+    shortest = min(stats["read_seconds"], stats["write_seconds"])
+    overlap = (serial - elapsed) / shortest if shortest > 0 else 0.0
+    return {
+        **stats,
+        "elapsed_seconds": elapsed,
+        "serial_seconds": serial,
+        "overlap_ratio": min(max(overlap, 0.0), 1.0),
+        "speedup": serial / elapsed if elapsed > 0 else None,
+    }
+
+
+def load_overlapped(engine, table_name, chunk, parse_seconds, chunks,
+                    dtype_dict, checkpoint, queue_size, writers, sizer=None):
+    """
+    Charge les chunks en recouvrant la lecture et l'écriture.
+
+    Un thread lit et sérialise les chunks dans une file bornée pendant
+    que `writers` connexions la vident avec COPY. Au plus
+    queue_size + writers + 1 chunks sont en mémoire en même temps.
+
+    Returns:
+        tuple: (lignes chargées, rapport de recouvrement)
+    """
+    start = time.perf_counter()
+    chunk_queue = queue.Queue(maxsize=max(queue_size, 1))
+    stop = threading.Event()
+    turn = threading.Condition()
+    turn.next_index = 0
+    turn.rows_committed = 0
+    stats = {
+        "read_seconds": 0.0,
+        "write_seconds": 0.0,
+        "queue_full_seconds": 0.0,
+        "queue_empty_seconds": 0.0,
+    }
+
+    with ThreadPoolExecutor(max_workers=writers + 1) as executor:
+        consumers = [
+            executor.submit(
+                write_buffers, engine, table_name, chunk_queue, stop, turn,
+                checkpoint, stats, sizer,
+            )
+            for _ in range(writers)
+        ]
+        producer = executor.submit(
+            produce_buffers, chunk, parse_seconds, chunks, dtype_dict,
+            chunk_queue, stop, writers, stats, sizer,
+        )
+        for future in [producer] + consumers:
+            try:
+                future.result()
+            except Exception:
+                stop.set()
+                raise
+
+    # La lecture du premier chunk, faite avant la création de la table,
+    # compte dans la durée comme dans le temps de lecture
+    report = overlap_report(stats, time.perf_counter() - start + parse_seconds)
+    metrics.record_overlap(table_name, report)
+    return turn.rows_committed, report
+
+
+def copy_chunks(engine, table_name, chunk, parse_seconds, chunks,
+                dtype_dict, checkpoint=None, sizer=None):
+    """
+    Charge les chunks l'un après l'autre sur une seule connexion.
+
+    Returns:
+        int: Le nombre de lignes chargées.
+    """
+    total_rows = 0
+    read_total = 0
+    raw_connection = engine.raw_connection()
+    try:
+        with raw_connection.cursor() as cursor:
+            while chunk is not None:
+                chunk_read = rows_read(chunk)
+                frame_bytes = frame_size(chunk) if sizer is not None else 0
+                start = time.perf_counter()
+                buffer = serialize_chunk(chunk, dtype_dict)
+                serialized = time.perf_counter()
+                size = copy_chunk(cursor, table_name, chunk.columns, buffer)
+                total_rows += len(chunk)
+                read_total += chunk_read
+                if checkpoint is not None:
+                    checkpoint(cursor, total_rows, read_total)
+                raw_connection.commit()
+                copy_seconds = time.perf_counter() - serialized
+                metrics.record_chunk(
+                    table_name, len(chunk), parse_seconds,
+                    serialized - start, copy_seconds, size,
+                )
+                if sizer is not None:
+                    observe(
+                        sizer, chunk_read,
+                        parse_seconds + serialized - start + copy_seconds,
+                        frame_bytes, size,
+                    )
+
+                start = time.perf_counter()
+                chunk = next(chunks, None)
+                parse_seconds = time.perf_counter() - start
+    finally:
+        raw_connection.close()
+
+    return total_rows
+
+
+def bulk_load(engine, table_name, chunks, dtype_dict, if_exists="replace",
+              checkpoint=None, queue_size=0, writers=1, sizer=None):
+    """
+    Charge une suite de chunks dans PostgreSQL avec COPY.
+
+    La table est créée à partir du premier chunk avec les types de
+    dtype_dict (comme le faisait to_sql), puis chaque chunk est envoyé
+    en flux et validé séparément. Pour chaque chunk, le temps de
+    production (lecture et parsing), de mise au format COPY et d'écriture
+    en base est enregistré dans metrics, sous le nom de la table.
+
+    Avec queue_size > 0 ou plusieurs écrivains, la lecture du chunk
+    suivant se fait pendant l'écriture du précédent (load_overlapped).
+
+    En ajout dans une table existante, ses index secondaires sont
+    supprimés avant le chargement et reconstruits à la fin ; si le
+    chargement échoue, ils restent à recréer (étape d'index du pipeline).
+
+    Args:
+        engine (Engine): L'engine de connexion à la base de données.
+        table_name (str): Le nom de la table cible.
+        chunks (iterable): Les DataFrames à charger.
+        dtype_dict (dict): Les types SQL des colonnes.
+        if_exists (str): "replace" ou "append", comme pour to_sql.
+        checkpoint (callable): Appelée avec (curseur, lignes chargées,
+            lignes lues) après chaque chunk, dans la même transaction que
+            le COPY. Les lignes lues comptent aussi celles qu'un filtre a
+            retirées du chunk (chunk.attrs["rows_read"]).
+        queue_size (int): Le nombre de chunks lus d'avance (0 : lecture
+            et écriture en séquence).
+        writers (int): Le nombre de connexions qui écrivent en parallèle.
+        sizer (dict): L'état de chunk_sizing : la taille des chunks
+            suivants est ajustée après chaque chunk chargé.
+
+    Returns:
+        int: Le nombre total de lignes chargées.
+    """
+    chunks = iter(chunks)
+    start = time.perf_counter()
+    chunk = next(chunks, None)
+    parse_seconds = time.perf_counter() - start
+    if chunk is None:
+        return 0
+    create_table(engine, table_name, chunk, dtype_dict, if_exists)
+
+    deferred = []
+    if if_exists == "append":
+        deferred = drop_secondary_indexes(engine, table_name)
+
+    if queue_size > 0 or writers > 1:
+        total_rows, report = load_overlapped(
+            engine, table_name, chunk, parse_seconds, chunks, dtype_dict,
+            checkpoint, queue_size, writers, sizer,
+        )
+        print(
+            f"Recouvrement lecture/écriture : {report['overlap_ratio']:.0%} "
+            f"(lecture {report['read_seconds']:.1f}s, écriture "
+            f"{report['write_seconds']:.1f}s, durée "
+            f"{report['elapsed_seconds']:.1f}s au lieu de "
+            f"{report['serial_seconds']:.1f}s ; file pleine "
+            f"{report['queue_full_seconds']:.1f}s, file vide "
+            f"{report['queue_empty_seconds']:.1f}s)"
+        )
+    else:
+        total_rows = copy_chunks(
+            engine, table_name, chunk, parse_seconds, chunks, dtype_dict,
+            checkpoint, sizer,
+        )
+
+    if deferred:
+        print(f"Reconstruction de {len(deferred)} index de {table_name}...")
+        build_indexes(engine, deferred, stage=table_name)
+    return total_rows
+
+
+def to_sql_load(engine, table_name, chunks, dtype_dict, if_exists="replace"):
+    """Chargement historique avec DataFrame.to_sql, conservé pour comparaison"""
+    total_rows = 0
+    for chunk in chunks:
+        chunk.to_sql(
+            table_name, engine, if_exists=if_exists,
+            index=False, dtype=dtype_dict
+        )
+        if_exists = "append"
+        total_rows += len(chunk)
+    return total_rows
+
+
+def compare_loaders(engine, csv_path, dtype_dict, nrows=500000,
+                    chunksize=100000):
+    """
+    Compare le débit de to_sql et de COPY sur les premières lignes d'un CSV.
+
+    Chaque méthode charge le même échantillon dans une table temporaire,
+    supprimée ensuite.
+
+    Args:
+        engine (Engine): L'engine de connexion à la base de données.
+        csv_path (str): Le chemin du fichier CSV.
+        dtype_dict (dict): Les types SQL des colonnes.
+        nrows (int): Le nombre de lignes de l'échantillon.
+        chunksize (int): La taille des chunks.
+
+    Returns:
+        dict: Le débit en lignes/s pour chaque méthode.
+    """
+    loaders = {"to_sql": to_sql_load, "copy": bulk_load}
+    results = {}
+
+    for name, loader in loaders.items():
+        table_name = f"bench_{name}"
+        chunks = pd.read_csv(csv_path, chunksize=chunksize, nrows=nrows)
+
+        start = time.perf_counter()
+        rows = loader(engine, table_name, chunks, dtype_dict)
+        elapsed = time.perf_counter() - start
+
+        results[name] = rows / elapsed if elapsed > 0 else 0.0
+        print(f"{name:>7} : {rows:,} lignes en {elapsed:.2f}s "
+              f"({results[name]:,.0f} lignes/s)")
+
+        with engine.connect() as connection:
+            connection.execute(text(f"DROP TABLE IF EXISTS {table_name}"))
+            connection.commit()
+
+    if results["to_sql"] > 0:
+        print(f"Gain COPY / to_sql : x{results['copy'] / results['to_sql']:.1f}")
+
+    return results
@@ -0,0 +1,147 @@
+from metrics import current_rss_bytes
+
+MB = 1024 * 1024
+
+# Budget mémoire par défaut d'un chargement
+DEFAULT_MEMORY_MB = 1024
+# Taille de départ, puis bornes de l'ajustement
+INITIAL_ROWS = 100000
+MIN_ROWS = 10000
+MAX_ROWS = 2000000
+# Facteurs appliqués à la taille quand le débit progresse ou que la
+# mémoire approche du budget
+GROWTH = 1.5
+SHRINK = 0.5
+# La taille n'augmente que si le débit progresse d'au moins 5 %
+MIN_IMPROVEMENT = 1.05
+# Part du budget au-delà de laquelle la taille est réduite
+RSS_HIGH = 0.85
+# Part du budget libre réservée aux chunks : pandas crée des copies
+# temporaires pendant la conversion et la sérialisation
+CHUNK_SHARE = 0.5
+
+
+def chunk_sizer(memory_mb=DEFAULT_MEMORY_MB, in_flight=1,
+                initial_rows=INITIAL_ROWS):
+    """
+    Crée l'état de l'ajustement de la taille des chunks.
+
+    La mémoire qui ne dépend pas de la taille des chunks (bibliothèques,
+    cache produits, lecture anticipée d'Arrow) est mesurée ici, puis
+    réévaluée après chaque chunk, et déduite du budget.
+
+    Args:
+        memory_mb (int): Le budget mémoire du processus, en Mo.
+        in_flight (int): Le nombre de chunks présents en mémoire en même
+            temps (plus d'un en chargement recouvert).
+        initial_rows (int): La taille du premier chunk.
+
+    Returns:
+        dict: L'état, à passer aux lecteurs et à bulk_load.
+    """
+    budget = memory_mb * MB
+    baseline = current_rss_bytes()
+    return {
+        "rows": initial_rows,
+        "budget": budget,
+        "other_memory": baseline,
+        "over_budget": False,
+        "in_flight": in_flight,
+        "bytes_per_row": None,
+        "best_rate": 0.0,
+        "best_rows": initial_rows,
+        "growing": True,
+        "peak_rss": baseline,
+        "history": [initial_rows],
+    }
+
+
+def current_size(sizer):
+    """Renvoie une fonction qui donne la taille du prochain chunk"""
+    return lambda: sizer["rows"]
+
+
+def memory_limit_rows(sizer):
+    """Taille maximale permise par le budget, d'après les octets par ligne"""
+    if not sizer["bytes_per_row"]:
+        return MAX_ROWS
+    free = (sizer["budget"] - sizer["other_memory"]) * CHUNK_SHARE
+    if free <= 0:
+        # Le budget est déjà dépassé hors chunks : les réduire n'y change rien
+        return sizer["rows"]
+    return int(free / (sizer["in_flight"] * sizer["bytes_per_row"]))
+
+
+def observe(sizer, rows, seconds, frame_bytes, buffer_bytes):
+    """
+    Ajuste la taille des chunks après le chargement d'un chunk.
+
+    La taille augmente tant que le débit (lignes par seconde de lecture,
+    conversion et écriture) progresse, puis revient à la meilleure
+    taille mesurée. Elle est réduite de moitié quand la mémoire du
+    processus approche du budget, si les chunks en sont la cause, et ne
+    dépasse jamais la taille permise par les octets par ligne observés.
+    Si la mémoire hors chunks dépasse déjà le budget, réduire les chunks
+    ne servirait à rien : le dépassement est seulement signalé.
+
+    Args:
+        sizer (dict): L'état créé par chunk_sizer.
+        rows (int): Les lignes du chunk.
+        seconds (float): Le temps de lecture, conversion et écriture.
+        frame_bytes (int): La taille du DataFrame en mémoire.
+        buffer_bytes (int): La taille du texte envoyé par COPY.
+    """
+    if rows == 0:
+        return
+    sizer["bytes_per_row"] = (frame_bytes + buffer_bytes) / rows
+    rss = current_rss_bytes()
+    sizer["peak_rss"] = max(sizer["peak_rss"], rss)
+    rate = rows / seconds if seconds > 0 else 0.0
+
+    size = sizer["rows"]
+    chunk_memory = sizer["in_flight"] * sizer["bytes_per_row"] * size
+    sizer["other_memory"] = max(rss - chunk_memory, 0)
+    excess = rss - sizer["budget"] * RSS_HIGH
+    if excess > 0:
+        sizer["growing"] = False
+        if chunk_memory >= excess:
+            size = size * SHRINK
+        else:
+            sizer["over_budget"] = True
+    elif sizer["growing"] and rows == sizer["rows"]:
+        # Seuls les chunks à la taille courante sont comparés (le dernier
+        # chunk d'un fichier est plus court)
+        if rate > sizer["best_rate"] * MIN_IMPROVEMENT:
+            sizer["best_rate"] = rate
+            sizer["best_rows"] = rows
+            size = size * GROWTH
+        else:
+            sizer["growing"] = False
+            size = sizer["best_rows"]
+
+    size = min(size, memory_limit_rows(sizer), MAX_ROWS)
+    size = int(max(size, MIN_ROWS))
+    if size != sizer["rows"]:
+        sizer["rows"] = size
+        sizer["history"].append(size)
+
+
+def describe(sizer):
+    """Résume les tailles choisies pour un fichier, pour le journal"""
+    sizes = " -> ".join(f"{size:,}" for size in sizer["history"])
+    line = f"Taille des chunks : {sizes} lignes"
+    if sizer["bytes_per_row"]:
+        line += f" ({sizer['bytes_per_row']:.0f} octets/ligne"
+        line += f", pic {sizer['peak_rss'] / MB:,.0f} Mo"
+        line += f" pour un budget de {sizer['budget'] / MB:,.0f} Mo)"
+    if sizer["over_budget"]:
+        line += (f" ; budget trop faible : {sizer['other_memory'] / MB:,.0f}"
+                 " Mo sont utilisés hors chunks")
+    return line
+
+
+def in_flight_chunks(queue_size=0, writers=1):
+    """Chunks en mémoire en même temps pendant un chargement (bulk_load)"""
+    if queue_size > 0 or writers > 1:
+        return queue_size + writers + 1
+    return 1
@@ -0,0 +1,556 @@
+import argparse
+import time
+from sqlalchemy import text
+from database import get_engine
+from partitions import drop_table, is_partitioned, is_view
+from row_counts import get_count, set_count
+import metrics
+
+# Table des faits de la version compacte de customers ; customers devient
+# une vue sur cette table qui garde les colonnes d'origine
+COMPACT_TABLE = "customers_compact"
+
+# Colonnes texte remplacées par un code entier :
+# colonne -> (table de dimension, type du code)
+DIMENSIONS = {
+    "event_type": ("event_types", "SMALLINT"),
+    "category_code": ("category_codes", "INTEGER"),
+    "brand": ("brands", "INTEGER"),
+}
+
+# Le prix NUMERIC(10, 2) est stocké en centimes : un INTEGER couvre
+# jusqu'à 21 474 836,47, bien au-delà des prix du sujet
+PRICE_COLUMN = "price"
+MAX_PRICE_CENTS = 2**31 - 1
+
+# Ordre des colonnes dans la table compacte : les types alignés sur
+# 8 octets d'abord, puis 4, puis 2, pour que PostgreSQL n'ajoute pas
+# d'octets de remplissage entre les colonnes. Les colonnes inconnues
+# suivent, dans l'ordre de customers.
+STORAGE_ORDER = [
+    "event_time", "user_id", "category_id", "user_session", "product_id",
+    "price", "category_code", "brand", "event_type",
+]
+
+# Nombre de lectures de chaque table pour la mesure ; la meilleure est
+# gardée, les suivantes trouvant les pages en cache
+SCAN_RUNS = 3
+
+
+def relation_columns(connection, table_name):
+    """Liste les colonnes et leurs types, dans l'ordre de définition"""
+    result = connection.execute(text("""
+    SELECT attname, format_type(atttypid, atttypmod) FROM pg_attribute
+    WHERE attrelid = CAST(:table AS regclass)
+      AND attnum > 0 AND NOT attisdropped
+    ORDER BY attnum
+    """), {"table": table_name})
+    return [(row[0], row[1]) for row in result]
+
+
+def is_compact(connection):
+    """Indique si customers est la vue sur la table compacte"""
+    return is_view(connection, "customers")
+
+
+def code_column(column):
+    """Nom de la colonne de code d'une colonne texte (brand -> brand_id)"""
+    return f"{column}_id"
+
+
+def stored_column(column):
+    """Nom d'une colonne de customers dans la table compacte"""
+    if column in DIMENSIONS:
+        return code_column(column)
+    if column == PRICE_COLUMN:
+        return "price_cents"
+    return column
+
+
+def ensure_dimensions(connection, columns, source="customers",
+                      stage="compact"):
+    """
+    Crée les tables de dimension des colonnes texte présentes et y ajoute
+    les valeurs de `source` qui n'y sont pas encore.
+
+    Les codes déjà attribués ne changent pas : une table compactée à
+    nouveau garde les mêmes codes.
+
+    Args:
+        connection (Connection): La connexion à la base de données.
+        columns (list): Les noms des colonnes de `source`.
+        source (str): La table dont les valeurs sont ajoutées.
+        stage (str): Le nom de l'étape pour les mesures.
+
+    Returns:
+        dict: Le nombre de valeurs de chaque dimension.
+    """
+    sizes = {}
+    for column, (dimension, code_type) in DIMENSIONS.items():
+        if column not in columns:
+            continue
+        code = code_column(column)
+        connection.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS {dimension} (
+            {code} {code_type} GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            {column} TEXT NOT NULL UNIQUE
+        )
+        """))
+        metrics.execute_timed(
+            connection, stage, f"dimension_{dimension}", f"""
+            INSERT INTO {dimension} ({column})
+            SELECT value FROM (
+                SELECT DISTINCT {column} AS value FROM {source}
+                WHERE {column} IS NOT NULL
+                EXCEPT
+                SELECT {column} FROM {dimension}
+            ) new_values
+            ORDER BY value
+            ON CONFLICT ({column}) DO NOTHING
+            """,
+        )
+        sizes[dimension] = connection.execute(
+            text(f"SELECT COUNT(*) FROM {dimension}")
+        ).scalar()
+    return sizes
+
+
+def check_price_range(connection):
+    """
+    Vérifie que tous les prix de customers tiennent en centimes dans un
+    INTEGER.
+
+    Raises:
+        ValueError: Si un prix est hors de l'intervalle.
+    """
+    min_price, max_price = connection.execute(text(
+        f"SELECT MIN({PRICE_COLUMN}), MAX({PRICE_COLUMN}) FROM customers"
+    )).fetchone()
+    limit = MAX_PRICE_CENTS / 100
+    for price in (min_price, max_price):
+        if price is not None and abs(price) > limit:
+            raise ValueError(
+                f"Prix {price} hors de l'intervalle des centimes en INTEGER"
+            )
+
+
+def storage_order(names):
+    """Range des colonnes de customers dans l'ordre de STORAGE_ORDER"""
+    ordered = [c for c in STORAGE_ORDER if c in names]
+    return ordered + [c for c in names if c not in STORAGE_ORDER]
+
+
+def compact_select(names, source="customers"):
+    """
+    Requête qui encode les lignes de `source`, au format de customers,
+    pour la table compacte, dans l'ordre de storage_order.
+
+    Les dimensions sont jointes sur leur valeur (LEFT JOIN : une valeur
+    NULL garde un code NULL).
+    """
+    ordered = storage_order(names)
+
+    selected = []
+    joins = []
+    for column in ordered:
+        if column in DIMENSIONS:
+            dimension, _ = DIMENSIONS[column]
+            selected.append(f"{dimension}.{code_column(column)}")
+            joins.append(
+                f"LEFT JOIN {dimension} "
+                f"ON {dimension}.{column} = c.{column}"
+            )
+        elif column == PRICE_COLUMN:
+            selected.append(
+                f"CAST(c.{column} * 100 AS INTEGER) AS price_cents"
+            )
+        else:
+            selected.append(f"c.{column}")
+    return (
+        f"SELECT {', '.join(selected)} FROM {source} c {' '.join(joins)}"
+    )
+
+
+def append_compact(connection, rows_query, names, label, params=None):
+    """
+    Ajoute des lignes au format de customers à la table compacte, en
+    quelques requêtes ensemblistes : les lignes sont écrites une fois
+    dans une table temporaire, les valeurs texte nouvelles entrent dans
+    leurs dimensions, puis toutes les lignes sont encodées par une seule
+    jointure. Le trigger de la vue, ligne par ligne, n'est pas utilisé.
+
+    Args:
+        connection (Connection): La connexion (dans la transaction).
+        rows_query (str): La requête (SELECT ou WITH ... SELECT) qui
+            renvoie les lignes à ajouter.
+        names (list): Les colonnes renvoyées par `rows_query`, parmi
+            celles de customers ; les autres restent NULL.
+        label (str): Le nom de la requête d'ajout pour les mesures.
+        params (dict): Les paramètres liés de `rows_query`.
+
+    Returns:
+        int: Le nombre de lignes ajoutées.
+    """
+    connection.execute(text("DROP TABLE IF EXISTS new_customers"))
+    metrics.execute_timed(
+        connection, "dedup", f"{label}_rows",
+        f"CREATE TEMPORARY TABLE new_customers ON COMMIT DROP AS "
+        f"{rows_query}",
+        params,
+    )
+    ensure_dimensions(connection, names, "new_customers", stage="dedup")
+    stored = ", ".join(stored_column(c) for c in storage_order(names))
+    return metrics.execute_timed(
+        connection, "dedup", label,
+        f"INSERT INTO {COMPACT_TABLE} ({stored}) "
+        f"{compact_select(names, 'new_customers')}",
+    )
+
+
+def view_select(columns):
+    """
+    Requête qui présente la table compacte avec les colonnes et les types
+    de customers, dans leur ordre d'origine.
+
+    Les dimensions sont jointes en LEFT JOIN sur leur clé primaire : une
+    requête qui n'en lit pas les colonnes (COUNT(*), product_id...) ne lit
+    que la table compacte, PostgreSQL supprimant ces jointures.
+    """
+    selected = []
+    joins = []
+    for column, sql_type in columns:
+        if column in DIMENSIONS:
+            dimension, _ = DIMENSIONS[column]
+            code = code_column(column)
+            selected.append(
+                f"CAST({dimension}.{column} AS {sql_type}) AS {column}"
+            )
+            joins.append(
+                f"LEFT JOIN {dimension} ON {dimension}.{code} = f.{code}"
+            )
+        elif column == PRICE_COLUMN:
+            selected.append(
+                f"CAST(f.price_cents / 100.0 AS {sql_type}) AS {column}"
+            )
+        else:
+            selected.append(f"f.{column}")
+    return (
+        f"SELECT {', '.join(selected)} FROM {COMPACT_TABLE} f "
+        f"{' '.join(joins)}"
+    )
+
+
+def insert_trigger(connection, columns):
+    """
+    Rend la vue customers insérable : chaque ligne est encodée puis
+    ajoutée à la table compacte, les valeurs texte nouvelles entrant dans
+    leur dimension.
+
+    Le trigger traite les lignes une par une : il sert aux insertions
+    ponctuelles. Les ajouts en masse (un nouveau mois dédupliqué par
+    remove_duplicates.py) passent par append_compact.
+    """
+    names = [name for name, _ in columns]
+    declarations = []
+    lookups = []
+    values = []
+    for column in names:
+        if column in DIMENSIONS:
+            dimension, code_type = DIMENSIONS[column]
+            code = code_column(column)
+            declarations.append(f"new_{code} {code_type};")
+            lookups.append(f"""
+            IF NEW.{column} IS NOT NULL THEN
+                SELECT d.{code} INTO new_{code} FROM {dimension} d
+                WHERE d.{column} = NEW.{column};
+                IF NOT FOUND THEN
+                    INSERT INTO {dimension} AS d ({column})
+                    VALUES (NEW.{column})
+                    ON CONFLICT ({column})
+                        DO UPDATE SET {column} = EXCLUDED.{column}
+                    RETURNING d.{code} INTO new_{code};
+                END IF;
+            END IF;""")
+            values.append(f"new_{code}")
+        elif column == PRICE_COLUMN:
+            values.append(f"CAST(NEW.{column} * 100 AS INTEGER)")
+        else:
+            values.append(f"NEW.{column}")
+
+    connection.execute(text(f"""
+    CREATE OR REPLACE FUNCTION {COMPACT_TABLE}_insert() RETURNS trigger AS $$
+    DECLARE
+        {' '.join(declarations)}
+    BEGIN
+        {''.join(lookups)}
+        INSERT INTO {COMPACT_TABLE}
+            ({', '.join(stored_column(column) for column in names)})
+        VALUES ({', '.join(values)});
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """))
+    connection.execute(text(f"""
+    CREATE TRIGGER customers_insert INSTEAD OF INSERT ON customers
+    FOR EACH ROW EXECUTE FUNCTION {COMPACT_TABLE}_insert()
+    """))
+
+
+def relation_size(connection, tables):
+    """Taille sur disque de tables, index et TOAST compris, en octets"""
+    return sum(
+        connection.execute(
+            text("SELECT pg_total_relation_size(CAST(:table AS regclass))"),
+            {"table": table},
+        ).scalar()
+        for table in tables
+    )
+
+
+def scan_seconds(connection, label, source, columns):
+    """
+    Mesure la lecture complète de customers, toutes colonnes décodées,
+    comme la font la déduplication et test_fusion.
+
+    Args:
+        connection (Connection): La connexion à la base de données.
+        label (str): Le nom de la mesure.
+        source (str): La table, ou la requête de la vue entre parenthèses.
+        columns (list): Les colonnes de customers.
+
+    Returns:
+        float: La meilleure durée sur SCAN_RUNS lectures, en secondes.
+    """
+    counts = ", ".join(f"COUNT({name})" for name, _ in columns)
+    query = text(f"SELECT COUNT(*), {counts} FROM {source} AS scanned")
+    best = None
+    for _ in range(SCAN_RUNS):
+        start = time.perf_counter()
+        with metrics.timed("compact", label):
+            connection.execute(query).fetchone()
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best
+
+
+def print_savings(wide_bytes, compact_bytes, scans):
+    """
+    Affiche le gain de place et de temps de lecture de la compaction.
+
+    Args:
+        wide_bytes (int): La taille de la table d'origine.
+        compact_bytes (int): La taille de la table compacte et des
+            dimensions.
+        scans (dict): Les durées de lecture complète de la table
+            d'origine ("customers"), de la table compacte seule
+            ("table") et de la vue qui décode les valeurs ("view").
+    """
+    print(f"\nTaille de customers : {wide_bytes / 2**20:,.1f} Mo -> "
+          f"{compact_bytes / 2**20:,.1f} Mo avec les dimensions "
+          f"({1 - compact_bytes / wide_bytes:.0%} de moins)")
+    print("Lecture complète de la table d'origine : "
+          f"{scans['customers']:.3f}s")
+    print(f"  - table compacte (codes) : {scans['table']:.3f}s "
+          f"({scans['customers'] / scans['table']:.2f}x)")
+    print(f"  - vue customers (valeurs décodées) : {scans['view']:.3f}s "
+          f"({scans['customers'] / scans['view']:.2f}x)")
+
+
+def compact_customers(exact=False, verify=False):
+    """
+    Remplace la table customers par une table compacte et une vue du même
+    nom qui en présente les colonnes d'origine.
+
+    Dans la table compacte, event_type devient un code SMALLINT,
+    category_code et brand des codes INTEGER vers leurs tables de
+    dimension, et price un nombre de centimes INTEGER ; les colonnes sont
+    rangées pour éviter le remplissage d'alignement. Les lectures de
+    customers (déduplication, test_fusion, requêtes d'analyse) ne
+    changent pas, et les insertions passent par un trigger.
+
+    La taille et le temps d'une lecture complète avant et après sont
+    affichés et ajoutés aux mesures de l'étape "compact".
+
+    Args:
+        exact (bool): Compter customers avec un vrai COUNT(*) au lieu de
+            lire row_counts.
+        verify (bool): Comparer la vue à la table d'origine (EXCEPT ALL)
+            avant de supprimer celle-ci.
+
+    Returns:
+        bool: True si customers est compacte à la fin de l'appel.
+    """
+    # Connexion à la base de données, partagée entre les étapes
+    engine = get_engine()
+
+    try:
+        with engine.connect() as connection:
+            if is_compact(connection):
+                print("\nLa table 'customers' est déjà compacte.")
+                return True
+            if is_partitioned(connection, "customers"):
+                raise ValueError(
+                    "customers n'est pas encore dédupliquée : lancez d'abord "
+                    "remove_duplicates.py"
+                )
+
+            columns = relation_columns(connection, "customers")
+            names = [name for name, _ in columns]
+            count_customers = get_count(connection, "customers", exact)
+            print(f"\nNombre de lignes dans customers: {count_customers:,}")
+
+            if PRICE_COLUMN in names:
+                check_price_range(connection)
+            dimensions = ensure_dimensions(connection, names)
+            for dimension, size in dimensions.items():
+                print(f"Dimension '{dimension}': {size:,} valeurs")
+            connection.commit()
+
+            # Écrire la table compacte
+            print("Écriture de la table compacte...")
+            drop_table(connection, COMPACT_TABLE)
+            count_compact = metrics.execute_timed(
+                connection, "compact", COMPACT_TABLE,
+                f"CREATE TABLE {COMPACT_TABLE} AS {compact_select(names)}",
+            )
+            connection.commit()
+            if count_compact != count_customers:
+                raise ValueError(
+                    f"{count_compact:,} lignes dans {COMPACT_TABLE} pour "
+                    f"{count_customers:,} dans customers"
+                )
+            # Statistiques à jour : les dimensions, minuscules, sont alors
+            # jointes par hachage
+            connection.execute(text(
+                f"ANALYZE {', '.join([COMPACT_TABLE] + list(dimensions))}"
+            ))
+
+            # Mesurer avant de supprimer la table d'origine
+            view_query = view_select(columns)
+            wide_bytes = relation_size(connection, ["customers"])
+            compact_bytes = relation_size(
+                connection,
+                [COMPACT_TABLE] + [DIMENSIONS[c][0] for c in names
+                                   if c in DIMENSIONS],
+            )
+            # Le décodage des codes et des centimes par la vue coûte du
+            # temps processeur ; la table compacte seule donne le gain
+            # d'entrées-sorties des requêtes qui lisent les codes
+            scans = {
+                "customers": scan_seconds(
+                    connection, "scan_customers", "customers", columns
+                ),
+                "table": scan_seconds(
+                    connection, "scan_compact_table", COMPACT_TABLE,
+                    relation_columns(connection, COMPACT_TABLE),
+                ),
+                "view": scan_seconds(
+                    connection, "scan_compact_view", f"({view_query})",
+                    columns,
+                ),
+            }
+
+            if verify:
+                with metrics.timed("compact", "verify_except_all"):
+                    differences = connection.execute(text(f"""
+                    SELECT
+                        (SELECT COUNT(*) FROM (
+                            SELECT * FROM customers
+                            EXCEPT ALL {view_query}) a),
+                        (SELECT COUNT(*) FROM (
+                            {view_query}
+                            EXCEPT ALL SELECT * FROM customers) b)
+                    """)).fetchone()
+                if differences[0] or differences[1]:
+                    raise ValueError(
+                        f"La vue diffère de customers : {differences[0]:,} "
+                        f"lignes manquantes, {differences[1]:,} en trop"
+                    )
+                print("✅ La vue est identique à la table d'origine")
+
+            # Remplacer la table par la vue, dans une seule transaction
+            print("Remplacement de la table customers par la vue...")
+            drop_table(connection, "customers")
+            connection.execute(text(f"CREATE VIEW customers AS {view_query}"))
+            insert_trigger(connection, columns)
+            set_count(connection, "customers", count_compact)
+            connection.commit()
+
+            print_savings(wide_bytes, compact_bytes, scans)
+            print("Compaction terminée avec succès.")
+            return True
+
+    except Exception as e:
+        print(f"Erreur lors de la compaction: {str(e)}")
+        return False
+
+
+def expand_customers(exact=False):
+    """
+    Remet customers sous forme de table ordinaire, à partir de la vue
+    compacte ; la table compacte est supprimée, les dimensions gardées.
+
+    Returns:
+        bool: True si customers est une table à la fin de l'appel.
+    """
+    # Connexion à la base de données, partagée entre les étapes
+    engine = get_engine()
+
+    try:
+        with engine.connect() as connection:
+            if not is_compact(connection):
+                print("\nLa table 'customers' n'est pas compacte.")
+                return True
+
+            print("\nÉcriture de la table customers à partir de la vue...")
+            connection.execute(text("DROP TABLE IF EXISTS customers_expanded"))
+            count_expanded = metrics.execute_timed(
+                connection, "compact", "customers_expanded",
+                "CREATE TABLE customers_expanded AS SELECT * FROM customers",
+            )
+            count_customers = get_count(connection, "customers", exact)
+            if count_expanded != count_customers:
+                raise ValueError(
+                    f"{count_expanded:,} lignes écrites pour "
+                    f"{count_customers:,} dans customers"
+                )
+            drop_table(connection, "customers")
+            drop_table(connection, COMPACT_TABLE)
+            connection.execute(
+                text("ALTER TABLE customers_expanded RENAME TO customers")
+            )
+            set_count(connection, "customers", count_expanded)
+            connection.commit()
+            print(f"Table 'customers' rétablie avec {count_expanded:,} lignes")
+            return True
+
+    except Exception as e:
+        print(f"Erreur lors de la décompaction: {str(e)}")
+        return False
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Stocke customers sous forme compacte (codes entiers, "
+                    "prix en centimes) derrière une vue du même nom"
+    )
+    parser.add_argument(
+        "--expand", action="store_true",
+        help="remet customers sous forme de table ordinaire"
+    )
+    parser.add_argument(
+        "--verify", action="store_true",
+        help="compare la vue à la table d'origine avant de la supprimer"
+    )
+    parser.add_argument(
+        "--exact", action="store_true",
+        help="compte customers avec un vrai COUNT(*) au lieu de lire "
+             "row_counts"
+    )
+    args = parser.parse_args()
+
+    if args.expand:
+        expand_customers(args.exact)
+    else:
+        compact_customers(args.exact, args.verify)
+    metrics.export_metrics("compact")
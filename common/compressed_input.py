@@ -0,0 +1,164 @@
+import csv
+import fcntl
+import io
+import os
+import threading
+from contextlib import contextmanager
+import pyarrow as pa
+from csv_count import record_ends, find_row_offset
+
+# Extensions de compression reconnues -> codec Arrow
+COMPRESSIONS = {".gz": "gzip", ".zst": "zstd", ".bz2": "bz2"}
+CSV_SUFFIXES = (".csv",) + tuple(f".csv{ext}" for ext in COMPRESSIONS)
+# Taille des blocs décompressés envoyés au parseur
+BLOCK_SIZE = 4 * 1024 * 1024
+# Capacité du tube entre le thread de décompression et le parseur
+# (F_SETPIPE_SZ, Linux ; la valeur par défaut du système sinon)
+PIPE_SIZE = 1024 * 1024
+F_SETPIPE_SZ = getattr(fcntl, "F_SETPIPE_SZ", 1031)
+
+
+def compression_of(path):
+    """Codec Arrow d'un fichier d'après son extension, None s'il est brut"""
+    return COMPRESSIONS.get(os.path.splitext(path)[1])
+
+
+def is_csv(name):
+    """Indique si un nom de fichier est un CSV, compressé ou non"""
+    return name.endswith(CSV_SUFFIXES)
+
+
+def csv_stem(path):
+    """Nom d'un CSV sans dossier ni extensions (data_2022_oct.csv.gz ->
+    data_2022_oct)"""
+    name = os.path.basename(path)
+    if compression_of(name):
+        name = os.path.splitext(name)[0]
+    return os.path.splitext(name)[0]
+
+
+def find_input(path):
+    """
+    Renvoie le chemin d'un CSV, ou celui de sa version compressée.
+
+    Returns:
+        str: `path` s'il existe, sinon le premier de path.gz, path.zst,
+            path.bz2 qui existe, sinon `path` (l'erreur viendra à la
+            lecture).
+    """
+    if os.path.exists(path):
+        return path
+    for ext in COMPRESSIONS:
+        if os.path.exists(path + ext):
+            return path + ext
+    return path
+
+
+def skip_records(block, in_quotes, to_skip):
+    """
+    Saute des enregistrements au début d'un bloc décompressé.
+
+    Returns:
+        tuple: (reste du bloc après le dernier enregistrement sauté, ou
+            None s'il faut encore sauter ; enregistrements restant à
+            sauter ; état entre guillemets en fin de bloc)
+    """
+    positions, in_quotes = record_ends(block, in_quotes)
+    if len(positions) >= to_skip:
+        return block[int(positions[to_skip - 1]) + 1:], 0, in_quotes
+    return None, to_skip - len(positions), in_quotes
+
+
+def decompress(path, codec, write_fd, skip, state):
+    """
+    Décompresse un fichier dans un tube (thread de décompression).
+
+    Les codecs d'Arrow libèrent le GIL : la décompression d'un bloc se
+    fait pendant que le parseur traite le précédent. Les `skip` premiers
+    enregistrements (en-tête compris) sont sautés sans être parsés.
+    """
+    # Le tube est fermé quoi qu'il arrive, même si le fichier ne s'ouvre
+    # pas : le lecteur reçoit alors EOF et l'erreur est relevée
+    try:
+        with os.fdopen(write_fd, "wb", buffering=0) as pipe, \
+                pa.input_stream(path, compression=codec,
+                                buffer_size=BLOCK_SIZE) as stream:
+            in_quotes = False
+            while block := stream.read(BLOCK_SIZE):
+                if skip:
+                    block, skip, in_quotes = skip_records(
+                        block, in_quotes, skip
+                    )
+                    if not block:
+                        continue
+                view = memoryview(block)
+                while view:
+                    view = view[pipe.write(view):]
+                state["bytes_out"] += len(block)
+    except BrokenPipeError:
+        # Le lecteur a fermé le tube : lecture interrompue, pas une erreur
+        pass
+    except Exception as e:
+        state["error"] = e
+
+
+@contextmanager
+def open_input(path, rows_done=0):
+    """
+    Ouvre un CSV en binaire, décompressé au besoin, à partir d'une ligne.
+
+    Un CSV brut est ouvert directement, positionné sur la ligne de
+    données `rows_done`. Un CSV compressé (.gz, .zst, .bz2) est
+    décompressé par un thread dédié qui alimente un tube : le parseur lit
+    un flux brut sans jamais attendre le disque ni le codec. Une reprise
+    saute les lignes déjà chargées dans ce thread, sans les parser (et
+    l'en-tête avec elles).
+
+    Args:
+        path (str): Le chemin du fichier.
+        rows_done (int): Les lignes de données à sauter ; avec 0, le flux
+            commence à l'en-tête.
+
+    Yields:
+        file: Le flux binaire à lire.
+
+    Raises:
+        Exception: L'erreur du thread de décompression (fichier corrompu
+            ou tronqué), à la fin de la lecture.
+    """
+    codec = compression_of(path)
+    if codec is None:
+        with open(path, "rb") as f:
+            if rows_done:
+                f.seek(find_row_offset(path, rows_done))
+            yield f
+        return
+
+    read_fd, write_fd = os.pipe()
+    try:
+        fcntl.fcntl(write_fd, F_SETPIPE_SZ, PIPE_SIZE)
+    except OSError:
+        pass
+    state = {"error": None, "bytes_out": 0}
+    skip = rows_done + 1 if rows_done else 0
+    thread = threading.Thread(
+        target=decompress, args=(path, codec, write_fd, skip, state),
+        daemon=True,
+    )
+    thread.start()
+    reader = os.fdopen(read_fd, "rb")
+    try:
+        yield reader
+    finally:
+        # Fermer la lecture débloque le thread s'il écrit encore
+        reader.close()
+        thread.join()
+    if state["error"] is not None:
+        raise state["error"]
+
+
+def csv_columns(path):
+    """Lit les noms de colonnes de l'en-tête d'un CSV, compressé ou non"""
+    with open_input(path) as f:
+        header = io.TextIOWrapper(f, encoding="utf-8", newline="").readline()
+    return next(csv.reader([header]))
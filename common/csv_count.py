@@ -0,0 +1,137 @@
+import mmap
+import os
+import sys
+import numpy as np
+
+BUFFER_SIZE = 64 * 1024 * 1024
+QUOTE = ord('"')
+NEWLINE = ord("\n")
+
+
+def record_ends(block, in_quotes):
+    """
+    Trouve les fins d'enregistrement d'un bloc.
+
+    Un saut de ligne est une fin d'enregistrement si le nombre de
+    guillemets qui le précèdent (en tenant compte de l'état hérité du bloc
+    précédent) est pair. Les guillemets échappés ("") comptent deux fois
+    et ne changent donc pas la parité.
+
+    Args:
+        block (bytes): Le bloc lu.
+        in_quotes (bool): True si le bloc commence dans un champ entre
+            guillemets.
+
+    Returns:
+        tuple: (positions des fins d'enregistrement dans le bloc,
+            état entre guillemets en fin de bloc)
+    """
+    data = np.frombuffer(block, dtype=np.uint8)
+    newline_positions = np.flatnonzero(data == NEWLINE)
+    if not in_quotes and b'"' not in block:
+        return newline_positions, False
+
+    quote_positions = np.flatnonzero(data == QUOTE)
+
+    # Nombre de guillemets avant chaque saut de ligne
+    quotes_before = np.searchsorted(quote_positions, newline_positions)
+    outside = (quotes_before + in_quotes) % 2 == 0
+
+    in_quotes = (len(quote_positions) + in_quotes) % 2 == 1
+    return newline_positions[outside], in_quotes
+
+
+def count_newlines(block, in_quotes):
+    """
+    Compte les fins d'enregistrement d'un bloc (voir record_ends).
+
+    Returns:
+        tuple: (nombre de fins de ligne, état entre guillemets en fin de bloc)
+    """
+    if not in_quotes and b'"' not in block:
+        return block.count(b"\n"), False
+
+    positions, in_quotes = record_ends(block, in_quotes)
+    return len(positions), in_quotes
+
+
+def count_csv_rows(file_path, header=True, buffer_size=BUFFER_SIZE):
+    """
+    Compte les lignes de données d'un CSV sans le parser.
+
+    Le fichier est projeté en mémoire et parcouru par gros blocs. Un
+    dernier enregistrement sans saut de ligne final est compté, et les
+    sauts de ligne à l'intérieur de champs entre guillemets sont ignorés.
+
+    Args:
+        file_path (str): Le chemin du fichier CSV.
+        header (bool): True si la première ligne est un en-tête.
+        buffer_size (int): La taille des blocs lus.
+
+    Returns:
+        int: Le nombre de lignes de données.
+    """
+    with open(file_path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return 0
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            lines = 0
+            in_quotes = False
+            for start in range(0, size, buffer_size):
+                count, in_quotes = count_newlines(
+                    mm[start:start + buffer_size], in_quotes
+                )
+                lines += count
+
+            # Dernière ligne sans saut de ligne final
+            if mm[size - 1] != NEWLINE:
+                lines += 1
+
+    return max(lines - 1, 0) if header else lines
+
+
+def find_row_offset(file_path, rows, header=True, buffer_size=BUFFER_SIZE):
+    """
+    Trouve la position en octets de la ligne de données numéro `rows`.
+
+    Permet de reprendre la lecture d'un CSV après `rows` lignes déjà
+    traitées sans les reparser.
+
+    Args:
+        file_path (str): Le chemin du fichier CSV.
+        rows (int): Le nombre de lignes de données à sauter.
+        header (bool): True si la première ligne est un en-tête.
+        buffer_size (int): La taille des blocs lus.
+
+    Returns:
+        int: La position du début de la ligne (la taille du fichier si
+            elle n'existe pas).
+    """
+    target = rows + 1 if header else rows
+    if target == 0:
+        return 0
+
+    with open(file_path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return 0
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            seen = 0
+            in_quotes = False
+            for start in range(0, size, buffer_size):
+                positions, in_quotes = record_ends(
+                    mm[start:start + buffer_size], in_quotes
+                )
+                if seen + len(positions) >= target:
+                    return start + int(positions[target - seen - 1]) + 1
+                seen += len(positions)
+
+    return size
+
+
+if __name__ == "__main__":
+    for path in sys.argv[1:]:
+        print(f"{path} : {count_csv_rows(path):,} lignes")
@@ -0,0 +1,262 @@
+import hashlib
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from sqlalchemy import text, inspect
+
+# États possibles d'une étape à la fin du pipeline
+DONE = "terminée"
+SKIPPED = "à jour"
+FAILED = "en échec"
+BLOCKED = "bloquée"
+
+
+def stage(name, run, deps=(), inputs=None, outputs=()):
+    """
+    Déclare une étape du pipeline.
+
+    Args:
+        name (str): Le nom unique de l'étape.
+        run (callable): La fonction à exécuter, sans argument ; l'étape
+            est en échec si elle lève une exception ou renvoie False.
+        deps (list): Les étapes qui doivent être terminées avant.
+        inputs (callable): Renvoie les empreintes des entrées externes
+            (fichiers sources) ; doit être rapide.
+        outputs (list): Les tables produites ; l'étape est relancée si
+            l'une d'elles n'existe plus.
+
+    Returns:
+        dict: La description de l'étape.
+    """
+    return {
+        "name": name,
+        "run": run,
+        "deps": list(deps),
+        "inputs": inputs or (lambda: []),
+        "outputs": list(outputs),
+    }
+
+
+def file_fingerprints(paths):
+    """Empreinte rapide de fichiers : chemin, taille et date de modification"""
+    fingerprints = []
+    for path in sorted(paths):
+        stat = os.stat(path)
+        fingerprints.append([path, stat.st_size, stat.st_mtime])
+    return fingerprints
+
+
+def topological_order(stages):
+    """
+    Trie les étapes pour que chacune suive ses dépendances.
+
+    Raises:
+        ValueError: Si une dépendance est inconnue ou si le graphe
+            contient un cycle.
+    """
+    by_name = {s["name"]: s for s in stages}
+    order = []
+    state = {}
+
+    def visit(name, path):
+        if name not in by_name:
+            raise ValueError(f"Étape inconnue : {name}")
+        if state.get(name) == "visited":
+            return
+        if state.get(name) == "visiting":
+            cycle = " -> ".join(path + [name])
+            raise ValueError(f"Cycle dans le pipeline : {cycle}")
+        state[name] = "visiting"
+        for dep in by_name[name]["deps"]:
+            visit(dep, path + [name])
+        state[name] = "visited"
+        order.append(by_name[name])
+
+    for s in stages:
+        visit(s["name"], [])
+    return order
+
+
+def ensure_pipeline_state(engine):
+    """Crée la table pipeline_state si elle n'existe pas"""
+    with engine.begin() as connection:
+        connection.execute(text("""
+        CREATE TABLE IF NOT EXISTS pipeline_state (
+            stage TEXT PRIMARY KEY,
+            fingerprint TEXT NOT NULL,
+            version TEXT NOT NULL,
+            duration DOUBLE PRECISION,
+            finished_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+        """))
+
+
+def stage_fingerprint(s, versions):
+    """
+    Calcule l'empreinte d'une étape.
+
+    Elle combine les empreintes des entrées externes et les versions des
+    étapes amont. Chaque exécution d'une étape produit une nouvelle
+    version : des tables amont reconstruites, même avec les mêmes
+    entrées, rendent périmées toutes les étapes qui en dépendent.
+    """
+    parts = {
+        "inputs": s["inputs"](),
+        "deps": {dep: versions[dep] for dep in s["deps"]},
+    }
+    encoded = json.dumps(parts, sort_keys=True, default=str).encode()
+    return hashlib.blake2b(encoded, digest_size=16).hexdigest()
+
+
+def up_to_date_version(engine, s, fingerprint):
+    """
+    Cherche une exécution réussie de l'étape avec ces entrées.
+
+    Returns:
+        str: La version produite par cette exécution, ou None si l'étape
+            doit être relancée (entrées changées ou table de sortie
+            disparue).
+    """
+    with engine.connect() as connection:
+        recorded = connection.execute(
+            text("SELECT fingerprint, version FROM pipeline_state "
+                 "WHERE stage = :stage"),
+            {"stage": s["name"]},
+        ).fetchone()
+    if recorded is None or recorded.fingerprint != fingerprint:
+        return None
+
+    inspector = inspect(engine)
+    existing = set(inspector.get_table_names() + inspector.get_view_names())
+    if not all(table in existing for table in s["outputs"]):
+        return None
+    return recorded.version
+
+
+def record_stage(engine, s, fingerprint, duration):
+    """
+    Enregistre une exécution réussie de l'étape.
+
+    Returns:
+        str: La nouvelle version de l'étape.
+    """
+    version = uuid.uuid4().hex
+    with engine.begin() as connection:
+        connection.execute(text("""
+        INSERT INTO pipeline_state (stage, fingerprint, version, duration)
+        VALUES (:stage, :fingerprint, :version, :duration)
+        ON CONFLICT (stage) DO UPDATE SET
+            fingerprint = EXCLUDED.fingerprint,
+            version = EXCLUDED.version,
+            duration = EXCLUDED.duration,
+            finished_at = now()
+        """), {
+            "stage": s["name"],
+            "fingerprint": fingerprint,
+            "version": version,
+            "duration": duration,
+        })
+    return version
+
+
+def run_stage(s):
+    """
+    Exécute une étape et mesure sa durée.
+
+    Returns:
+        tuple: (succès (bool), durée en secondes)
+    """
+    print(f"\n=== Étape '{s['name']}' ===")
+    start = time.perf_counter()
+    try:
+        success = s["run"]() is not False
+    except Exception as e:
+        print(f"Erreur dans l'étape '{s['name']}' : {e}")
+        success = False
+    return success, time.perf_counter() - start
+
+
+def run_pipeline(engine, stages, force=None, max_workers=2):
+    """
+    Exécute les étapes dans l'ordre du graphe de dépendances.
+
+    Une étape est lancée dès que toutes ses dépendances sont terminées,
+    donc les étapes indépendantes tournent en parallèle (dans des threads
+    qui partagent le pool de connexions de l'engine). Une étape dont
+    l'empreinte n'a pas changé depuis sa dernière exécution réussie est
+    ignorée ; les étapes en aval d'une étape relancée sont relancées
+    aussi, et celles en aval d'une étape en échec ne sont pas lancées.
+
+    Args:
+        engine (Engine): L'engine partagé par toutes les étapes.
+        stages (list): Les étapes déclarées avec stage().
+        force (list): Les étapes à relancer même si elles sont à jour
+            (toutes si la liste est vide, aucune si None).
+        max_workers (int): Le nombre maximal d'étapes simultanées.
+
+    Returns:
+        dict: L'état final de chaque étape.
+    """
+    order = topological_order(stages)
+    if force is not None and not force:
+        force = [s["name"] for s in order]
+    force = set(force or [])
+    unknown = force - {s["name"] for s in order}
+    if unknown:
+        raise ValueError(f"Étape inconnue : {', '.join(sorted(unknown))}")
+
+    ensure_pipeline_state(engine)
+    status = {}
+    fingerprints = {}
+    versions = {}
+    pending = list(order)
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            # Lancer (ou ignorer) toutes les étapes dont l'amont est prêt
+            progress = True
+            while progress:
+                progress = False
+                for s in list(pending):
+                    deps = [status.get(dep) for dep in s["deps"]]
+                    if any(d in (FAILED, BLOCKED) for d in deps):
+                        status[s["name"]] = BLOCKED
+                    elif all(d in (DONE, SKIPPED) for d in deps):
+                        fingerprint = stage_fingerprint(s, versions)
+                        fingerprints[s["name"]] = fingerprint
+                        version = None
+                        if s["name"] not in force:
+                            version = up_to_date_version(engine, s, fingerprint)
+                        if version is not None:
+                            print(f"\nÉtape '{s['name']}' à jour, ignorée")
+                            versions[s["name"]] = version
+                            status[s["name"]] = SKIPPED
+                        else:
+                            future = executor.submit(run_stage, s)
+                            running[future] = s
+                    else:
+                        continue
+                    pending.remove(s)
+                    progress = True
+
+            if not running:
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                s = running.pop(future)
+                success, duration = future.result()
+                if success:
+                    versions[s["name"]] = record_stage(
+                        engine, s, fingerprints[s["name"]], duration
+                    )
+                    status[s["name"]] = DONE
+                    print(f"\nÉtape '{s['name']}' terminée en {duration:.1f}s")
+                else:
+                    status[s["name"]] = FAILED
+                    print(f"\nÉtape '{s['name']}' en échec")
+
+    return status
@@ -0,0 +1,44 @@
+import os
+from dotenv import load_dotenv
+from sqlalchemy import create_engine
+
+_engine = None
+
+
+def get_engine():
+    """
+    Renvoie l'engine du processus, créé au premier appel.
+
+    Les étapes exécutées dans un même processus (par exemple par le
+    pipeline) partagent ainsi un seul pool de connexions au lieu de
+    recréer chacune le leur.
+
+    Returns:
+        Engine: L'engine de connexion à la base de données.
+    """
+    global _engine
+    if _engine is None:
+        load_dotenv()
+        _engine = create_engine(os.getenv("DATABASE_URL"), pool_pre_ping=True)
+    return _engine
+
+
+def dedicated_engine(connections):
+    """
+    Crée un engine à part, avec exactement `connections` connexions.
+
+    Pour des requêtes lancées en parallèle : elles n'attendent pas les
+    connexions du pool partagé de get_engine (5 connexions, plus 10 en
+    débordement), déjà utilisées par l'étape qui les lance. L'engine est
+    à fermer avec dispose().
+
+    Args:
+        connections (int): Le nombre de connexions simultanées.
+
+    Returns:
+        Engine: L'engine, sur la même base que get_engine.
+    """
+    return create_engine(
+        get_engine().url, pool_size=connections, max_overflow=0,
+        pool_pre_ping=True,
+    )
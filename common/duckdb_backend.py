@@ -0,0 +1,358 @@
+import os
+import time
+import tempfile
+import duckdb
+from schemas import EVENT_SCHEMA, ITEM_SCHEMA, sql_type_names, open_csv
+from compressed_input import compression_of, open_input, csv_stem
+from sql_queries import DIALECTS, dedup_query, items_unique_query, \
+    fusion_query
+import metrics
+
+DIALECT = DIALECTS["duckdb"]
+# Compressions lues directement par le scanner CSV de DuckDB ; les autres
+# (bz2) passent par le flux décompressé d'open_input et le parseur Arrow
+SCANNER_COMPRESSIONS = {None: "none", "gzip": "gzip", "zstd": "zstd"}
+
+
+def connect(database=":memory:"):
+    """
+    Ouvre une base DuckDB dans le processus.
+
+    Les dates écrites sans fuseau sont lues en UTC, comme par le parseur
+    Arrow des chargements PostgreSQL.
+
+    Args:
+        database (str): Le fichier de la base, ou ":memory:".
+
+    Returns:
+        DuckDBPyConnection: La connexion.
+    """
+    connection = duckdb.connect(database)
+    connection.execute("SET TimeZone = 'UTC'")
+    return connection
+
+
+def execute_timed(connection, stage, label, statement, params=None):
+    """
+    Exécute une requête DuckDB qui écrit une table, en mesurant sa durée.
+
+    Returns:
+        int: Le nombre de lignes écrites (None si inconnu).
+    """
+    with metrics.timed(stage, label):
+        row = connection.execute(statement, params).fetchone()
+    return row[0] if row else None
+
+
+def count_rows(connection, table_name):
+    """Compte les lignes d'une table ou d'une vue"""
+    return connection.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
+
+
+def table_columns(connection, table_name):
+    """Liste les colonnes et leurs types, dans l'ordre de définition"""
+    return connection.execute("""
+    SELECT column_name, data_type FROM information_schema.columns
+    WHERE table_schema = ? AND table_name = ? ORDER BY ordinal_position
+    """, [DIALECT["schema"], table_name]).fetchall()
+
+
+def relation_kind(connection, name):
+    """Renvoie "VIEW", "BASE TABLE", ou None si la relation n'existe pas"""
+    row = connection.execute("""
+    SELECT table_type FROM information_schema.tables
+    WHERE table_schema = ? AND table_name = ?
+    """, [DIALECT["schema"], name]).fetchone()
+    return row[0] if row else None
+
+
+def drop_relation(connection, name):
+    """Supprime une table ou une vue si elle existe"""
+    kind = relation_kind(connection, name)
+    if kind == "VIEW":
+        connection.execute(f"DROP VIEW {name}")
+    elif kind is not None:
+        connection.execute(f"DROP TABLE {name}")
+
+
+def rename_relation(connection, name, new_name):
+    """Renomme une table ou une vue"""
+    kind = "VIEW" if relation_kind(connection, name) == "VIEW" else "TABLE"
+    connection.execute(f"ALTER {kind} {name} RENAME TO {new_name}")
+
+
+def load_csv(connection, path, table_name, schema, stage="ingest"):
+    """
+    Charge un CSV dans une table DuckDB, en une seule requête.
+
+    Le scanner CSV vectorisé de DuckDB lit le fichier sur tous les cœurs,
+    directement avec les types du registre de schémas, et décompresse
+    lui-même gzip et zstd. Un CSV bz2 est décompressé par open_input et
+    lu par le parseur Arrow, dont DuckDB consomme les lots sans copie.
+
+    Args:
+        connection (DuckDBPyConnection): La connexion DuckDB.
+        path (str): Le chemin du CSV.
+        table_name (str): La table à créer (remplacée si elle existe).
+        schema (dict): Le schéma des colonnes.
+        stage (str): Le nom de l'étape pour les mesures.
+
+    Returns:
+        int: Le nombre de lignes chargées.
+    """
+    types = sql_type_names(schema)
+    codec = compression_of(path)
+    if codec in SCANNER_COMPRESSIONS:
+        return execute_timed(
+            connection, stage, f"load_{table_name}",
+            f"CREATE OR REPLACE TABLE {table_name} AS "
+            "SELECT * FROM read_csv(?, header = true, columns = ?, "
+            "compression = ?)",
+            [path, types, SCANNER_COMPRESSIONS[codec]],
+        )
+
+    casts = ", ".join(
+        f"CAST({column} AS {sql_type}) AS {column}"
+        for column, sql_type in types.items()
+    )
+    with open_input(path) as f:
+        connection.register("csv_stream", open_csv(f, schema))
+        try:
+            return execute_timed(
+                connection, stage, f"load_{table_name}",
+                f"CREATE OR REPLACE TABLE {table_name} AS "
+                f"SELECT {casts} FROM csv_stream",
+            )
+        finally:
+            connection.unregister("csv_stream")
+
+
+def ingest_files(connection, paths):
+    """
+    Charge les CSV mensuels, une table par fichier (data_2022_oct.csv ->
+    data_2022_oct).
+
+    Returns:
+        dict: Le nombre de lignes chargées par table.
+    """
+    counts = {}
+    for path in paths:
+        table_name = csv_stem(path)
+        counts[table_name] = load_csv(
+            connection, path, table_name, EVENT_SCHEMA, "ingest_customers"
+        )
+        print(f"Table '{table_name}' créée : {counts[table_name]:,} lignes")
+    return counts
+
+
+def create_items_table(connection, items_csv):
+    """
+    Charge items avec une ligne par product_id.
+
+    Le fichier est chargé tel quel, puis réduit avec la même règle que
+    items_table.py : la ligne la plus renseignée, puis la première du
+    fichier (DuckDB garde l'ordre d'insertion dans rowid).
+
+    Returns:
+        int: Le nombre de produits distincts.
+    """
+    connection.begin()
+    try:
+        raw_rows = load_csv(
+            connection, items_csv, "items_raw", ITEM_SCHEMA, "ingest_items"
+        )
+        drop_relation(connection, "items")
+        rows = execute_timed(
+            connection, "ingest_items", "items_unique",
+            items_unique_query("items_raw", "items", DIALECT),
+        )
+        connection.execute("DROP TABLE items_raw")
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    print(f"Table 'items' créée : {rows:,} produits distincts "
+          f"sur {raw_rows:,} lignes")
+    return rows
+
+
+def create_customers_table(connection, tables):
+    """
+    Crée customers comme une vue UNION ALL des tables mensuelles.
+
+    Comme les partitions côté PostgreSQL, aucune ligne n'est copiée : la
+    déduplication lit directement les tables mensuelles.
+
+    Returns:
+        int: Le nombre de lignes de customers.
+    """
+    drop_relation(connection, "customers")
+    union = " UNION ALL ".join(f"SELECT * FROM {table}" for table in tables)
+    connection.execute(f"CREATE VIEW customers AS {union}")
+    rows = count_rows(connection, "customers")
+    print(f"Vue 'customers' créée sur {len(tables)} tables : {rows:,} lignes")
+    return rows
+
+
+def remove_duplicates(connection):
+    """
+    Supprime les doublons à 1 seconde de customers, avec la même requête
+    que remove_duplicates.py.
+
+    Returns:
+        int: Le nombre de lignes conservées.
+    """
+    initial_count = count_rows(connection, "customers")
+    columns = [name for name, _ in table_columns(connection, "customers")]
+    connection.begin()
+    try:
+        drop_relation(connection, "customers_no_duplicates")
+        rows_kept = execute_timed(
+            connection, "dedup", "dedup_window",
+            dedup_query("customers", "customers_no_duplicates", columns),
+        )
+        drop_relation(connection, "customers")
+        rename_relation(connection, "customers_no_duplicates", "customers")
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    print(f"Nombre final de lignes: {rows_kept:,} "
+          f"({initial_count - rows_kept:,} doublons supprimés)")
+    return rows_kept
+
+
+def fusion(connection):
+    """
+    Ajoute à customers les colonnes d'items, avec la même requête que
+    fusion.py ; l'ancienne table est gardée dans customers_old.
+
+    Returns:
+        int: Le nombre de lignes de la table fusionnée.
+    """
+    connection.begin()
+    try:
+        drop_relation(connection, "customers_enriched")
+        count_fusion = execute_timed(
+            connection, "fusion", "customers_enriched",
+            fusion_query("customers", "items", "customers_enriched"),
+        )
+        drop_relation(connection, "customers_old")
+        rename_relation(connection, "customers", "customers_old")
+        rename_relation(connection, "customers_enriched", "customers")
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    match_count = connection.execute(
+        "SELECT COUNT(category_id) FROM customers"
+    ).fetchone()[0]
+    match_percent = match_count / count_fusion * 100 if count_fusion else 0
+    print(f"Nombre de lignes dans la table fusionnée: {count_fusion:,} "
+          f"({match_percent:.2f}% avec correspondance dans items)")
+    return count_fusion
+
+
+def run_pipeline(database, customer_paths, items_csv):
+    """
+    Exécute l'ingestion, customers, la déduplication et la fusion dans
+    DuckDB, sans serveur PostgreSQL.
+
+    Toutes les étapes sont relancées à chaque appel : il n'y a pas de
+    pipeline_state de ce côté, et chaque étape ne prend qu'une requête.
+
+    Args:
+        database (str): Le fichier de la base DuckDB, ou ":memory:".
+        customer_paths (list): Les CSV mensuels.
+        items_csv (str): Le CSV des items.
+
+    Returns:
+        dict: La durée de chaque étape en secondes, ou None en cas
+            d'échec.
+    """
+    durations = {}
+    try:
+        with connect(database) as connection:
+            stages = [
+                ("ingest_customers",
+                 lambda: ingest_files(connection, customer_paths)),
+                ("ingest_items",
+                 lambda: create_items_table(connection, items_csv)),
+                ("customers", lambda: create_customers_table(
+                    connection, [csv_stem(path) for path in customer_paths]
+                )),
+                ("dedup", lambda: remove_duplicates(connection)),
+                ("fusion", lambda: fusion(connection)),
+            ]
+            for name, run in stages:
+                print(f"\n=== Étape '{name}' (DuckDB) ===")
+                start = time.perf_counter()
+                run()
+                durations[name] = time.perf_counter() - start
+                print(f"Étape '{name}' terminée en {durations[name]:.1f}s")
+        return durations
+
+    except Exception as e:
+        print(f"Erreur lors du pipeline DuckDB : {str(e)}")
+        return None
+
+
+def export_postgres_table(engine, table_name, columns, path):
+    """Copie une table PostgreSQL dans un CSV, dates écrites en UTC"""
+    raw_connection = engine.raw_connection()
+    try:
+        with raw_connection.cursor() as cursor, open(path, "w") as f:
+            cursor.execute("SET LOCAL TIME ZONE 'UTC'")
+            cursor.copy_expert(
+                f"COPY (SELECT {', '.join(columns)} FROM {table_name}) "
+                "TO STDOUT WITH (FORMAT csv, HEADER)", f
+            )
+        raw_connection.rollback()
+    finally:
+        raw_connection.close()
+
+
+def compare_with_postgres(connection, engine, table_name="customers"):
+    """
+    Vérifie qu'une table DuckDB contient exactement les lignes de la table
+    PostgreSQL du même nom.
+
+    La table PostgreSQL est exportée avec COPY dans un CSV temporaire,
+    relu par DuckDB avec les types de sa propre table, puis les deux sont
+    comparées avec EXCEPT ALL : la mémoire ne dépend pas de leur taille.
+
+    Returns:
+        bool: True si les deux tables sont identiques ligne pour ligne.
+    """
+    columns = table_columns(connection, table_name)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, f"{table_name}.csv")
+        with metrics.timed("compare", f"export_{table_name}"):
+            export_postgres_table(
+                engine, table_name, [name for name, _ in columns], path
+            )
+        # Les chaînes vides sont écrites "" par COPY, les NULL sans rien
+        postgres_rows = (
+            "read_csv(?, header = true, columns = ?, "
+            "allow_quoted_nulls = false)"
+        )
+        with metrics.timed("compare", f"except_all_{table_name}"):
+            differences = connection.execute(f"""
+            SELECT
+                (SELECT COUNT(*) FROM (
+                    SELECT * FROM {table_name}
+                    EXCEPT ALL SELECT * FROM {postgres_rows}) a),
+                (SELECT COUNT(*) FROM (
+                    SELECT * FROM {postgres_rows}
+                    EXCEPT ALL SELECT * FROM {table_name}) b)
+            """, [path, dict(columns)] * 2).fetchone()
+
+    if differences[0] == 0 and differences[1] == 0:
+        print(f"✅ {table_name} identique dans DuckDB et PostgreSQL")
+        return True
+    print(
+        f"❌ Différences entre DuckDB et PostgreSQL sur {table_name}: "
+        f"{differences[0]:,} lignes en trop, {differences[1]:,} lignes "
+        "manquantes"
+    )
+    return False
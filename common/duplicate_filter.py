@@ -0,0 +1,138 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# Colonnes d'un événement : deux lignes égales sur les six sont des
+# doublons exacts
+EVENT_COLUMNS = [
+    "event_time", "event_type", "product_id", "price", "user_id",
+    "user_session",
+]
+# Fenêtre gardée derrière l'événement le plus récent, comme la fenêtre
+# de déduplication de remove_duplicates
+WINDOW_NS = 1_000_000_000
+
+
+def duplicate_filter(window_ns=WINDOW_NS):
+    """
+    Crée l'état du filtre des doublons exacts à l'ingestion.
+
+    L'état ne garde que les empreintes des lignes situées dans la fenêtre
+    derrière l'événement le plus récent vu : sa taille dépend du nombre
+    d'événements par seconde, pas de la taille du fichier.
+
+    Args:
+        window_ns (int): La largeur de la fenêtre, en nanosecondes.
+
+    Returns:
+        dict: L'état, à passer à filter_duplicates.
+    """
+    return {
+        "window_ns": window_ns,
+        "hashes": np.empty(0, dtype=np.uint64),
+        "times": np.empty(0, dtype=np.int64),
+        "watermark": None,
+        "rows_in": 0,
+        "rows_dropped": 0,
+        "peak_window": 0,
+    }
+
+
+def price_values(column):
+    """Prix en float64 (décimaux Arrow convertis sans passer par Python)"""
+    if isinstance(column.dtype, pd.ArrowDtype):
+        values = pc.cast(pa.array(column.array), pa.float64())
+        return pd.Series(
+            values.to_numpy(zero_copy_only=False), index=column.index
+        )
+    return pd.to_numeric(column).astype("float64")
+
+
+def row_hashes(chunk):
+    """
+    Empreinte 64 bits des six colonnes d'événement de chaque ligne.
+
+    Le prix est haché en float64 : ses deux décimales tiennent sans
+    perte, donc deux prix égaux en NUMERIC(10, 2) donnent la même
+    empreinte.
+    """
+    frame = chunk[EVENT_COLUMNS].assign(price=price_values(chunk["price"]))
+    return pd.util.hash_pandas_object(frame, index=False).to_numpy()
+
+
+def event_times(chunk):
+    """event_time en nanosecondes (valeur minimale pour une date absente)"""
+    times = pd.to_datetime(chunk["event_time"], utc=True).dt.as_unit("ns")
+    return times.dt.tz_convert(None).to_numpy().view("int64")
+
+
+def filter_chunk(state, chunk):
+    """
+    Retire d'un chunk les doublons exacts déjà vus.
+
+    Une ligne est retirée si une ligne identique la précède dans le chunk
+    ou figure dans la fenêtre de l'état. Retirer une copie exacte ne
+    change pas le résultat de remove_duplicates : la copie gardée a la
+    même date, et sert de précédent aux mêmes événements.
+
+    Le nombre de lignes lues avant filtrage est noté dans
+    chunk.attrs["rows_read"], pour les points de reprise.
+
+    Args:
+        state (dict): L'état créé par duplicate_filter.
+        chunk (DataFrame): Les événements lus.
+
+    Returns:
+        DataFrame: Le chunk sans ses doublons exacts.
+    """
+    rows_read = len(chunk)
+    hashes = row_hashes(chunk)
+    times = event_times(chunk)
+
+    duplicated = (
+        pd.Series(hashes).duplicated().to_numpy()
+        | np.isin(hashes, state["hashes"])
+    )
+    kept_hashes = hashes[~duplicated]
+    kept_times = times[~duplicated]
+
+    # Garder dans l'état les lignes conservées de la fenêtre
+    if len(times):
+        latest = times.max()
+        if state["watermark"] is None or latest > state["watermark"]:
+            state["watermark"] = latest
+    if state["watermark"] is not None:
+        start = state["watermark"] - state["window_ns"]
+        recent = state["times"] >= start
+        new = kept_times >= start
+        state["hashes"] = np.concatenate(
+            [state["hashes"][recent], kept_hashes[new]]
+        )
+        state["times"] = np.concatenate(
+            [state["times"][recent], kept_times[new]]
+        )
+    state["peak_window"] = max(state["peak_window"], len(state["hashes"]))
+    state["rows_in"] += rows_read
+    state["rows_dropped"] += int(duplicated.sum())
+
+    if duplicated.any():
+        chunk = chunk[~duplicated].reset_index(drop=True)
+    chunk.attrs["rows_read"] = rows_read
+    return chunk
+
+
+def filter_duplicates(chunks, state):
+    """Applique filter_chunk à une suite de chunks"""
+    for chunk in chunks:
+        yield filter_chunk(state, chunk)
+
+
+def filter_summary(state):
+    """Résume l'effet du filtre sur un fichier, pour le journal"""
+    rate = state["rows_dropped"] / state["rows_in"] if state["rows_in"] else 0
+    return (
+        f"Doublons exacts filtrés à l'ingestion : {state['rows_dropped']:,} "
+        f"sur {state['rows_in']:,} lignes ({rate:.1%}, fenêtre de "
+        f"{state['peak_window']:,} empreintes au plus)"
+    )
@@ -0,0 +1,225 @@
+import os
+import pickle
+import tempfile
+import numpy as np
+import pandas as pd
+
+MB = 1024 * 1024
+
+# Colonnes qui définissent un doublon (PARTITION BY de la version SQL)
+KEY_COLUMNS = ["event_type", "product_id", "price", "user_id", "user_session"]
+# Ordre de tri : les colonnes clés (prix en centimes), puis le temps
+SORT_COLUMNS = [
+    "event_type", "product_id", "_cents", "user_id", "user_session", "_ns"
+]
+COMPARE_COLUMNS = [
+    "event_type", "product_id", "_cents", "user_id", "user_session"
+]
+# Deux événements identiques à 1 seconde ou moins d'écart sont des doublons
+DEDUP_WINDOW_NS = 1_000_000_000
+# Nombre de blocs par run : la fusion garde un bloc par run en mémoire
+BLOCKS_PER_RUN = 64
+
+
+def add_sort_columns(chunk):
+    """
+    Ajoute les colonnes techniques de tri et de comparaison.
+
+    _ns contient event_time en nanosecondes et _cents le prix en centimes,
+    pour comparer les prix comme le NUMERIC(10, 2) de PostgreSQL et non
+    comme des flottants. Les valeurs manquantes restent manquantes.
+    """
+    event_time = pd.to_datetime(chunk["event_time"], utc=True).dt.as_unit("ns")
+    missing = event_time.isna().to_numpy()
+    nanoseconds = event_time.dt.tz_convert(None).to_numpy().view("int64")
+
+    chunk["event_time"] = event_time
+    chunk["_ns"] = pd.arrays.IntegerArray(nanoseconds.copy(), missing)
+    chunk["_cents"] = (
+        (pd.to_numeric(chunk["price"]) * 100).round().astype("Int64")
+    )
+    return chunk
+
+
+def sort_events(frame):
+    return frame.sort_values(
+        SORT_COLUMNS, na_position="last", kind="stable", ignore_index=True
+    )
+
+
+def spill_run(frame, workdir):
+    """
+    Trie un lot d'événements et l'écrit sur disque en blocs.
+
+    Returns:
+        str: Le chemin du run écrit.
+    """
+    frame = sort_events(frame)
+    block_rows = max(len(frame) // BLOCKS_PER_RUN, 1000)
+
+    fd, path = tempfile.mkstemp(suffix=".run", dir=workdir)
+    with os.fdopen(fd, "wb") as f:
+        for start in range(0, len(frame), block_rows):
+            pickle.dump(
+                frame.iloc[start:start + block_rows], f,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+    return path
+
+
+def read_run(path):
+    """Relit un run bloc par bloc"""
+    with open(path, "rb") as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+
+def write_runs(chunks, workdir, memory_budget):
+    """
+    Découpe le flux d'événements en runs triés qui tiennent en mémoire.
+
+    Les chunks sont accumulés jusqu'à la moitié du budget (le tri a besoin
+    d'une copie), puis triés et écrits sur disque.
+
+    Returns:
+        tuple: (chemins des runs, nombre de lignes lues)
+    """
+    runs = []
+    pending = []
+    pending_bytes = 0
+    total_rows = 0
+
+    for chunk in chunks:
+        chunk = add_sort_columns(chunk)
+        pending.append(chunk)
+        pending_bytes += chunk.memory_usage(deep=True).sum()
+        total_rows += len(chunk)
+
+        if pending_bytes >= memory_budget // 2:
+            runs.append(spill_run(pd.concat(pending, ignore_index=True), workdir))
+            pending = []
+            pending_bytes = 0
+
+    if pending:
+        runs.append(spill_run(pd.concat(pending, ignore_index=True), workdir))
+
+    return runs, total_rows
+
+
+def merge_runs(paths):
+    """
+    Fusionne les runs triés (k-way merge) par lots vectorisés.
+
+    Un seul bloc par run est chargé à la fois. La dernière ligne du bloc
+    courant de chaque run sert de borne : toutes les lignes triées avant la
+    plus petite de ces bornes peuvent être émises, car les blocs suivants
+    des runs ne contiennent que des lignes plus grandes.
+
+    Yields:
+        DataFrame: Des lots d'événements, globalement triés.
+    """
+    readers = [read_run(path) for path in paths]
+    pending = None
+    to_load = list(range(len(readers)))
+
+    while True:
+        frames = [] if pending is None else [pending]
+        for run in to_load:
+            block = next(readers[run], None)
+            if block is None:
+                continue
+            bound = np.full(len(block), -1)
+            bound[-1] = run
+            frames.append(block.assign(_bound=bound))
+
+        if not frames:
+            return
+        pending = sort_events(pd.concat(frames, ignore_index=True))
+
+        bounds = np.flatnonzero(pending["_bound"].to_numpy() >= 0)
+        if len(bounds) == 0:
+            # Tous les runs sont épuisés
+            yield pending.drop(columns="_bound")
+            return
+
+        cut = bounds[0] + 1
+        emitted = pending.iloc[:cut]
+        pending = pending.iloc[cut:]
+
+        to_load = emitted["_bound"][emitted["_bound"] >= 0].tolist()
+        yield emitted.drop(columns="_bound")
+
+
+def keys_equal(column):
+    """Compare chaque ligne à la précédente, deux NULL étant égaux"""
+    previous = column.shift(1)
+    equal = column.eq(previous).fillna(False).astype(bool)
+    return equal | (column.isna() & previous.isna())
+
+
+def mark_kept(batch, previous):
+    """
+    Applique la règle de la version SQL à un lot trié.
+
+    Une ligne est conservée si elle est la première de son groupe, si
+    l'événement précédent n'a pas de date, ou si elle arrive plus d'une
+    seconde après l'événement précédent du même groupe (qu'il ait été
+    conservé ou non, comme avec LAG).
+
+    Args:
+        batch (DataFrame): Le lot trié.
+        previous (DataFrame): La dernière ligne du lot précédent, ou None.
+
+    Returns:
+        ndarray: Le masque des lignes à conserver.
+    """
+    columns = COMPARE_COLUMNS + ["_ns"]
+    frame = batch[columns]
+    if previous is not None:
+        frame = pd.concat([previous[columns], frame], ignore_index=True)
+
+    same_group = np.ones(len(frame), dtype=bool)
+    for column in COMPARE_COLUMNS:
+        same_group &= keys_equal(frame[column]).to_numpy()
+    same_group[0] = False
+
+    gap = frame["_ns"] - frame["_ns"].shift(1)
+    far = gap.gt(DEDUP_WINDOW_NS).fillna(False).to_numpy(dtype=bool)
+    previous_missing = frame["_ns"].shift(1).isna().to_numpy()
+
+    kept = ~same_group | previous_missing | far
+    return kept[1:] if previous is not None else kept
+
+
+def dedup_events(chunks, memory_budget=512 * MB, tmp_dir=None):
+    """
+    Supprime les doublons à 1 seconde d'un flux d'événements par tri externe.
+
+    Les chunks sont triés par (event_type, product_id, price, user_id,
+    user_session, event_time) en runs écrits sur disque, puis fusionnés ;
+    chaque ligne n'est comparée qu'à la précédente dans cet ordre. La
+    mémoire utilisée reste bornée par memory_budget quelle que soit la
+    taille du flux.
+
+    Args:
+        chunks (iterable): Les DataFrames d'événements.
+        memory_budget (int): La mémoire allouée au tri, en octets.
+        tmp_dir (str): Le dossier des fichiers temporaires.
+
+    Yields:
+        DataFrame: Les événements conservés, triés, avec leurs colonnes
+            d'origine.
+    """
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as workdir:
+        runs, _ = write_runs(chunks, workdir, memory_budget)
+
+        previous = None
+        for batch in merge_runs(runs):
+            if batch.empty:
+                continue
+            kept = mark_kept(batch, previous)
+            previous = batch.iloc[[-1]]
+            yield batch.loc[kept].drop(columns=["_ns", "_cents"])
@@ -0,0 +1,67 @@
+import os
+import time
+
+# Délai sans modification après lequel un fichier est considéré complet
+SETTLE_SECONDS = 30
+# Intervalle entre deux examens des dossiers surveillés
+POLL_SECONDS = 10
+
+
+def file_watcher(settle_seconds=SETTLE_SECONDS):
+    """
+    Crée l'état de la surveillance de fichiers.
+
+    La surveillance examine les dossiers à intervalles réguliers (stat
+    seulement, sans lire les fichiers) : elle fonctionne sur tout système
+    de fichiers, y compris les volumes montés où inotify ne voit pas les
+    écritures faites depuis l'hôte.
+
+    Args:
+        settle_seconds (int): Le délai sans modification après lequel un
+            fichier en cours de copie est considéré complet.
+
+    Returns:
+        dict: L'état, à passer à stable_files.
+    """
+    return {"settle_seconds": settle_seconds, "seen": {}, "handled": {}}
+
+
+def stable_files(watcher, paths):
+    """
+    Renvoie les fichiers complets pas encore traités dans leur version
+    actuelle.
+
+    Un fichier est complet quand sa taille et sa date de modification
+    n'ont pas changé depuis l'examen précédent, et qu'il n'a pas été
+    modifié depuis settle_seconds. Un fichier remplacé ou modifié après
+    son traitement est renvoyé à nouveau, une fois stable.
+
+    Args:
+        watcher (dict): L'état créé par file_watcher.
+        paths (list): Les fichiers présents dans les dossiers surveillés.
+
+    Returns:
+        list: Les fichiers à traiter, dans l'ordre de `paths`.
+    """
+    now = time.time()
+    seen = {}
+    ready = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            # Supprimé ou renommé entre le listage et l'examen
+            continue
+        signature = (stat.st_size, stat.st_mtime_ns)
+        seen[path] = signature
+        if (watcher["seen"].get(path) == signature
+                and now - stat.st_mtime >= watcher["settle_seconds"]
+                and watcher["handled"].get(path) != signature):
+            ready.append(path)
+    watcher["seen"] = seen
+    return ready
+
+
+def mark_handled(watcher, path):
+    """Note un fichier comme traité dans sa version actuelle"""
+    watcher["handled"][path] = watcher["seen"][path]
@@ -0,0 +1,187 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import text
+import metrics
+
+# Colonnes qui définissent un doublon, puis le temps : l'ordre de la
+# fonction fenêtre de la déduplication
+DEDUP_KEY = [
+    "event_type", "product_id", "price", "user_id", "user_session",
+    "event_time",
+]
+
+# Index connus : suffixe du nom -> (méthode, colonnes). Le suffixe
+# event_time_brin est celui de l'index créé par remove_duplicates.
+INDEXES = {
+    "event_time_brin": ("brin", ["event_time"]),
+    "product_id": ("btree", ["product_id"]),
+    "dedup_key": ("btree", DEDUP_KEY),
+}
+
+# Mémoire de tri de chaque construction d'index
+MAINTENANCE_MB = 256
+
+
+def index_statement(table_name, suffix):
+    """Requête de création d'un index connu, sans effet s'il existe"""
+    method, columns = INDEXES[suffix]
+    return (
+        f"CREATE INDEX IF NOT EXISTS {table_name}_{suffix} "
+        f"ON {table_name} USING {method} ({', '.join(columns)})"
+    )
+
+
+def secondary_indexes(connection, table_name):
+    """
+    Liste les index d'une table qui ne portent pas de contrainte.
+
+    Returns:
+        list: Des couples (nom, définition SQL).
+    """
+    result = connection.execute(text("""
+    SELECT i.indexname, i.indexdef FROM pg_indexes i
+    WHERE i.schemaname = 'public' AND i.tablename = :table
+      AND NOT EXISTS (
+          SELECT 1 FROM pg_constraint c WHERE c.conname = i.indexname
+      )
+    ORDER BY i.indexname
+    """), {"table": table_name})
+    return [(row.indexname, row.indexdef) for row in result]
+
+
+def drop_secondary_indexes(engine, table_name):
+    """
+    Supprime les index secondaires d'une table avant un chargement.
+
+    COPY n'a alors plus à maintenir les index ligne par ligne ; ils sont
+    reconstruits en une passe après le chargement.
+
+    Returns:
+        list: Les définitions SQL des index supprimés.
+    """
+    with engine.begin() as connection:
+        indexes = secondary_indexes(connection, table_name)
+        for name, _ in indexes:
+            connection.execute(text(f"DROP INDEX IF EXISTS {name}"))
+    return [definition for _, definition in indexes]
+
+
+def run_statement(engine, stage, label, statement, maintenance_mb):
+    """
+    Exécute une construction d'index ou un VACUUM sur sa connexion.
+
+    La connexion est en autocommit : VACUUM ne peut pas tourner dans une
+    transaction.
+    """
+    with engine.connect().execution_options(
+        isolation_level="AUTOCOMMIT"
+    ) as connection:
+        connection.execute(
+            text(f"SET maintenance_work_mem = '{maintenance_mb}MB'")
+        )
+        with metrics.timed(stage, label):
+            connection.execute(text(statement))
+
+
+def build_indexes(engine, statements, workers=4,
+                  maintenance_mb=MAINTENANCE_MB, stage="indexes"):
+    """
+    Construit des index en parallèle, un par connexion.
+
+    Plusieurs CREATE INDEX sur une même table peuvent tourner en même
+    temps : chacun ne prend qu'un verrou SHARE, qui bloque les écritures
+    mais pas les autres constructions.
+
+    Args:
+        engine (Engine): L'engine de connexion à la base de données.
+        statements (list): Les requêtes CREATE INDEX.
+        workers (int): Le nombre de constructions simultanées.
+        maintenance_mb (int): La mémoire de tri de chaque construction.
+        stage (str): Le nom de l'étape pour les mesures.
+    """
+    if not statements:
+        return
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = []
+        for statement in statements:
+            label = statement.split(" ON ")[0].split()[-1]
+            futures.append(executor.submit(
+                run_statement, engine, stage, label, statement, maintenance_mb
+            ))
+        for future in futures:
+            future.result()
+
+
+def analyze_tables(engine, tables, workers=4, stage="indexes"):
+    """
+    Met à jour les statistiques du planificateur, une table par connexion.
+
+    VACUUM (ANALYZE) remplit aussi la carte de visibilité d'une table
+    fraîchement chargée : sans elle, les index ne servent pas de parcours
+    d'index seul (index-only scan).
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(
+                run_statement, engine, stage, f"analyze_{table}",
+                f"VACUUM (ANALYZE) {table}", MAINTENANCE_MB,
+            )
+            for table in tables
+        ]
+        for future in futures:
+            future.result()
+
+
+def index_tables(engine, plan, workers=4, maintenance_mb=MAINTENANCE_MB,
+                 stage="indexes"):
+    """
+    Crée les index d'un plan en parallèle, puis analyse les tables.
+
+    Args:
+        engine (Engine): L'engine de connexion à la base de données.
+        plan (dict): Table -> suffixes d'index à créer (voir INDEXES) ;
+            une liste vide se contente d'un VACUUM (ANALYZE).
+        workers (int): Le nombre de requêtes simultanées.
+        maintenance_mb (int): La mémoire de tri de chaque construction.
+        stage (str): Le nom de l'étape pour les mesures.
+
+    Returns:
+        bool: True si tous les index et statistiques sont à jour.
+    """
+    statements = [
+        index_statement(table, suffix)
+        for table, suffixes in plan.items() for suffix in suffixes
+    ]
+    try:
+        if statements:
+            print(f"\nConstruction de {len(statements)} index "
+                  f"({workers} en parallèle)...")
+        build_indexes(engine, statements, workers, maintenance_mb, stage)
+        print(f"\nAnalyse de {len(plan)} table(s)...")
+        analyze_tables(engine, list(plan), workers, stage)
+        print("Index et statistiques à jour")
+        return True
+    except Exception as e:
+        print(f"Erreur lors de la création des index : {str(e)}")
+        return False
+
+
+if __name__ == "__main__":
+    from database import get_engine
+
+    parser = argparse.ArgumentParser(
+        description="Crée les index d'une table puis lance VACUUM (ANALYZE)"
+    )
+    parser.add_argument("tables", nargs="+", help="tables à indexer")
+    parser.add_argument(
+        "--index", nargs="+", choices=sorted(INDEXES),
+        default=["event_time_brin", "product_id"],
+        help="index à créer (défaut : event_time_brin product_id)"
+    )
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    index_tables(
+        get_engine(), {table: args.index for table in args.tables},
+        args.workers,
+    )
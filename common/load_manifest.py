@@ -0,0 +1,256 @@
+import hashlib
+import os
+import pandas as pd
+from sqlalchemy import text, inspect
+from compressed_input import open_input, csv_columns
+from schemas import read_csv_chunks, chunk_rows
+from row_counts import ensure_row_counts, count_checkpoint
+
+HASH_BLOCK_SIZE = 16 * 1024 * 1024
+
+# Décisions renvoyées par plan_load
+SKIP = "skip"
+RESUME = "resume"
+LOAD = "load"
+
+
+def table_exists(engine, table_name):
+    inspector = inspect(engine)
+    return table_name in (
+        inspector.get_table_names() + inspector.get_view_names()
+    )
+
+
+def ensure_manifest(engine):
+    """Crée les tables load_manifest et row_counts si elles n'existent pas"""
+    with engine.begin() as connection:
+        ensure_row_counts(connection)
+        connection.execute(text("""
+        CREATE TABLE IF NOT EXISTS load_manifest (
+            file_path TEXT PRIMARY KEY,
+            table_name TEXT NOT NULL,
+            file_size BIGINT NOT NULL,
+            file_mtime DOUBLE PRECISION NOT NULL,
+            content_hash TEXT NOT NULL,
+            chunks_done INTEGER NOT NULL DEFAULT 0,
+            rows_loaded BIGINT NOT NULL DEFAULT 0,
+            completed BOOLEAN NOT NULL DEFAULT FALSE,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+        """))
+
+
+def file_hash(file_path):
+    """Calcule l'empreinte BLAKE2 du contenu d'un fichier"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(file_path, "rb") as f:
+        while block := f.read(HASH_BLOCK_SIZE):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def plan_load(engine, file_path, table_name):
+    """
+    Décide comment charger un fichier d'après le manifeste.
+
+    Un fichier dont la taille et la date de modification n'ont pas changé
+    est reconnu sans être relu. Si seule la date a changé, l'empreinte du
+    contenu est recalculée pour confirmer. Un fichier nouveau ou modifié,
+    ou dont la table a été supprimée, est (re)chargé depuis le début.
+
+    Args:
+        engine (Engine): L'engine de connexion à la base de données.
+        file_path (str): Le chemin du fichier CSV.
+        table_name (str): La table cible.
+
+    Returns:
+        tuple: (SKIP, RESUME ou LOAD, nombre de lignes déjà chargées)
+    """
+    ensure_manifest(engine)
+    stat = os.stat(file_path)
+
+    with engine.begin() as connection:
+        entry = connection.execute(
+            text("SELECT * FROM load_manifest WHERE file_path = :path"),
+            {"path": file_path},
+        ).fetchone()
+
+        # Table chargée avant l'introduction du manifeste
+        loaded = table_exists(engine, table_name)
+        if entry is None and loaded:
+            return SKIP, 0
+
+        # Une table supprimée depuis le chargement est rechargée, même si
+        # le fichier n'a pas changé
+        content_hash = None
+        unchanged = (
+            entry is not None
+            and loaded
+            and entry.file_size == stat.st_size
+            and entry.file_mtime == stat.st_mtime
+        )
+        if (not unchanged and entry is not None and loaded
+                and entry.file_size == stat.st_size):
+            content_hash = file_hash(file_path)
+            if content_hash == entry.content_hash:
+                connection.execute(
+                    text("UPDATE load_manifest SET file_mtime = :mtime "
+                         "WHERE file_path = :path"),
+                    {"mtime": stat.st_mtime, "path": file_path},
+                )
+                unchanged = True
+
+        if unchanged:
+            if entry.completed:
+                return SKIP, entry.rows_loaded
+            return RESUME, entry.rows_loaded
+
+        connection.execute(text("""
+        INSERT INTO load_manifest
+            (file_path, table_name, file_size, file_mtime, content_hash)
+        VALUES (:path, :table, :size, :mtime, :hash)
+        ON CONFLICT (file_path) DO UPDATE SET
+            table_name = EXCLUDED.table_name,
+            file_size = EXCLUDED.file_size,
+            file_mtime = EXCLUDED.file_mtime,
+            content_hash = EXCLUDED.content_hash,
+            chunks_done = 0,
+            rows_loaded = 0,
+            completed = FALSE,
+            updated_at = now()
+        """), {
+            "path": file_path,
+            "table": table_name,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "hash": content_hash or file_hash(file_path),
+        })
+
+    return LOAD, 0
+
+
+def checkpoint(file_path, rows_done=0, table_name=None, table_rows=None):
+    """
+    Crée le callback de point de reprise à passer à bulk_load.
+
+    La mise à jour du manifeste est exécutée dans la transaction du chunk,
+    donc le nombre de lignes enregistré correspond toujours aux lignes
+    réellement validées. Le manifeste compte les lignes lues dans le
+    fichier (la position de reprise), y compris celles retirées par un
+    filtre avant le chargement.
+
+    Args:
+        file_path (str): Le chemin du fichier CSV.
+        rows_done (int): Les lignes du fichier déjà traitées avant cette
+            exécution.
+        table_name (str): Si fourni, la table chargée : son compte dans
+            row_counts est tenu à jour dans la même transaction.
+        table_rows (int): Les lignes déjà présentes dans la table
+            (rows_done par défaut, s'il n'y a pas de filtre).
+
+    Returns:
+        callable: Le callback (curseur, lignes chargées, lignes lues).
+    """
+    if table_rows is None:
+        table_rows = rows_done
+
+    def update(cursor, rows_loaded, rows_read):
+        cursor.execute(
+            "UPDATE load_manifest SET rows_loaded = %s, "
+            "chunks_done = chunks_done + 1, updated_at = now() "
+            "WHERE file_path = %s",
+            (rows_done + rows_read, file_path),
+        )
+        if table_name is not None:
+            count_checkpoint(cursor, table_name, table_rows + rows_loaded)
+    return update
+
+
+def mark_completed(engine, file_path, rows_read=None):
+    """
+    Marque le chargement d'un fichier comme terminé.
+
+    rows_read met aussi à jour le nombre de lignes lues, pour un fichier
+    chargé sans point de reprise.
+    """
+    with engine.begin() as connection:
+        connection.execute(
+            text("UPDATE load_manifest SET completed = TRUE, "
+                 "rows_loaded = COALESCE(:rows, rows_loaded), "
+                 "updated_at = now() WHERE file_path = :path"),
+            {"path": file_path, "rows": rows_read},
+        )
+
+
+def completed_tables(connection, tables):
+    """
+    Garde, parmi `tables`, celles dont le chargement est terminé.
+
+    Une table dont le fichier a une entrée non terminée dans le manifeste
+    (chargement en cours, interrompu ou en échec) est écartée : ses lignes
+    sont partielles. Une table sans entrée a été chargée avant
+    l'introduction du manifeste, et est gardée comme le fait plan_load.
+
+    Args:
+        connection (Connection): La connexion à la base de données.
+        tables (list): Les tables à filtrer.
+
+    Returns:
+        list: Les tables complètes, dans l'ordre de `tables`.
+    """
+    if not connection.execute(
+        text("SELECT to_regclass('load_manifest') IS NOT NULL")
+    ).scalar():
+        return list(tables)
+    unfinished = {
+        row[0] for row in connection.execute(text(
+            "SELECT table_name FROM load_manifest "
+            "GROUP BY table_name HAVING NOT bool_and(completed)"
+        ))
+    }
+    return [table for table in tables if table not in unfinished]
+
+
+def read_csv_from(file_path, rows_done, chunksize, schema=None):
+    """
+    Lit un CSV par chunks à partir de la ligne de données `rows_done`.
+
+    Le début du fichier n'est pas reparsé : la lecture reprend directement
+    à la position en octets de la ligne. Un CSV compressé est décompressé
+    par un thread, qui saute les lignes déjà chargées sans les parser.
+
+    Args:
+        file_path (str): Le chemin du fichier CSV (.csv, .csv.gz,
+            .csv.zst ou .csv.bz2).
+        rows_done (int): Le nombre de lignes déjà chargées.
+        chunksize (int ou callable): La taille des chunks, ou une fonction
+            qui la donne avant chaque chunk (lecture Arrow seulement ; sans
+            schéma, la taille de départ est gardée).
+        schema (dict): Si fourni, le schéma des colonnes : le fichier est
+            alors lu avec le parseur Arrow et des dtypes compacts.
+
+    Yields:
+        DataFrame: Les chunks restants.
+    """
+    if rows_done == 0:
+        if schema is not None:
+            yield from read_csv_chunks(file_path, schema, chunksize)
+        else:
+            with open_input(file_path) as f:
+                yield from pd.read_csv(f, chunksize=chunk_rows(chunksize))
+        return
+
+    columns = csv_columns(file_path)
+    with open_input(file_path, rows_done) as f:
+        # Toutes les lignes sont déjà chargées
+        if not f.peek(1):
+            return
+        if schema is not None:
+            yield from read_csv_chunks(
+                f, schema, chunksize, column_names=columns
+            )
+        else:
+            yield from pd.read_csv(
+                f, chunksize=chunk_rows(chunksize), header=None,
+                names=columns,
+            )
@@ -0,0 +1,372 @@
+import os
+import json
+import time
+import resource
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from sqlalchemy import text
+
+# Dossier des fichiers exportés (JSON et textfile Prometheus)
+METRICS_DIR = os.getenv("METRICS_DIR", "metrics")
+# Avec METRICS_EXPLAIN=1, les requêtes instrumentées passent par
+# EXPLAIN ANALYZE pour obtenir le temps mesuré par le serveur
+EXPLAIN = os.getenv("METRICS_EXPLAIN", "0") == "1"
+PREFIX = "piscineds"
+
+_lock = threading.Lock()
+_stages = {}
+_statements = []
+# Cumul des requêtes par (étape, requête) : une série Prometheus par
+# couple, même si la requête est répétée (lectures de mesure, --watch)
+_statement_totals = {}
+_overlaps = {}
+
+
+def peak_rss_bytes():
+    """Pic de mémoire résidente du processus (ru_maxrss est en Ko)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def current_rss_bytes():
+    """Mémoire résidente actuelle du processus (pic si /proc est absent)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return peak_rss_bytes()
+
+
+def _stage(name):
+    if name not in _stages:
+        _stages[name] = {
+            "rows": 0,
+            "chunks": 0,
+            "bytes_read": 0,
+            "bytes_sent": 0,
+            "parse_seconds": 0.0,
+            "serialize_seconds": 0.0,
+            "copy_seconds": 0.0,
+            "chunk_log": [],
+        }
+    return _stages[name]
+
+
+def record_chunk(stage, rows, parse_seconds, serialize_seconds,
+                 copy_seconds, bytes_sent):
+    """
+    Enregistre les mesures d'un chunk chargé.
+
+    Args:
+        stage (str): L'étape (la table chargée).
+        rows (int): Les lignes du chunk.
+        parse_seconds (float): Le temps passé à produire le chunk
+            (lecture, parsing, conversions).
+        serialize_seconds (float): Le temps de mise au format COPY.
+        copy_seconds (float): Le temps du COPY et du commit, réseau et
+            PostgreSQL compris.
+        bytes_sent (int): La taille des données envoyées.
+    """
+    with _lock:
+        s = _stage(stage)
+        s["rows"] += rows
+        s["chunks"] += 1
+        s["bytes_sent"] += bytes_sent
+        s["parse_seconds"] += parse_seconds
+        s["serialize_seconds"] += serialize_seconds
+        s["copy_seconds"] += copy_seconds
+        elapsed = parse_seconds + serialize_seconds + copy_seconds
+        s["chunk_log"].append({
+            "rows": rows,
+            "parse_seconds": round(parse_seconds, 4),
+            "serialize_seconds": round(serialize_seconds, 4),
+            "copy_seconds": round(copy_seconds, 4),
+            "bytes_sent": bytes_sent,
+            "rows_per_second": round(rows / elapsed) if elapsed else None,
+            "peak_rss_bytes": peak_rss_bytes(),
+        })
+
+
+def record_overlap(stage, overlap):
+    """Enregistre le rapport de recouvrement d'un chargement en flux"""
+    with _lock:
+        _overlaps[stage] = dict(overlap)
+
+
+def record_bytes_read(stage, size):
+    """Ajoute les octets lus depuis le fichier source d'une étape"""
+    with _lock:
+        _stage(stage)["bytes_read"] += size
+
+
+def _add_statement(entry):
+    """Ajoute une requête mesurée au journal et aux cumuls (sous _lock)"""
+    _statements.append(entry)
+    key = (entry["stage"], entry["statement"])
+    totals = _statement_totals.setdefault(key, {
+        "stage": entry["stage"], "statement": entry["statement"],
+        "count": 0, "seconds": 0.0,
+        "server_count": 0, "server_seconds": 0.0,
+    })
+    totals["count"] += 1
+    totals["seconds"] += entry["seconds"]
+    if "server_seconds" in entry:
+        totals["server_count"] += 1
+        totals["server_seconds"] += entry["server_seconds"]
+
+
+def plan_rows(plan):
+    """Lignes produites par un plan ; pour INSERT, celles du nœud enfant"""
+    if plan.get("Node Type") == "ModifyTable" and plan.get("Plans"):
+        child = plan["Plans"][0]
+        return child.get("Actual Rows", 0) * child.get("Actual Loops", 1)
+    return plan.get("Actual Rows")
+
+
+def explain_analyze(connection, statement, params=None):
+    """
+    Exécute une requête sous EXPLAIN ANALYZE.
+
+    La requête est réellement exécutée (tables créées, lignes insérées).
+
+    Returns:
+        dict: Les temps serveur en secondes et les compteurs du plan.
+    """
+    result = connection.execute(
+        text(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {statement}"),
+        params or {},
+    ).scalar()
+    report = result[0] if isinstance(result, list) else json.loads(result)[0]
+    plan = report["Plan"]
+    return {
+        "server_seconds": report["Execution Time"] / 1000,
+        "planning_seconds": report["Planning Time"] / 1000,
+        "rows": plan_rows(plan),
+        "shared_hit_blocks": plan.get("Shared Hit Blocks"),
+        "shared_read_blocks": plan.get("Shared Read Blocks"),
+        "temp_written_blocks": plan.get("Temp Written Blocks"),
+    }
+
+
+def execute_timed(connection, stage, label, statement, params=None):
+    """
+    Exécute une requête SQL qui ne renvoie pas de lignes en mesurant sa
+    durée.
+
+    La durée est mesurée côté client (réseau compris) ; avec
+    METRICS_EXPLAIN=1, la requête passe par EXPLAIN ANALYZE et le temps
+    d'exécution mesuré par PostgreSQL est ajouté. Réservé aux requêtes
+    lourdes (CREATE TABLE AS, INSERT ... SELECT) : les SELECT se mesurent
+    avec timed().
+
+    Args:
+        connection (Connection): La connexion à la base de données.
+        stage (str): L'étape (par exemple "fusion").
+        label (str): Le nom court de la requête.
+        statement (str): La requête.
+        params (dict): Les paramètres liés.
+
+    Returns:
+        int: Le nombre de lignes écrites (None si inconnu).
+    """
+    entry = {"stage": stage, "statement": label}
+    start = time.perf_counter()
+    if EXPLAIN:
+        entry.update(explain_analyze(connection, statement, params))
+    else:
+        result = connection.execute(text(statement), params or {})
+        entry["rows"] = result.rowcount if result.rowcount >= 0 else None
+    entry["seconds"] = time.perf_counter() - start
+
+    with _lock:
+        _add_statement(entry)
+    return entry["rows"]
+
+
+@contextmanager
+def timed(stage, label):
+    """Mesure un bloc de code comme une requête (durée côté client)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        with _lock:
+            _add_statement({
+                "stage": stage,
+                "statement": label,
+                "seconds": time.perf_counter() - start,
+            })
+
+
+def snapshot():
+    """Copie des mesures du processus, pour les renvoyer au parent"""
+    with _lock:
+        return json.loads(json.dumps({
+            "stages": _stages, "statements": _statements,
+            "overlaps": _overlaps,
+        }))
+
+
+def merge(data):
+    """Ajoute les mesures d'un processus worker à celles du processus"""
+    with _lock:
+        for name, values in data["stages"].items():
+            s = _stage(name)
+            for key, value in values.items():
+                if key == "chunk_log":
+                    s[key].extend(value)
+                else:
+                    s[key] += value
+        for entry in data["statements"]:
+            _add_statement(entry)
+        _overlaps.update(data["overlaps"])
+
+
+def report(job):
+    """
+    Construit le rapport structuré du processus.
+
+    Returns:
+        dict: Les mesures par étape et par requête.
+    """
+    with _lock:
+        stages = {}
+        for name, s in _stages.items():
+            elapsed = (s["parse_seconds"] + s["serialize_seconds"]
+                       + s["copy_seconds"])
+            stages[name] = dict(s)
+            stages[name]["rows_per_second"] = (
+                round(s["rows"] / elapsed) if elapsed else None
+            )
+        return {
+            "job": job,
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "peak_rss_bytes": peak_rss_bytes(),
+            "stages": stages,
+            "statements": list(_statements),
+            "statement_totals": [
+                dict(totals) for totals in _statement_totals.values()
+            ],
+            "overlaps": dict(_overlaps),
+        }
+
+
+def clear_logs():
+    """
+    Vide le journal des requêtes et des chunks, en gardant les cumuls.
+
+    À appeler après chaque export d'un processus qui tourne longtemps
+    (pipeline.py --watch) : la mémoire reste bornée, et chaque export ne
+    détaille que ce qui s'est passé depuis le précédent.
+    """
+    with _lock:
+        _statements.clear()
+        for s in _stages.values():
+            s["chunk_log"].clear()
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+
+def prometheus_text(data):
+    """Met un rapport au format texte de Prometheus"""
+    job = _label(data["job"])
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP {PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+        for labels, value, *suffix in samples:
+            label_text = ",".join(
+                [f'job="{job}"']
+                + [f'{key}="{_label(v)}"' for key, v in labels.items()]
+            )
+            series = f"{PREFIX}_{name}{''.join(suffix)}"
+            lines.append(f"{series}{{{label_text}}} {value}")
+
+    def summary(name, help_text, key, count_key):
+        # Une somme et un nombre par (étape, requête), sans quantiles
+        samples = []
+        for totals in data["statement_totals"]:
+            if not totals[count_key]:
+                continue
+            labels = {
+                "stage": totals["stage"], "statement": totals["statement"],
+            }
+            samples.append((labels, totals[key], "_sum"))
+            samples.append((labels, totals[count_key], "_count"))
+        metric(name, "summary", help_text, samples)
+
+    stages = data["stages"]
+    counters = [
+        ("rows", "Lignes chargées"),
+        ("chunks", "Chunks chargés"),
+        ("bytes_read", "Octets lus dans les fichiers sources"),
+        ("bytes_sent", "Octets envoyés par COPY"),
+        ("parse_seconds", "Temps de lecture et de parsing"),
+        ("serialize_seconds", "Temps de mise au format COPY"),
+        ("copy_seconds", "Temps du COPY côté base (réseau compris)"),
+    ]
+    for key, help_text in counters:
+        metric(f"stage_{key}_total", "counter", help_text, [
+            ({"stage": name}, s[key]) for name, s in stages.items()
+        ])
+    metric("stage_rows_per_second", "gauge", "Débit de chargement", [
+        ({"stage": name}, s["rows_per_second"])
+        for name, s in stages.items() if s["rows_per_second"] is not None
+    ])
+    metric("ingest_overlap_ratio", "gauge",
+           "Part du temps de lecture ou d'écriture cachée derrière l'autre", [
+               ({"stage": name}, o["overlap_ratio"])
+               for name, o in data["overlaps"].items()
+           ])
+    metric("ingest_queue_full_seconds", "gauge",
+           "Temps d'attente du lecteur sur la file pleine", [
+               ({"stage": name}, o["queue_full_seconds"])
+               for name, o in data["overlaps"].items()
+           ])
+    metric("ingest_queue_empty_seconds", "gauge",
+           "Temps d'attente des écrivains sur la file vide", [
+               ({"stage": name}, o["queue_empty_seconds"])
+               for name, o in data["overlaps"].items()
+           ])
+    summary("sql_statement_seconds", "Durée des requêtes vue du client",
+            "seconds", "count")
+    summary("sql_statement_server_seconds",
+            "Durée des requêtes mesurée par EXPLAIN ANALYZE",
+            "server_seconds", "server_count")
+    metric("peak_rss_bytes", "gauge", "Pic de mémoire résidente du client",
+           [({}, data["peak_rss_bytes"])])
+    return "\n".join(lines) + "\n"
+
+
+def _write_atomic(path, content):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def export_metrics(job, directory=None):
+    """
+    Écrit les mesures du processus en JSON et en textfile Prometheus.
+
+    Les fichiers <job>.json et <job>.prom sont remplacés de façon atomique,
+    comme l'attend le collecteur textfile de node_exporter.
+
+    Args:
+        job (str): Le nom du script (par exemple "fusion").
+        directory (str): Le dossier de sortie (METRICS_DIR par défaut).
+
+    Returns:
+        dict: Le rapport écrit.
+    """
+    directory = directory or METRICS_DIR
+    os.makedirs(directory, exist_ok=True)
+    data = report(job)
+    _write_atomic(
+        os.path.join(directory, f"{job}.json"), json.dumps(data, indent=2)
+    )
+    _write_atomic(os.path.join(directory, f"{job}.prom"), prometheus_text(data))
+    return data
@@ -0,0 +1,137 @@
+import re
+from sqlalchemy import text
+
+MONTHS = {
+    "jan": 1, "feb": 2, "mar": 3, "apr": 4, "may": 5, "jun": 6,
+    "jul": 7, "aug": 8, "sep": 9, "oct": 10, "nov": 11, "dec": 12,
+}
+# Nom d'une table mensuelle : data_2022_oct
+MONTHLY_TABLE = re.compile(rf"data_(\d{{4}})_({'|'.join(MONTHS)})")
+
+
+def month_bounds(table_name):
+    """
+    Calcule les bornes d'une table mensuelle d'après son nom.
+
+    Args:
+        table_name (str): Un nom de la forme data_2022_oct.
+
+    Returns:
+        tuple: (début inclus, fin exclue) en UTC, au format texte.
+    """
+    match = MONTHLY_TABLE.fullmatch(table_name)
+    if match is None:
+        raise ValueError(f"Nom de table mensuelle invalide : {table_name}")
+
+    year, month = int(match.group(1)), MONTHS[match.group(2)]
+    next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return (
+        f"{year:04d}-{month:02d}-01 00:00:00+00",
+        f"{next_year:04d}-{next_month:02d}-01 00:00:00+00",
+    )
+
+
+def monthly_tables(connection):
+    """
+    Liste les tables mensuelles data_YYYY_mon de la base, dans l'ordre
+    des mois.
+    """
+    result = connection.execute(text("""
+    SELECT table_name FROM information_schema.tables
+    WHERE table_schema = 'public' AND table_type = 'BASE TABLE'
+    """))
+    tables = [row[0] for row in result if MONTHLY_TABLE.fullmatch(row[0])]
+    return sorted(tables, key=month_bounds)
+
+
+def is_partitioned(connection, table_name):
+    """Indique si une table est une table partitionnée"""
+    return connection.execute(text("""
+    SELECT EXISTS (
+        SELECT 1 FROM pg_partitioned_table p
+        JOIN pg_class c ON c.oid = p.partrelid
+        WHERE c.relname = :name
+    )
+    """), {"name": table_name}).scalar()
+
+
+def is_view(connection, table_name):
+    """Indique si une relation est une vue"""
+    return connection.execute(text("""
+    SELECT EXISTS (
+        SELECT 1 FROM pg_views
+        WHERE schemaname = 'public' AND viewname = :name
+    )
+    """), {"name": table_name}).scalar()
+
+
+def list_partitions(connection, parent):
+    """Liste les partitions attachées à une table"""
+    result = connection.execute(text("""
+    SELECT c.relname FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    JOIN pg_class p ON p.oid = i.inhparent
+    WHERE p.relname = :parent
+    ORDER BY c.relname
+    """), {"parent": parent})
+    return [row[0] for row in result]
+
+
+def create_partitioned_table(connection, parent, template):
+    """Crée une table partitionnée par mois sur event_time"""
+    connection.execute(text(
+        f"CREATE TABLE {parent} (LIKE {template}) "
+        "PARTITION BY RANGE (event_time)"
+    ))
+
+
+def attach_month(connection, parent, table_name):
+    """
+    Attache une table mensuelle comme partition, sans copier ses lignes.
+
+    Une contrainte CHECK sur le mois est ajoutée à la table (une seule
+    lecture, la première fois) et conservée : PostgreSQL s'en sert pour
+    éviter de revalider la table lors de l'ATTACH, qui devient une simple
+    opération sur le catalogue.
+
+    Args:
+        connection (Connection): La connexion à la base de données.
+        parent (str): La table partitionnée.
+        table_name (str): La table mensuelle à attacher.
+    """
+    start, end = month_bounds(table_name)
+    constraint = f"{table_name}_month_check"
+
+    exists = connection.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = :name)"
+    ), {"name": constraint}).scalar()
+    if not exists:
+        connection.execute(text(
+            f"ALTER TABLE {table_name} ADD CONSTRAINT {constraint} "
+            f"CHECK (event_time IS NOT NULL AND event_time >= '{start}' "
+            f"AND event_time < '{end}')"
+        ))
+
+    connection.execute(text(
+        f"ALTER TABLE {parent} ATTACH PARTITION {table_name} "
+        f"FOR VALUES FROM ('{start}') TO ('{end}')"
+    ))
+
+
+def drop_table(connection, table_name):
+    """
+    Supprime une table sans emporter ses partitions.
+
+    Les tables mensuelles attachées sont détachées avant le DROP pour
+    qu'elles restent disponibles. Une vue (customers compacte, voir
+    compact_storage) est supprimée sans sa table compacte.
+    """
+    if is_view(connection, table_name):
+        connection.execute(text(f"DROP VIEW {table_name}"))
+        return
+    if is_partitioned(connection, table_name):
+        for partition in list_partitions(connection, table_name):
+            connection.execute(text(
+                f"ALTER TABLE {table_name} DETACH PARTITION {partition}"
+            ))
+    connection.execute(text(f"DROP TABLE IF EXISTS {table_name}"))
@@ -0,0 +1,157 @@
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from schemas import ITEM_SCHEMA, sql_dtypes
+
+# Colonnes ajoutées aux événements par l'enrichissement
+ITEM_COLUMNS = ["category_id", "category_code", "brand"]
+
+# Types SQL des colonnes ajoutées, comme dans la table items
+ITEM_DTYPES = {
+    column: sql_type for column, sql_type in sql_dtypes(ITEM_SCHEMA).items()
+    if column in ITEM_COLUMNS
+}
+
+# Colonnes dont les valeurs renseignées départagent les lignes d'un même
+# produit
+SCORE_COLUMNS = ["category_code", "brand"]
+
+
+def merge_items(best, chunk, offset):
+    """
+    Fusionne un chunk d'items avec les meilleures lignes déjà retenues.
+
+    Pour chaque product_id, la ligne gardée est celle qui a le plus de
+    valeurs renseignées parmi SCORE_COLUMNS ; à égalité, la première du
+    fichier. Le choix ne dépend donc ni de la taille des chunks ni de
+    l'ordre de lecture de PostgreSQL. Les lignes sans product_id sont
+    ignorées.
+
+    Args:
+        best (DataFrame): Les lignes retenues jusqu'ici (None au début).
+        chunk (DataFrame): Le chunk suivant du fichier.
+        offset (int): La position dans le fichier de la première ligne
+            du chunk.
+
+    Returns:
+        DataFrame: Une ligne par product_id, triée par product_id.
+    """
+    chunk = chunk.assign(
+        _score=chunk[SCORE_COLUMNS].notna().sum(axis=1),
+        _order=np.arange(offset, offset + len(chunk)),
+    ).dropna(subset=["product_id"])
+    merged = chunk if best is None else pd.concat(
+        [best, chunk], ignore_index=True
+    )
+    merged = merged.sort_values(
+        ["product_id", "_score", "_order"],
+        ascending=[True, False, True], kind="stable",
+    )
+    return merged.drop_duplicates("product_id", ignore_index=True)
+
+
+def unique_items(chunks):
+    """
+    Réduit un flux de chunks items à une ligne par product_id.
+
+    Seules les lignes retenues restent en mémoire : au plus une par
+    produit, plus le chunk en cours.
+
+    Returns:
+        tuple: (DataFrame des items uniques triés par product_id,
+            nombre de lignes lues)
+    """
+    best = None
+    rows_read = 0
+    for chunk in chunks:
+        best = merge_items(best, chunk, rows_read)
+        rows_read += len(chunk)
+    if best is None:
+        return None, 0
+    return best.drop(columns=["_score", "_order"]), rows_read
+
+
+def build_product_cache(items):
+    """
+    Construit la dimension produits compacte à partir d'un DataFrame items.
+
+    Une seule ligne est gardée par product_id (la première rencontrée,
+    comme un DISTINCT ON). Les identifiants sont triés dans un tableau
+    NumPy et les textes stockés en catégories, donc la dimension tient en
+    quelques octets par produit.
+
+    Args:
+        items (DataFrame): Les colonnes product_id, category_id,
+            category_code et brand.
+
+    Returns:
+        dict: product_id (tableau int64 trié) et une colonne alignée par
+            attribut d'item.
+    """
+    items = items.dropna(subset=["product_id"])
+    items = items.drop_duplicates("product_id").sort_values("product_id")
+
+    return {
+        "product_id": items["product_id"].to_numpy(dtype=np.int64),
+        "category_id": pd.array(items["category_id"], dtype="Int64"),
+        "category_code": pd.Categorical(items["category_code"]),
+        "brand": pd.Categorical(items["brand"]),
+    }
+
+
+def load_product_cache(engine, table_name="items"):
+    """Charge la dimension produits depuis la table items"""
+    query = text(
+        f"SELECT product_id, category_id, category_code, brand FROM {table_name}"
+    )
+    with engine.connect() as connection:
+        # Types nullables dès la lecture : un passage par float64
+        # arrondirait les category_id (entiers sur 19 chiffres)
+        items = pd.read_sql(query, connection, dtype_backend="numpy_nullable")
+    return build_product_cache(items)
+
+
+def has_unique_products(connection):
+    """Indique si items a une clé primaire ou un index unique sur product_id"""
+    return connection.execute(text("""
+    SELECT EXISTS (
+        SELECT 1 FROM pg_index i
+        JOIN pg_attribute a
+          ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+        WHERE i.indrelid = 'items'::regclass
+          AND i.indisunique AND i.indnatts = 1
+          AND a.attname = 'product_id'
+    )
+    """)).scalar()
+
+
+def enrich_chunk(chunk, cache):
+    """
+    Ajoute category_id, category_code et brand à un chunk d'événements.
+
+    La jointure est faite par recherche dichotomique vectorisée
+    (searchsorted) sur les product_id triés. Les produits absents de la
+    dimension reçoivent des valeurs nulles, comme avec un LEFT JOIN.
+
+    Args:
+        chunk (DataFrame): Les événements, avec une colonne product_id.
+        cache (dict): La dimension construite par build_product_cache.
+
+    Returns:
+        DataFrame: Le chunk enrichi.
+    """
+    product_ids = cache["product_id"]
+    wanted = pd.to_numeric(chunk["product_id"]).fillna(-1).to_numpy(np.int64)
+
+    positions = np.searchsorted(product_ids, wanted)
+    if len(product_ids) == 0:
+        positions = np.full(len(wanted), -1)
+    else:
+        clipped = np.minimum(positions, len(product_ids) - 1)
+        found = (positions < len(product_ids)) & (product_ids[clipped] == wanted)
+        positions = np.where(found, clipped, -1)
+
+    for column in ITEM_COLUMNS:
+        values = cache[column].take(positions, allow_fill=True)
+        chunk[column] = pd.Series(values, index=chunk.index)
+    return chunk
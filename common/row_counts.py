@@ -0,0 +1,129 @@
+from sqlalchemy import text
+
+# Requête d'enregistrement d'un compte, au format de paramètres du pilote
+# pour servir aussi bien sur une connexion que sur un curseur brut (COPY)
+UPSERT_COUNT = """
+INSERT INTO row_counts (table_oid, table_name, row_count)
+VALUES (CAST(%(table)s AS regclass), %(table)s, %(rows)s)
+ON CONFLICT (table_oid) DO UPDATE SET
+    table_name = EXCLUDED.table_name,
+    row_count = EXCLUDED.row_count,
+    version = row_counts.version + 1,
+    updated_at = now()
+"""
+
+
+def ensure_row_counts(connection):
+    """
+    Crée la table row_counts si elle n'existe pas, oublie les tables
+    supprimées depuis et met à jour les noms des tables renommées.
+
+    Le catalogue est indexé par l'OID des tables : un renommage conserve
+    le compte, et une table supprimée puis recréée n'hérite pas de
+    l'ancien.
+    """
+    connection.execute(text("""
+    CREATE TABLE IF NOT EXISTS row_counts (
+        table_oid OID PRIMARY KEY,
+        table_name TEXT NOT NULL,
+        row_count BIGINT NOT NULL,
+        version BIGINT NOT NULL DEFAULT 1,
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    )
+    """))
+    connection.execute(text(
+        "DELETE FROM row_counts "
+        "WHERE table_oid NOT IN (SELECT oid FROM pg_class)"
+    ))
+    connection.execute(text("""
+    UPDATE row_counts r SET table_name = c.relname
+    FROM pg_class c
+    WHERE c.oid = r.table_oid AND c.relname <> r.table_name
+    """))
+
+
+def set_count(connection, table_name, rows):
+    """
+    Enregistre le nombre de lignes d'une table qui vient d'être écrite.
+
+    À appeler dans la transaction de l'écriture, pour que le compte et
+    les lignes soient validés ensemble. Chaque écriture incrémente la
+    version de la table ; le catalogue est remis à jour (tables
+    supprimées ou renommées) au même moment, pour que les lectures
+    n'aient rien à écrire.
+
+    Args:
+        connection (Connection): La connexion (dans la transaction).
+        table_name (str): La table écrite.
+        rows (int): Son nombre total de lignes.
+    """
+    ensure_row_counts(connection)
+    connection.exec_driver_sql(
+        UPSERT_COUNT, {"table": table_name, "rows": rows}
+    )
+
+
+def count_checkpoint(cursor, table_name, rows):
+    """Comme set_count, sur le curseur brut d'un chunk chargé avec COPY"""
+    cursor.execute(UPSERT_COUNT, {"table": table_name, "rows": rows})
+
+
+def add_count(connection, table_name, rows):
+    """
+    Ajoute des lignes insérées au compte d'une table.
+
+    Sans compte connu pour la table, rien n'est enregistré : get_count
+    comptera la table réellement.
+    """
+    connection.execute(text("""
+    UPDATE row_counts SET
+        table_name = :table,
+        row_count = row_count + :rows,
+        version = version + 1,
+        updated_at = now()
+    WHERE table_oid = CAST(:table AS regclass)
+    """), {"table": table_name, "rows": rows})
+
+
+def get_count(connection, table_name, exact=False):
+    """
+    Renvoie le nombre de lignes d'une table.
+
+    Le compte est lu dans le catalogue, sans parcourir la table. Il est
+    calculé avec COUNT(*) si la table n'y figure pas ou si exact est
+    demandé ; un écart avec le catalogue est alors signalé. La lecture
+    n'écrit rien : elle ne touche pas à la transaction de l'appelant, et
+    le catalogue n'est mis à jour que par les écritures (set_count).
+
+    Args:
+        connection (Connection): La connexion à la base de données.
+        table_name (str): La table.
+        exact (bool): Forcer un vrai COUNT(*), pour les audits.
+
+    Returns:
+        int: Le nombre de lignes.
+    """
+    recorded = None
+    if connection.execute(
+        text("SELECT to_regclass('row_counts') IS NOT NULL")
+    ).scalar():
+        recorded = connection.execute(text(
+            "SELECT row_count FROM row_counts "
+            "WHERE table_oid = CAST(:table AS regclass)"
+        ), {"table": table_name}).scalar()
+    if recorded is not None and not exact:
+        return recorded
+
+    rows = connection.execute(
+        text(f"SELECT COUNT(*) FROM {table_name}")
+    ).scalar()
+    if recorded is not None and recorded != rows:
+        print(f"⚠️ Compte de {table_name} différent du catalogue : "
+              f"{recorded:,} enregistrées, {rows:,} comptées")
+    return rows
+
+
+def record_count(engine, table_name, rows):
+    """Enregistre le compte d'une table dans sa propre transaction"""
+    with engine.begin() as connection:
+        set_count(connection, table_name, rows)
@@ -0,0 +1,221 @@
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+from sqlalchemy.types import DateTime, String, Integer, Numeric, UUID, \
+    BigInteger, Text
+from sqlalchemy.dialects import postgresql
+from compressed_input import compression_of, open_input
+
+# Chaque colonne est déclarée des deux côtés :
+# (type Arrow lu dans le CSV, dtype pandas en mémoire, type SQL de la table)
+EVENT_SCHEMA = {
+    "event_time": (
+        pa.timestamp("us", tz="UTC"),
+        pd.DatetimeTZDtype("us", "UTC"),
+        DateTime(timezone=True),
+    ),
+    "event_type": (
+        pa.dictionary(pa.int32(), pa.string()),
+        pd.CategoricalDtype(),
+        String,
+    ),
+    "product_id": (pa.int32(), pd.Int32Dtype(), Integer),
+    "price": (
+        pa.decimal128(10, 2),
+        pd.ArrowDtype(pa.decimal128(10, 2)),
+        Numeric(10, 2),
+    ),
+    "user_id": (pa.int64(), pd.Int64Dtype(), BigInteger),
+    "user_session": (pa.string(), pd.StringDtype("pyarrow"), UUID),
+}
+
+ITEM_SCHEMA = {
+    "product_id": (pa.int32(), pd.Int32Dtype(), Integer),
+    "category_id": (pa.int64(), pd.Int64Dtype(), BigInteger),
+    "category_code": (
+        pa.dictionary(pa.int32(), pa.string()),
+        pd.CategoricalDtype(),
+        Text,
+    ),
+    "brand": (
+        pa.dictionary(pa.int32(), pa.string()),
+        pd.CategoricalDtype(),
+        String,
+    ),
+}
+
+# Taille des blocs lus par le parseur Arrow
+BLOCK_SIZE = 16 * 1024 * 1024
+# Les dates du sujet sont écrites "2022-10-01 00:00:00 UTC"
+TIMESTAMP_FORMATS = ["%Y-%m-%d %H:%M:%S UTC", "%Y-%m-%d %H:%M:%S"]
+
+
+def sql_dtypes(schema):
+    """Renvoie le dictionnaire des types SQL, à passer à to_sql / bulk_load"""
+    return {column: sql_type for column, (_, _, sql_type) in schema.items()}
+
+
+def sql_type_names(schema):
+    """
+    Renvoie les types SQL du schéma écrits en DDL (par exemple
+    "NUMERIC(10, 2)"), compris par PostgreSQL comme par DuckDB.
+    """
+    dialect = postgresql.dialect()
+    return {
+        column: (sql_type() if isinstance(sql_type, type) else sql_type)
+        .compile(dialect=dialect)
+        for column, sql_type in sql_dtypes(schema).items()
+    }
+
+
+def pandas_dtypes(schema):
+    """Renvoie le dictionnaire des dtypes pandas du schéma"""
+    return {column: dtype for column, (_, dtype, _) in schema.items()}
+
+
+def arrow_types(schema):
+    """
+    Renvoie les types Arrow à utiliser pour le parsing.
+
+    Les dates du CSV n'ont pas de décalage horaire numérique : elles sont
+    lues sans fuseau, puis marquées UTC par apply_timezones.
+    """
+    types = {}
+    for column, (arrow_type, _, _) in schema.items():
+        if pa.types.is_timestamp(arrow_type) and arrow_type.tz is not None:
+            arrow_type = pa.timestamp(arrow_type.unit)
+        types[column] = arrow_type
+    return types
+
+
+def apply_timezones(table, schema):
+    """Marque les dates lues sans fuseau avec le fuseau déclaré"""
+    for column, (arrow_type, _, _) in schema.items():
+        if column not in table.column_names:
+            continue
+        if not pa.types.is_timestamp(arrow_type) or arrow_type.tz is None:
+            continue
+        if table.schema.field(column).type.tz is None:
+            index = table.column_names.index(column)
+            values = pc.assume_timezone(table[column], arrow_type.tz)
+            table = table.set_column(index, column, values)
+    return table
+
+
+def to_frame(table, schema):
+    """
+    Convertit une table Arrow en DataFrame aux dtypes du schéma.
+
+    Args:
+        table (Table): Les lignes lues par Arrow.
+        schema (dict): Le schéma des colonnes.
+
+    Returns:
+        DataFrame: Les lignes, avec les dtypes pandas déclarés.
+    """
+    table = apply_timezones(table, schema)
+    mapping = {
+        arrow_type: dtype for arrow_type, dtype, _ in schema.values()
+        if not isinstance(dtype, (pd.CategoricalDtype, pd.DatetimeTZDtype))
+    }
+    return table.to_pandas(types_mapper=mapping.get)
+
+
+def open_csv(source, schema, column_names=None):
+    """
+    Ouvre un CSV avec le lecteur en flux d'Arrow, typé par le schéma.
+
+    Returns:
+        CSVStreamingReader: Le lecteur, qui renvoie des RecordBatch.
+    """
+    return pa_csv.open_csv(
+        source,
+        read_options=pa_csv.ReadOptions(
+            block_size=BLOCK_SIZE, column_names=column_names
+        ),
+        convert_options=pa_csv.ConvertOptions(
+            column_types=arrow_types(schema),
+            timestamp_parsers=TIMESTAMP_FORMATS,
+            strings_can_be_null=True,
+        ),
+    )
+
+
+def chunk_rows(chunksize):
+    """Taille du prochain chunk : un entier fixe ou une fonction"""
+    return chunksize() if callable(chunksize) else chunksize
+
+
+def rechunk(batches, chunksize):
+    """
+    Regroupe des RecordBatch en tables d'exactement `chunksize` lignes.
+
+    `chunksize` peut être une fonction, appelée avant chaque chunk : la
+    taille peut alors changer pendant la lecture (voir chunk_sizing).
+
+    Yields:
+        Table: Les tables, la dernière pouvant être plus courte.
+    """
+    pending = []
+    pending_rows = 0
+    size = chunk_rows(chunksize)
+    for batch in batches:
+        pending.append(batch)
+        pending_rows += batch.num_rows
+        while pending_rows >= size:
+            table = pa.Table.from_batches(pending)
+            yield table.slice(0, size)
+            pending = table.slice(size).to_batches()
+            pending_rows -= size
+            size = chunk_rows(chunksize)
+
+    if pending_rows:
+        yield pa.Table.from_batches(pending)
+
+
+def slice_frame(frame, chunksize):
+    """
+    Découpe un DataFrame en chunks de `chunksize` lignes (entier ou
+    fonction, comme pour rechunk).
+
+    Yields:
+        DataFrame: Les chunks, le dernier pouvant être plus court.
+    """
+    start = 0
+    while start < len(frame):
+        size = chunk_rows(chunksize)
+        yield frame.iloc[start:start + size].reset_index(drop=True)
+        start += size
+
+
+def read_csv_chunks(source, schema, chunksize=100000, column_names=None):
+    """
+    Lit un CSV par chunks typés avec le parseur multithreadé d'Arrow.
+
+    Les colonnes sont typées pendant le parsing (catégories, entiers,
+    dates, décimaux), sans passer par des objets Python. Les chunks ont
+    exactement `chunksize` lignes, sauf le dernier.
+
+    Args:
+        source (str ou fichier): Le chemin du CSV (éventuellement
+            compressé : .gz, .zst, .bz2) ou un fichier ouvert en binaire,
+            éventuellement positionné au milieu du fichier.
+        schema (dict): Le schéma des colonnes.
+        chunksize (int ou callable): Le nombre de lignes par chunk, ou
+            une fonction qui le donne avant chaque chunk.
+        column_names (list): Les noms des colonnes, si la lecture ne
+            commence pas à l'en-tête.
+
+    Yields:
+        DataFrame: Les chunks du fichier.
+    """
+    # Un CSV compressé est décompressé dans un thread (voir open_input)
+    if isinstance(source, str) and compression_of(source):
+        with open_input(source) as f:
+            yield from read_csv_chunks(f, schema, chunksize, column_names)
+        return
+
+    reader = open_csv(source, schema, column_names)
+    for table in rechunk(reader, chunksize):
+        yield to_frame(table, schema)
@@ -0,0 +1,149 @@
+EVENT_COLUMNS = [
+    "event_time", "event_type", "product_id", "price", "user_id", "user_session"
+]
+
+# Ce qui change d'un moteur SQL à l'autre dans les requêtes partagées :
+# le schéma des tables, et la colonne système qui suit l'ordre
+# d'insertion des lignes
+DIALECTS = {
+    "postgres": {"schema": "public", "row_order": "ctid"},
+    "duckdb": {"schema": "main", "row_order": "rowid"},
+}
+
+
+# Nombre de valeurs positives d'un hachage int4, pour répartir les shards
+HASH_RANGE = 2147483647
+
+
+def ranked_events(source, condition=None):
+    """
+    Sous-requête ranked_events : chaque événement de `source` avec l'heure
+    de l'événement identique précédent (prev_event_time).
+
+    Args:
+        source (str): La table des événements.
+        condition (str): Filtre SQL optionnel sur les lignes lues.
+    """
+    where = f"WHERE {condition}" if condition else ""
+    return f"""
+    ranked_events AS (
+        SELECT *,
+            LAG(event_time) OVER (
+                PARTITION BY event_type, product_id, price, user_id, user_session
+                ORDER BY event_time
+            ) as prev_event_time
+        FROM {source}
+        {where}
+    )"""
+
+
+# Un événement est gardé s'il n'a pas d'identique dans la seconde qui précède
+KEEP_EVENT = """
+        prev_event_time IS NULL
+        OR
+        EXTRACT(EPOCH FROM (event_time - prev_event_time)) > 1"""
+
+
+def dedup_query(source, target, columns=EVENT_COLUMNS):
+    """
+    Requête SQL de déduplication de `source` vers une nouvelle table `target`.
+
+    On considère comme doublons les événements qui ont:
+    1. Les mêmes valeurs pour TOUTES les colonnes
+    2. Se produisent dans un intervalle de 1 seconde
+
+    Les colonnes en plus des six colonnes d'événement (items ajoutés à
+    l'ingestion) sont recopiées telles quelles. La requête est la même
+    pour PostgreSQL et DuckDB.
+    """
+    return f"""
+    CREATE TABLE {target} AS
+    WITH {ranked_events(source)}
+    SELECT
+        {", ".join(columns)}
+    FROM ranked_events
+    WHERE {KEEP_EVENT};
+    """
+
+
+def shard_expression(shards):
+    """
+    Expression SQL (PostgreSQL) du shard d'une ligne, de 0 à shards - 1,
+    d'après le hachage de user_id.
+
+    Deux événements identiques ont le même user_id, donc le même shard :
+    chaque shard se déduplique sans regarder les autres. Les lignes sans
+    user_id vont toutes dans le shard 0.
+    """
+    return f"mod(COALESCE(hashint8(user_id), 0) & {HASH_RANGE}, {shards})"
+
+
+def dedup_shard_query(source, target, columns, shard, shards):
+    """
+    Requête qui déduplique un shard de `source` et ajoute ses lignes à la
+    table existante `target` ; plusieurs shards peuvent être écrits en
+    même temps, chacun sur sa connexion.
+    """
+    return f"""
+    INSERT INTO {target} ({", ".join(columns)})
+    WITH {ranked_events(source, f"{shard_expression(shards)} = {shard}")}
+    SELECT
+        {", ".join(columns)}
+    FROM ranked_events
+    WHERE {KEEP_EVENT}
+    """
+
+
+def items_unique_query(source, target, dialect):
+    """
+    Requête qui garde une ligne par product_id de `source` dans `target`.
+
+    La ligne gardée est la plus renseignée (category_code, brand), puis la
+    première insérée : la même règle que product_cache.merge_items.
+
+    Args:
+        source (str): La table des items, chargée telle quelle.
+        target (str): La table à créer.
+        dialect (dict): Le dialecte du moteur, parmi DIALECTS.
+    """
+    return f"""
+    CREATE TABLE {target} AS
+    SELECT DISTINCT ON (product_id)
+        product_id,
+        category_id,
+        category_code,
+        brand
+    FROM {source}
+    WHERE product_id IS NOT NULL
+    ORDER BY
+        product_id,
+        (category_code IS NOT NULL)::int
+            + (brand IS NOT NULL)::int DESC,
+        {dialect["row_order"]}
+    """
+
+
+def fusion_query(customers, items, target):
+    """
+    Requête qui ajoute à chaque événement les colonnes de son produit.
+
+    La jointure LEFT garde tous les événements, même sans produit
+    correspondant ; `items` doit avoir une seule ligne par product_id.
+    """
+    return f"""
+    CREATE TABLE {target} AS
+    SELECT
+        c.event_time,
+        c.event_type,
+        c.product_id,
+        c.price,
+        c.user_id,
+        c.user_session,
+        i.category_id,
+        i.category_code,
+        i.brand
+    FROM
+        {customers} c
+    LEFT JOIN
+        {items} i ON c.product_id = i.product_id
+    """
@@ -0,0 +1,162 @@
+import json
+import os
+import pyarrow.parquet as pq
+from load_manifest import file_hash
+from schemas import open_csv, apply_timezones, rechunk, to_frame, \
+    chunk_rows
+from compressed_input import csv_stem, open_input
+
+# Nombre de lignes par row group : une reprise saute les groupes entiers
+ROW_GROUP_SIZE = 100000
+STAGING_DIRNAME = ".staging"
+
+
+def staging_paths(csv_path, staging_dir=None):
+    """
+    Calcule les chemins du fichier Parquet et de sa description.
+
+    Par défaut, le cache est rangé dans un dossier .staging à côté du CSV.
+
+    Returns:
+        tuple: (chemin du Parquet, chemin du fichier JSON de description)
+    """
+    if staging_dir is None:
+        staging_dir = os.path.join(os.path.dirname(csv_path), STAGING_DIRNAME)
+    name = csv_stem(csv_path)
+    base = os.path.join(staging_dir, name)
+    return f"{base}.parquet", f"{base}.json"
+
+
+def read_meta(meta_path):
+    """Lit la description d'un cache, ou None si elle est absente"""
+    try:
+        with open(meta_path) as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def write_meta(meta_path, meta):
+    tmp_path = f"{meta_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp_path, meta_path)
+
+
+def write_parquet(csv_path, parquet_path, schema):
+    """
+    Convertit un CSV en Parquet, en flux, avec les types du schéma.
+
+    Le fichier est écrit sous un nom temporaire puis renommé : un cache
+    interrompu n'est jamais pris pour un cache complet.
+
+    Returns:
+        int: Le nombre de lignes écrites.
+    """
+    tmp_path = f"{parquet_path}.tmp"
+    rows = 0
+    with open_input(csv_path) as f:
+        reader = open_csv(f, schema)
+        arrow_schema = apply_timezones(
+            reader.schema.empty_table(), schema
+        ).schema
+        with pq.ParquetWriter(tmp_path, arrow_schema) as writer:
+            for table in rechunk(reader, ROW_GROUP_SIZE):
+                writer.write_table(apply_timezones(table, schema))
+                rows += table.num_rows
+    os.replace(tmp_path, parquet_path)
+    return rows
+
+
+def stage_csv(csv_path, schema, staging_dir=None):
+    """
+    Renvoie la copie Parquet d'un CSV, en la (re)construisant si besoin.
+
+    Le cache est valide tant que le CSV n'a pas changé : la taille et la
+    date de modification suffisent quand elles sont identiques ; si seule
+    la date a changé, l'empreinte du contenu est recalculée pour trancher,
+    comme dans le manifeste de chargement.
+
+    Args:
+        csv_path (str): Le chemin du CSV source.
+        schema (dict): Le schéma des colonnes.
+        staging_dir (str): Le dossier du cache (par défaut, .staging à
+            côté du CSV).
+
+    Returns:
+        str: Le chemin du fichier Parquet.
+    """
+    parquet_path, meta_path = staging_paths(csv_path, staging_dir)
+    meta = read_meta(meta_path)
+    stat = os.stat(csv_path)
+
+    if (meta is not None and os.path.exists(parquet_path)
+            and meta["file_size"] == stat.st_size):
+        if meta["file_mtime"] == stat.st_mtime:
+            return parquet_path
+        if file_hash(csv_path) == meta["content_hash"]:
+            meta["file_mtime"] = stat.st_mtime
+            write_meta(meta_path, meta)
+            return parquet_path
+
+    print(f"Conversion de {csv_path} en Parquet...")
+    os.makedirs(os.path.dirname(parquet_path), exist_ok=True)
+    content_hash = file_hash(csv_path)
+    rows = write_parquet(csv_path, parquet_path, schema)
+    write_meta(meta_path, {
+        "source": csv_path,
+        "file_size": stat.st_size,
+        "file_mtime": stat.st_mtime,
+        "content_hash": content_hash,
+        "rows": rows,
+    })
+    return parquet_path
+
+
+def read_staged(parquet_path, schema, chunksize=100000, rows_done=0,
+                columns=None):
+    """
+    Lit un fichier Parquet du cache par chunks.
+
+    Le fichier est projeté en mémoire (mmap) et seules les colonnes
+    demandées sont décodées. Les row groups entièrement chargés avant
+    `rows_done` ne sont pas lus.
+
+    Args:
+        parquet_path (str): Le chemin du fichier Parquet.
+        schema (dict): Le schéma des colonnes.
+        chunksize (int ou callable): Le nombre de lignes par chunk, ou
+            une fonction qui le donne avant chaque chunk.
+        rows_done (int): Le nombre de lignes déjà chargées.
+        columns (list): Les colonnes à lire (toutes par défaut).
+
+    Yields:
+        DataFrame: Les chunks restants.
+    """
+    parquet_file = pq.ParquetFile(parquet_path, memory_map=True)
+
+    row_groups = []
+    skip = rows_done
+    for index in range(parquet_file.num_row_groups):
+        group_rows = parquet_file.metadata.row_group(index).num_rows
+        if skip >= group_rows:
+            skip -= group_rows
+            continue
+        row_groups.append(index)
+    if not row_groups:
+        return
+
+    def batches():
+        remaining = skip
+        for batch in parquet_file.iter_batches(
+            batch_size=chunk_rows(chunksize), row_groups=row_groups,
+            columns=columns
+        ):
+            if remaining >= batch.num_rows:
+                remaining -= batch.num_rows
+                continue
+            yield batch.slice(remaining)
+            remaining = 0
+
+    for table in rechunk(batches(), chunksize):
+        yield to_frame(table, schema)
@@ -0,0 +1,242 @@
+import os
+import argparse
+import numpy as np
+import pandas as pd
+from partitions import month_bounds
+
+EVENT_TYPES = np.array(["view", "cart", "remove_from_cart", "purchase"])
+EVENT_WEIGHTS = [0.55, 0.25, 0.15, 0.05]
+CATEGORY_CODES = np.array([
+    "appliances.environment.vacuum", "appliances.kitchen.refrigerators",
+    "apparel.shoes", "computers.notebook", "electronics.audio.headphone",
+    "electronics.smartphone", "furniture.bathroom.bath", "stationery.cartrige",
+])
+BRANDS = np.array([
+    "runail", "irisk", "grattol", "masura", "kapous", "estel", "jessnail",
+    "ingarden", "bpw.style", "uno",
+])
+MONTHS = ["2022_oct", "2022_nov", "2022_dec", "2023_jan"]
+
+# Lignes générées par bloc : la mémoire ne dépend pas de la taille du fichier
+BLOCK_ROWS = 1_000_000
+# Une ligne sur 1000 n'a pas de session, comme dans les vrais fichiers
+MISSING_SESSION_RATE = 0.001
+
+
+def uuid_strings(rng, count):
+    """Génère `count` UUID aléatoires (reproductibles) au format texte"""
+    raw = rng.integers(0, 256, size=(count, 16), dtype=np.uint8)
+    hex_values = [row.tobytes().hex() for row in raw]
+    return np.array([
+        f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}" for h in hex_values
+    ], dtype=object)
+
+
+def format_event_times(seconds):
+    """Écrit des dates (secondes Unix) au format des dumps : '... UTC'"""
+    text_values = np.datetime_as_string(seconds.astype("datetime64[s]"))
+    return np.char.add(np.char.replace(text_values, "T", " "), " UTC")
+
+
+def event_block(rng, rows, start, end, prices, sessions, session_users,
+                duplicate_rate):
+    """
+    Génère un bloc d'événements triés entre deux instants.
+
+    Une fraction `duplicate_rate` des événements est répétée à l'identique
+    0 ou 1 seconde plus tard : ce sont les doublons que la règle de la
+    seconde doit supprimer.
+
+    Returns:
+        DataFrame: Le bloc, au format texte des CSV du sujet.
+    """
+    event_time = np.sort(rng.integers(start, end, rows))
+    product_id = rng.integers(1, len(prices), rows)
+    session = rng.integers(0, len(sessions), rows)
+
+    block = pd.DataFrame({
+        "event_time": event_time,
+        "event_type": EVENT_TYPES[
+            rng.choice(len(EVENT_TYPES), rows, p=EVENT_WEIGHTS)
+        ],
+        "product_id": product_id,
+        "price": prices[product_id],
+        "user_id": session_users[session],
+        "user_session": sessions[session],
+    })
+    missing = rng.random(rows) < MISSING_SESSION_RATE
+    block.loc[missing, "user_session"] = None
+
+    duplicated = rng.random(rows) < duplicate_rate
+    copies = block[duplicated].copy()
+    # Une copie reste dans le bloc : décalée au-delà de `end`, elle
+    # tomberait dans le bloc suivant, voire le mois suivant (hors de la
+    # contrainte CHECK de la partition)
+    copies["event_time"] = np.minimum(
+        copies["event_time"] + rng.integers(0, 2, len(copies)), end - 1
+    )
+    block = pd.concat([block, copies]).sort_values("event_time", kind="stable")
+
+    block["event_time"] = format_event_times(block["event_time"].to_numpy())
+    block["price"] = block["price"].map("{:.2f}".format)
+    return block
+
+
+def generate_events(path, rows, month, products=50000, users=20000,
+                    duplicate_rate=0.05, seed=0):
+    """
+    Écrit un fichier d'événements mensuel déterministe.
+
+    Les prix sont fixes par produit et chaque session appartient à un seul
+    utilisateur, comme dans les vrais dumps.
+
+    Args:
+        path (str): Le fichier CSV à écrire.
+        rows (int): Le nombre d'événements avant ajout des doublons.
+        month (str): Le mois, au format 2022_oct.
+        products (int): Le nombre de produits distincts.
+        users (int): Le nombre d'utilisateurs distincts.
+        duplicate_rate (float): La part d'événements dupliqués à moins
+            d'une seconde.
+        seed (int): La graine ; même graine, même fichier.
+
+    Returns:
+        int: Le nombre de lignes écrites (doublons compris).
+    """
+    rng = np.random.default_rng([seed, rows, *month.encode()])
+    start, end = (
+        int(pd.Timestamp(bound).timestamp())
+        for bound in month_bounds(f"data_{month}")
+    )
+
+    prices = np.round(
+        np.random.default_rng([seed, products]).lognormal(2, 1, products + 1),
+        2,
+    ).clip(0.01, 99999)
+    sessions = uuid_strings(rng, max(rows // 10, 1))
+    session_users = rng.integers(10**8, 10**8 + users, len(sessions))
+
+    written = 0
+    blocks = max(-(-rows // BLOCK_ROWS), 1)
+    with open(path, "w") as f:
+        f.write(",".join([
+            "event_time", "event_type", "product_id", "price", "user_id",
+            "user_session",
+        ]) + "\n")
+        for index in range(blocks):
+            block_rows = min(BLOCK_ROWS, rows - index * BLOCK_ROWS)
+            block = event_block(
+                rng, block_rows,
+                start + (end - start) * index // blocks,
+                start + (end - start) * (index + 1) // blocks,
+                prices, sessions, session_users, duplicate_rate,
+            )
+            block.to_csv(f, index=False, header=False)
+            written += len(block)
+    return written
+
+
+def generate_items(path, rows, products=50000, overlap=0.8, seed=0):
+    """
+    Écrit un fichier items déterministe.
+
+    Une part `overlap` des produits des événements a au moins une ligne
+    dans items ; les autres lignes reprennent des produits déjà présents
+    (doublons de product_id, comme dans le vrai fichier) ou des produits
+    absents des événements.
+
+    Args:
+        path (str): Le fichier CSV à écrire.
+        rows (int): Le nombre de lignes.
+        products (int): Le nombre de produits des événements.
+        overlap (float): La part des produits des événements couverts.
+        seed (int): La graine.
+
+    Returns:
+        int: Le nombre de lignes écrites.
+    """
+    rng = np.random.default_rng([seed, rows, products])
+    covered = rng.permutation(np.arange(1, products + 1))
+    covered = covered[:min(int(products * overlap), rows)]
+
+    extra = rows - len(covered)
+    outside = rng.integers(products + 1, 2 * products + 1, extra)
+    repeated = rng.choice(covered, extra) if len(covered) else outside
+    product_id = np.concatenate([
+        covered, np.where(rng.random(extra) < 0.5, repeated, outside)
+    ])
+
+    category_id = pd.array(
+        rng.integers(2 * 10**18, 2 * 10**18 + 10**6, rows), dtype="Int64"
+    )
+    category_id[rng.random(rows) < 0.3] = pd.NA
+    category_code = CATEGORY_CODES[rng.integers(0, len(CATEGORY_CODES), rows)]
+    brand = BRANDS[rng.integers(0, len(BRANDS), rows)]
+
+    items = pd.DataFrame({
+        "product_id": rng.permutation(product_id),
+        "category_id": category_id,
+        "category_code": np.where(
+            rng.random(rows) < 0.6, None, category_code
+        ),
+        "brand": np.where(rng.random(rows) < 0.4, None, brand),
+    })
+    items.to_csv(path, index=False)
+    return rows
+
+
+def generate_dataset(directory, rows, months=MONTHS, item_rows=None,
+                     duplicate_rate=0.05, overlap=0.8, products=50000,
+                     seed=0):
+    """
+    Génère un jeu complet : customer/data_<mois>.csv et item/item.csv.
+
+    Returns:
+        dict: Le nombre de lignes écrites par fichier.
+    """
+    customer_dir = os.path.join(directory, "customer")
+    item_dir = os.path.join(directory, "item")
+    os.makedirs(customer_dir, exist_ok=True)
+    os.makedirs(item_dir, exist_ok=True)
+
+    written = {}
+    for month in months:
+        path = os.path.join(customer_dir, f"data_{month}.csv")
+        written[path] = generate_events(
+            path, rows, month, products, duplicate_rate=duplicate_rate,
+            seed=seed,
+        )
+
+    path = os.path.join(item_dir, "item.csv")
+    written[path] = generate_items(
+        path, item_rows or products, products, overlap, seed
+    )
+    return written
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Génère des CSV d'événements et d'items synthétiques"
+    )
+    parser.add_argument("directory", help="dossier de sortie")
+    parser.add_argument(
+        "--rows", type=int, default=1_000_000,
+        help="événements par mois, avant doublons (défaut : 1 000 000)"
+    )
+    parser.add_argument("--months", nargs="+", default=MONTHS)
+    parser.add_argument(
+        "--items", type=int, default=None,
+        help="lignes du fichier items (défaut : autant que de produits)"
+    )
+    parser.add_argument("--products", type=int, default=50000)
+    parser.add_argument("--duplicate-rate", type=float, default=0.05)
+    parser.add_argument("--overlap", type=float, default=0.8)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    written = generate_dataset(
+        args.directory, args.rows, args.months, args.items,
+        args.duplicate_rate, args.overlap, args.products, args.seed,
+    )
+    for path, rows in written.items():
+        print(f"{path} : {rows:,} lignes")
@@ -0,0 +1,55 @@
+from collections import namedtuple
+from sqlalchemy import text
+
+
+def stream_rows(connection, query, limit):
+    """
+    Lit au plus `limit` lignes d'une requête avec un curseur serveur.
+
+    Le curseur est fermé dès que les lignes voulues sont lues, donc
+    PostgreSQL arrête l'exécution sans envoyer le reste du résultat.
+    """
+    statement = text(query).execution_options(
+        stream_results=True, max_row_buffer=limit
+    )
+    result = connection.execute(statement)
+    try:
+        return result.fetchmany(limit)
+    finally:
+        result.close()
+
+
+def count_and_sample(connection, query, sample_size=5, fail_fast=False):
+    """
+    Compte les lignes d'une requête de vérification et en garde un extrait.
+
+    Le nombre et l'extrait viennent d'une seule exécution de la requête :
+    le nombre est ajouté à chaque ligne par COUNT(*) OVER () côté serveur,
+    et seules les premières lignes sont renvoyées. En mode fail_fast, la
+    lecture s'arrête à la première ligne trouvée et le nombre vaut 0 ou 1.
+
+    Args:
+        connection (Connection): La connexion à la base de données.
+        query (str): La requête qui renvoie les violations.
+        sample_size (int): Le nombre de lignes d'exemple à garder.
+        fail_fast (bool): S'arrêter à la première violation.
+
+    Returns:
+        tuple: (nombre de violations, lignes d'exemple)
+    """
+    if fail_fast:
+        rows = stream_rows(connection, query, 1)
+        return len(rows), rows
+
+    result = connection.execute(text(f"""
+    SELECT violations.*, COUNT(*) OVER () AS violation_count
+    FROM ({query}) AS violations
+    LIMIT {max(sample_size, 1)}
+    """))
+    rows = result.fetchall()
+    if not rows:
+        return 0, []
+    # Les exemples gardent les colonnes de la requête, sans le nombre
+    Violation = namedtuple("Violation", list(result.keys())[:-1], rename=True)
+    samples = [Violation(*row[:-1]) for row in rows[:sample_size]]
+    return rows[0].violation_count, samples
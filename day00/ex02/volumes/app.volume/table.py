@@ -1,14 +1,12 @@
 import os
-import pandas as pd
-from sqlalchemy import create_engine, text
+import sys
+from sqlalchemy import create_engine
 from dotenv import load_dotenv
-from sqlalchemy.types import DateTime, String, Integer, \
-    Numeric, UUID, BigInteger
-
-
-def count_csv_lines(file_path):
-    with open(file_path) as f:
-        return sum(1 for _ in f) - 1  # -1 pour l'en-tête
+from bulk_load import bulk_load, compare_loaders
+from schemas import EVENT_SCHEMA, read_csv_chunks, sql_dtypes
+from chunk_sizing import INITIAL_ROWS, chunk_sizer, current_size, describe
+from row_counts import record_count, get_count
+from compressed_input import csv_stem, find_input
 
 
 def main():
@@ -16,45 +14,38 @@ def main():
     DATABASE_URL = os.getenv("DATABASE_URL")
     engine = create_engine(DATABASE_URL)
 
-    csv_path = "/data_2022_oct.csv"
-    chunksize = 100000
-
-    # Compter le nombre total de lignes dans le CSV
-    total_lines = count_csv_lines(csv_path)
-
-    # Lire les chunks un par un
-    chunks = pd.read_csv(csv_path, chunksize=chunksize)
-
-    dtype_dict = {
-        "event_time": DateTime(timezone=True),  # Type 1: Pour les timestamps
-        "event_type": String,  # Type 2: Pour les types d'événements
-        "product_id": Integer,  # Type 3: Pour les IDs de produits
-        "price": Numeric(10, 2),  # Type 4: Pour les prix
-        "user_id": BigInteger,  # Type 5: Pour les grands nombres d'IDs
-        "user_session": UUID,  # Type 6: Pour les sessions UUID
-    }
-
-    # Utiliser le premier chunk pour créer la table
-    first_chunk = next(chunks)
-    table_name = os.path.splitext(os.path.basename(csv_path))[0]
-
-    # Créer la table avec le premier chunk
-    first_chunk.to_sql(
-        table_name, engine, if_exists="replace", index=False, dtype=dtype_dict
+    # Le CSV peut aussi être fourni compressé (.gz, .zst, .bz2)
+    csv_path = find_input("/data_2022_oct.csv")
+
+    # Six types SQL différents, déclarés dans le registre de schémas :
+    # DateTime, String, Integer, Numeric, BigInteger et UUID
+    dtype_dict = sql_dtypes(EVENT_SCHEMA)
+
+    # Comparer le débit de to_sql et de COPY au lieu de charger la table
+    if "--compare" in sys.argv:
+        compare_loaders(engine, csv_path, dtype_dict, chunksize=INITIAL_ROWS)
+        return
+
+    # Lire les chunks un par un, déjà typés par le parseur Arrow ; leur
+    # taille s'ajuste au débit et au budget mémoire par défaut
+    sizer = chunk_sizer()
+    chunks = read_csv_chunks(csv_path, EVENT_SCHEMA, current_size(sizer))
+    table_name = csv_stem(csv_path)
+
+    # Créer la table puis charger tous les chunks avec COPY ;
+    # le nombre de lignes du CSV est compté pendant ce même passage
+    total_lines = bulk_load(
+        engine, table_name, chunks, dtype_dict, if_exists="replace",
+        sizer=sizer,
     )
+    record_count(engine, table_name, total_lines)
     print(f"\nTable '{table_name}' créée avec succès")
+    print(describe(sizer))
 
-    # Traiter le reste des chunks
-    for chunk in chunks:
-        chunk.to_sql(
-            table_name, engine, if_exists="append",
-            index=False, dtype=dtype_dict
-        )
-
-    # Vérifier le nombre de lignes dans la table PostgreSQL
+    # Vérifier le nombre de lignes dans la table PostgreSQL : le compte
+    # enregistré, ou un vrai COUNT(*) avec --exact
     with engine.connect() as connection:
-        result = connection.execute(text(f"SELECT COUNT(*) FROM {table_name}"))
-        db_count = result.scalar()
+        db_count = get_count(connection, table_name, "--exact" in sys.argv)
 
     print("\nRésumé final :")
     print(f"Lignes dans le CSV : {total_lines:,}")
@@ -1,22 +1,30 @@
+import io
 import os
-import pandas as pd
-from sqlalchemy import create_engine, text, inspect
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from sqlalchemy import create_engine
 from dotenv import load_dotenv
-from sqlalchemy.types import DateTime, String, Integer, \
-    Numeric, UUID, BigInteger
+from database import get_engine
+from bulk_load import bulk_load
+from load_manifest import SKIP, RESUME, plan_load, checkpoint, \
+    mark_completed, read_csv_from, ensure_manifest
+from product_cache import ITEM_DTYPES, load_product_cache, enrich_chunk
+from schemas import EVENT_SCHEMA, sql_dtypes
+from staging import stage_csv, read_staged
+from chunk_sizing import DEFAULT_MEMORY_MB, chunk_sizer, current_size, \
+    describe, in_flight_chunks
+from duplicate_filter import duplicate_filter, filter_duplicates, \
+    filter_summary
+from row_counts import get_count
+from compressed_input import csv_stem, is_csv
+import metrics
 
 
-def count_csv_lines(file_path):
-    with open(file_path) as f:
-        return sum(1 for _ in f) - 1  # -1 pour l'en-tête
-
-
-def table_exists(engine, table_name):
-    inspector = inspect(engine)
-    return table_name in inspector.get_table_names()
-
-
-def process_csv_file(file_path, engine):
+def process_csv_file(file_path, engine, product_cache=None, stage=False,
+                     queue_size=0, writers=1, memory_mb=DEFAULT_MEMORY_MB,
+                     exact=False, drop_duplicates=False):
     """
     Traite un fichier CSV et crée une table correspondante
     dans la base de données.
@@ -24,55 +32,90 @@ def process_csv_file(file_path, engine):
     Args:
         file_path (str): Le chemin du fichier CSV.
         engine (Engine): L'engine de connexion à la base de données.
+        product_cache (dict): Si fourni, la dimension produits utilisée
+            pour enrichir chaque chunk avant son chargement.
+        stage (bool): Lire la copie Parquet du CSV (créée au besoin)
+            au lieu de reparser le CSV.
+        queue_size (int): Le nombre de chunks lus d'avance pendant
+            l'écriture (0 : lecture et écriture en séquence).
+        writers (int): Le nombre de connexions qui écrivent en parallèle.
+        memory_mb (int): Le budget mémoire du chargement, en Mo : la
+            taille des chunks est ajustée pour le respecter.
+        exact (bool): Vérifier le résultat avec un vrai COUNT(*) au lieu
+            du compte tenu par le chargement (row_counts).
+        drop_duplicates (bool): Retirer les doublons exacts pendant la
+            lecture, avant leur envoi à PostgreSQL (voir
+            duplicate_filter).
 
     Returns:
         None
     """
     # Obtenir le nom de la table à partir du nom du fichier
-    table_name = os.path.splitext(os.path.basename(file_path))[0]
+    table_name = csv_stem(file_path)
 
-    # Vérifier si la table existe déjà
-    if table_exists(engine, table_name):
+    # Consulter le manifeste : fichier déjà chargé, à reprendre ou nouveau
+    action, rows_done = plan_load(engine, file_path, table_name)
+    if action == SKIP:
         print(f"\nTable '{table_name}' existe déjà, skip...")
         return
 
-    # Compter le nombre total de lignes
-    total_lines = count_csv_lines(file_path)
-    print(f"\nTraitement de {file_path}")
-
-    # Lire et traiter par chunks
-    chunksize = 100000
-    chunks = pd.read_csv(file_path, chunksize=chunksize)
-
-    dtype_dict = {
-        'event_time': DateTime(timezone=True),
-        'event_type': String,
-        'product_id': Integer,
-        'price': Numeric(10, 2),
-        'user_id': BigInteger,
-        'user_session': UUID
-    }
-
-    # Premier chunk pour créer la table
-    first_chunk = next(chunks)
-    first_chunk.to_sql(
-        table_name, engine, if_exists="replace",
-        index=False, dtype=dtype_dict
+    table_rows = None
+    if action == RESUME:
+        print(f"\nReprise de {file_path} après {rows_done:,} lignes")
+        # Un filtre a pu retirer des lignes : la table en compte alors
+        # moins que le fichier
+        with engine.connect() as connection:
+            table_rows = get_count(connection, table_name)
+    else:
+        print(f"\nTraitement de {file_path}")
+
+    # Lire et traiter par chunks, à partir du dernier point de reprise ;
+    # la taille des chunks s'ajuste au débit et au budget mémoire
+    sizer = chunk_sizer(memory_mb, in_flight_chunks(queue_size, writers))
+    chunksize = current_size(sizer)
+    if stage:
+        staged_path = stage_csv(file_path, EVENT_SCHEMA)
+        chunks = read_staged(staged_path, EVENT_SCHEMA, chunksize, rows_done)
+        metrics.record_bytes_read(table_name, os.path.getsize(staged_path))
+    else:
+        chunks = read_csv_from(file_path, rows_done, chunksize, EVENT_SCHEMA)
+        metrics.record_bytes_read(table_name, os.path.getsize(file_path))
+
+    dtype_dict = sql_dtypes(EVENT_SCHEMA)
+
+    # Retirer les doublons exacts avant tout autre traitement
+    duplicates = None
+    if drop_duplicates:
+        duplicates = duplicate_filter()
+        chunks = filter_duplicates(chunks, duplicates)
+
+    # Enrichir les événements avec les items pendant le chargement
+    if product_cache is not None:
+        chunks = (enrich_chunk(chunk, product_cache) for chunk in chunks)
+        dtype_dict.update(ITEM_DTYPES)
+
+    # Créer la table et charger les chunks avec COPY ;
+    # le nombre de lignes du CSV est compté pendant ce même passage, et
+    # celui de la table enregistré avec chaque chunk
+    loaded = bulk_load(
+        engine, table_name, chunks, dtype_dict,
+        if_exists="append" if action == RESUME else "replace",
+        checkpoint=checkpoint(file_path, rows_done, table_name, table_rows),
+        queue_size=queue_size, writers=writers, sizer=sizer,
+    )
+    mark_completed(engine, file_path)
+    total_lines = rows_done + (
+        duplicates["rows_in"] if duplicates is not None else loaded
     )
 
     print(f"Table '{table_name}' créée")
-
-    # Traiter les chunks restants
-    for chunk in chunks:
-        chunk.to_sql(
-            table_name, engine,
-            if_exists="append", index=False, dtype=dtype_dict
-        )
+    print(describe(sizer))
+    if duplicates is not None:
+        print(filter_summary(duplicates))
 
     # Vérifier le nombre final de lignes
     with engine.connect() as connection:
-        result = connection.execute(text(f"SELECT COUNT(*) FROM {table_name}"))
-        db_count = result.scalar()
+        db_count = get_count(connection, table_name, exact)
 
     print(f"\nRésultat pour {table_name}:")
     print(f"Lignes dans le CSV : {total_lines:,}")
@@ -80,36 +123,227 @@ def process_csv_file(file_path, engine):
     print("=" * 50)
 
 
-def main():
+def ingest_file(file_path, product_cache=None, stage=False, queue_size=0,
+                writers=1, memory_mb=DEFAULT_MEMORY_MB, exact=False,
+                drop_duplicates=False):
+    """
+    Traite un fichier CSV dans un processus worker.
+
+    Le worker ouvre son propre engine et capture tout ce qu'il affiche,
+    pour que le processus principal puisse imprimer les résumés dans
+    l'ordre des fichiers. Une erreur est rapportée dans le résumé au lieu
+    d'interrompre les autres fichiers. Les mesures du worker sont
+    renvoyées pour être ajoutées à celles du processus principal.
+
+    Args:
+        file_path (str): Le chemin du fichier CSV.
+        product_cache (dict): La dimension produits, si enrichissement.
+        stage (bool): Passer par le cache Parquet.
+        queue_size (int): Le nombre de chunks lus d'avance.
+        writers (int): Le nombre de connexions d'écriture.
+        memory_mb (int): Le budget mémoire du worker, en Mo.
+        exact (bool): Vérifier avec un vrai COUNT(*).
+        drop_duplicates (bool): Retirer les doublons exacts à la lecture.
+
+    Returns:
+        tuple: (succès (bool), sortie capturée (str), mesures (dict))
+    """
     load_dotenv()
-    DATABASE_URL = os.getenv("DATABASE_URL")
-    engine = create_engine(DATABASE_URL)
+    engine = create_engine(os.getenv("DATABASE_URL"))
+    output = io.StringIO()
+    success = True
 
-    # Chercher tous les fichiers CSV dans le dossier customer
-    customer_dir = "/customer"
     try:
-        # Lister tous les fichiers du dossier
-        files = os.listdir(customer_dir)
-        # Filtrer pour ne garder que les .csv
-        csv_files = [f for f in files if f.endswith(".csv")]
+        with redirect_stdout(output):
+            process_csv_file(
+                file_path, engine, product_cache, stage, queue_size, writers,
+                memory_mb, exact, drop_duplicates,
+            )
+    except Exception as e:
+        output.write(f"\nErreur lors du traitement de {file_path} : {e}\n")
+        success = False
+    finally:
+        engine.dispose()
 
-        if not csv_files:
-            print("Aucun fichier CSV trouvé dans le dossier /customer/")
-            return
+    return success, output.getvalue(), metrics.snapshot()
 
-        print(f"Fichiers CSV trouvés : {len(csv_files)}")
-        for csv_file in csv_files:
-            # Construire le chemin complet du fichier
-            file_path = os.path.join(customer_dir, csv_file)
-            process_csv_file(file_path, engine)
 
-        print("\nTraitement terminé !")
+def ingest_parallel(file_paths, workers, product_cache=None, stage=False,
+                    queue_size=0, writers=1, memory_mb=DEFAULT_MEMORY_MB,
+                    exact=False, drop_duplicates=False):
+    """
+    Traite les fichiers CSV en parallèle, un processus par fichier.
+
+    Les workers sont démarrés par spawn et non par fork : dans le
+    pipeline, d'autres étapes utilisent en même temps, depuis leurs
+    threads, l'engine partagé du processus et ses connexions, qu'un fork
+    copierait en cours d'utilisation.
+
+    Args:
+        file_paths (list): Les chemins des fichiers CSV, dans l'ordre
+            d'affichage souhaité.
+        workers (int): Le nombre maximal de processus simultanés.
+        product_cache (dict): La dimension produits, si enrichissement.
+        stage (bool): Passer par le cache Parquet.
+        queue_size (int): Le nombre de chunks lus d'avance.
+        writers (int): Le nombre de connexions d'écriture par fichier.
+        memory_mb (int): Le budget mémoire de chaque worker, en Mo.
+        exact (bool): Vérifier avec un vrai COUNT(*).
+        drop_duplicates (bool): Retirer les doublons exacts à la lecture.
+
+    Returns:
+        int: Le nombre de fichiers en échec.
+    """
+    failures = 0
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        futures = [
+            executor.submit(
+                ingest_file, path, product_cache, stage, queue_size, writers,
+                memory_mb, exact, drop_duplicates,
+            )
+            for path in file_paths
+        ]
+        # Afficher les résumés dans l'ordre des fichiers, pas de fin
+        for future in futures:
+            success, output, measures = future.result()
+            metrics.merge(measures)
+            print(output, end="")
+            if not success:
+                failures += 1
+    return failures
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Charge les CSV de /customer dans PostgreSQL"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1,
+        help="nombre de fichiers traités en parallèle (défaut : 1)"
+    )
+    parser.add_argument(
+        "--enrich", action="store_true",
+        help="ajoute category_id, category_code et brand depuis la table "
+             "items pendant le chargement"
+    )
+    parser.add_argument(
+        "--stage", action="store_true",
+        help="convertit chaque CSV une seule fois en Parquet (dossier "
+             ".staging) et charge depuis cette copie"
+    )
+    parser.add_argument(
+        "--queue-size", type=int, default=0,
+        help="nombre de chunks lus d'avance pendant l'écriture du "
+             "précédent (défaut : 0, lecture et écriture en séquence)"
+    )
+    parser.add_argument(
+        "--writers", type=int, default=1,
+        help="nombre de connexions qui écrivent un même fichier en "
+             "parallèle (défaut : 1)"
+    )
+    parser.add_argument(
+        "--memory-mb", type=int, default=DEFAULT_MEMORY_MB,
+        help="budget mémoire de l'ingestion en Mo, partagé entre les "
+             "workers ; la taille des chunks s'y ajuste "
+             f"(défaut : {DEFAULT_MEMORY_MB})"
+    )
+    parser.add_argument(
+        "--exact", action="store_true",
+        help="vérifie chaque table avec un vrai COUNT(*) au lieu du compte "
+             "enregistré pendant le chargement"
+    )
+    parser.add_argument(
+        "--drop-duplicates", action="store_true",
+        help="retire les doublons exacts (six colonnes identiques) pendant "
+             "la lecture, avant l'envoi à PostgreSQL"
+    )
+    return parser.parse_args()
+
+
+def ingest_directory(engine, customer_dir="/customer", workers=1,
+                     enrich=False, stage=False, queue_size=0, writers=1,
+                     memory_mb=DEFAULT_MEMORY_MB, exact=False,
+                     drop_duplicates=False):
+    """
+    Charge chaque CSV d'un dossier dans sa propre table.
+
+    Args:
+        engine (Engine): L'engine de connexion à la base de données.
+        customer_dir (str): Le dossier des CSV mensuels.
+        workers (int): Le nombre de fichiers traités en parallèle.
+        enrich (bool): Enrichir les événements avec la table items.
+        stage (bool): Passer par le cache Parquet.
+        queue_size (int): Le nombre de chunks lus d'avance.
+        writers (int): Le nombre de connexions d'écriture par fichier.
+        memory_mb (int): Le budget mémoire total, partagé entre les
+            workers.
+        exact (bool): Vérifier chaque table avec un vrai COUNT(*).
+        drop_duplicates (bool): Retirer les doublons exacts à la lecture.
+
+    Returns:
+        bool: True si tous les fichiers ont été traités.
+    """
+    # Lister tous les fichiers du dossier
+    files = os.listdir(customer_dir)
+    # Filtrer pour ne garder que les .csv (compressés ou non), dans un
+    # ordre stable
+    csv_files = sorted(f for f in files if is_csv(f))
+
+    if not csv_files:
+        print(f"Aucun fichier CSV trouvé dans le dossier {customer_dir}/")
+        return True
+
+    print(f"Fichiers CSV trouvés : {len(csv_files)}")
+    # Construire les chemins complets des fichiers
+    file_paths = [os.path.join(customer_dir, f) for f in csv_files]
+
+    # Créer le manifeste avant de lancer les workers
+    ensure_manifest(engine)
+
+    # Charger une seule fois la dimension produits
+    product_cache = load_product_cache(engine) if enrich else None
+
+    failures = 0
+    if workers > 1:
+        failures = ingest_parallel(
+            file_paths, workers, product_cache, stage, queue_size, writers,
+            memory_mb // workers, exact, drop_duplicates,
+        )
+        if failures:
+            print(f"\n{failures} fichier(s) en échec")
+    else:
+        for file_path in file_paths:
+            process_csv_file(
+                file_path, engine, product_cache, stage, queue_size, writers,
+                memory_mb, exact, drop_duplicates,
+            )
+
+    print("\nTraitement terminé !")
+    return failures == 0
+
+
+def main():
+    args = parse_args()
+    engine = get_engine()
+
+    # Chercher tous les fichiers CSV dans le dossier customer
+    customer_dir = "/customer"
+    try:
+        ingest_directory(
+            engine, customer_dir, args.workers, args.enrich, args.stage,
+            args.queue_size, args.writers, args.memory_mb, args.exact,
+            args.drop_duplicates,
+        )
 
     except FileNotFoundError:
         print(f"Erreur : Le dossier {customer_dir} n'existe pas")
     except Exception as e:
         print(f"Erreur lors du traitement : {str(e)}")
 
+    metrics.export_metrics("automatic_table")
+
 
 if __name__ == "__main__":
     main()
@@ -1,84 +1,148 @@
 import os
-import pandas as pd
-from sqlalchemy import BigInteger, create_engine, text, inspect, \
-    Integer, Text, String
-from dotenv import load_dotenv
-
-
-def count_csv_lines(file_path):
-    with open(file_path) as f:
-        return sum(1 for _ in f) - 1  # -1 pour l'en-tête
-
-
-def table_exists(engine, table_name):
-    inspector = inspect(engine)
-    return table_name in inspector.get_table_names()
-
-
-def create_items_table(engine, csv_path):
-    """Crée la table items avec des types de données spécifiques"""
-
-    # Vérifier si la table existe déjà
-    if table_exists(engine, "items"):
+import argparse
+from sqlalchemy import text
+from database import get_engine
+from bulk_load import bulk_load
+from load_manifest import SKIP, RESUME, plan_load, mark_completed, \
+    read_csv_from
+from product_cache import unique_items
+from schemas import ITEM_SCHEMA, sql_dtypes, slice_frame
+from staging import stage_csv, read_staged
+from chunk_sizing import DEFAULT_MEMORY_MB, chunk_sizer, current_size, \
+    describe, in_flight_chunks
+from row_counts import get_count, set_count
+from compressed_input import find_input
+import metrics
+
+
+def create_items_table(engine, csv_path, stage=False, queue_size=0,
+                       writers=1, memory_mb=DEFAULT_MEMORY_MB, exact=False):
+    """
+    Crée la table items avec des types de données spécifiques, une ligne
+    par product_id (clé primaire)
+
+    Le CSV est réduit pendant la lecture : pour chaque produit, la ligne
+    gardée est celle dont category_code et brand sont les plus renseignés
+    (la première du fichier à égalité, voir merge_items). La fusion peut
+    ainsi joindre items directement.
+
+    Avec stage, le CSV est lu depuis sa copie Parquet (créée au besoin).
+    Avec queue_size ou writers, l'écriture se fait en flux (voir
+    bulk_load). La taille des chunks s'ajuste au budget memory_mb (Mo).
+    Avec exact, le résultat est vérifié par un vrai COUNT(*) plutôt que
+    par le compte enregistré pendant le chargement.
+    """
+
+    # Consulter le manifeste : fichier déjà chargé ou nouveau. La table
+    # n'est écrite qu'une fois le fichier entièrement lu : un chargement
+    # interrompu est repris depuis le début
+    action, _ = plan_load(engine, csv_path, "items")
+    if action == SKIP:
         print("\nTable 'items' existe déjà, skip...")
         return
 
-    # Compter le nombre total de lignes
-    total_lines = count_csv_lines(csv_path)
-    print(f"\nTraitement de {csv_path}")
+    if action == RESUME:
+        print(f"\nRechargement complet de {csv_path} (chargement interrompu)")
+    else:
+        print(f"\nTraitement de {csv_path}")
 
     # Définir les types de données pour certaines colonnes
-    dtype_mapping = {
-        "product_id": Integer,
-        "category_id": BigInteger,
-        "category_code": Text,
-        "brand": String,
-    }
-
-    # Lire et traiter par chunks
-    chunksize = 100000
-    chunks = pd.read_csv(csv_path, chunksize=chunksize)
-
-    # Premier chunk pour créer la table
-    first_chunk = next(chunks)
-    first_chunk.to_sql(
-        "items", engine, if_exists="replace", index=False, dtype=dtype_mapping
+    dtype_mapping = sql_dtypes(ITEM_SCHEMA)
+
+    # Lire par chunks et ne garder que la meilleure ligne de chaque
+    # produit ; la taille des chunks écrits s'ajuste au débit et au
+    # budget mémoire
+    sizer = chunk_sizer(memory_mb, in_flight_chunks(queue_size, writers))
+    chunksize = current_size(sizer)
+    if stage:
+        staged_path = stage_csv(csv_path, ITEM_SCHEMA)
+        chunks = read_staged(staged_path, ITEM_SCHEMA, chunksize)
+        metrics.record_bytes_read("items", os.path.getsize(staged_path))
+    else:
+        chunks = read_csv_from(csv_path, 0, chunksize, ITEM_SCHEMA)
+        metrics.record_bytes_read("items", os.path.getsize(csv_path))
+
+    with metrics.timed("items", "unique_items"):
+        items, total_lines = unique_items(chunks)
+    if items is None:
+        print(f"Aucune ligne dans {csv_path}")
+        return
+
+    # Créer la table et charger les items uniques avec COPY, puis poser
+    # la clé primaire et enregistrer le compte dans la même transaction
+    loaded = bulk_load(
+        engine, "items", slice_frame(items, chunksize), dtype_mapping,
+        if_exists="replace", queue_size=queue_size, writers=writers,
+        sizer=sizer,
     )
+    with engine.begin() as connection:
+        connection.execute(
+            text("ALTER TABLE items ADD PRIMARY KEY (product_id)")
+        )
+        set_count(connection, "items", loaded)
+    mark_completed(engine, csv_path, total_lines)
 
     print("Table 'items' créée")
-
-    # Traiter les chunks restants
-    for chunk in chunks:
-        chunk.to_sql(
-            "items", engine, if_exists="append",
-            index=False, dtype=dtype_mapping
-        )
+    print(describe(sizer))
 
     # Vérifier le nombre final de lignes
     with engine.connect() as connection:
-        result = connection.execute(text("SELECT COUNT(*) FROM items"))
-        db_count = result.scalar()
+        db_count = get_count(connection, "items", exact)
 
     print("\nRésultat pour items:")
     print(f"Lignes dans le CSV : {total_lines:,}")
+    print(f"Produits distincts : {loaded:,} "
+          f"({total_lines - loaded:,} lignes en double ou sans product_id)")
     print(f"Lignes dans la table : {db_count:,}")
 
 
 def main():
-    load_dotenv()
-    DATABASE_URL = os.getenv("DATABASE_URL")
-    engine = create_engine(DATABASE_URL)
+    parser = argparse.ArgumentParser(
+        description="Charge /item/item.csv dans la table items"
+    )
+    parser.add_argument(
+        "--stage", action="store_true",
+        help="convertit le CSV une seule fois en Parquet (dossier .staging) "
+             "et charge depuis cette copie"
+    )
+    parser.add_argument(
+        "--queue-size", type=int, default=0,
+        help="nombre de chunks lus d'avance pendant l'écriture du "
+             "précédent (défaut : 0, lecture et écriture en séquence)"
+    )
+    parser.add_argument(
+        "--writers", type=int, default=1,
+        help="nombre de connexions qui écrivent en parallèle (défaut : 1)"
+    )
+    parser.add_argument(
+        "--memory-mb", type=int, default=DEFAULT_MEMORY_MB,
+        help="budget mémoire du chargement en Mo ; la taille des chunks s'y "
+             f"ajuste (défaut : {DEFAULT_MEMORY_MB})"
+    )
+    parser.add_argument(
+        "--exact", action="store_true",
+        help="vérifie la table avec un vrai COUNT(*) au lieu du compte "
+             "enregistré pendant le chargement"
+    )
+    args = parser.parse_args()
+
+    engine = get_engine()
 
-    items_csv = "/item/item.csv"
+    items_csv = find_input("/item/item.csv")
 
     try:
-        create_items_table(engine, items_csv)
+        create_items_table(
+            engine, items_csv, args.stage, args.queue_size, args.writers,
+            args.memory_mb, args.exact,
+        )
 
     except FileNotFoundError:
         print(f"Erreur : Le fichier {items_csv} n'existe pas")
     except Exception as e:
         print(f"Erreur lors du traitement : {str(e)}")
 
+    metrics.export_metrics("items_table")
+
 
 if __name__ == "__main__":
     main()
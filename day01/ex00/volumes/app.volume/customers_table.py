@@ -1,68 +1,102 @@
-import os
-from sqlalchemy import create_engine, text
-from dotenv import load_dotenv
-
-
-def get_table_count(connection, table_name):
-    """Get the number of rows in a table"""
-    result = connection.execute(text(f"SELECT COUNT(*) FROM {table_name}"))
-    return result.scalar()
-
-
-def create_customers_table():
-    # Charger les variables d'environnement
-    load_dotenv()
-    DATABASE_URL = os.getenv("DATABASE_URL")
-
-    # Créer la connexion à la base de données
-    engine = create_engine(DATABASE_URL)
-
-    # SQL pour créer la table customers à partir des tables existantes
-    merge_query = """
-    CREATE TABLE IF NOT EXISTS customers AS
-    SELECT *
-    FROM (
-        SELECT * FROM data_2022_oct
-        UNION ALL
-        SELECT * FROM data_2022_nov
-        UNION ALL
-        SELECT * FROM data_2022_dec
-        UNION ALL
-        SELECT * FROM data_2023_jan
-    ) AS combined_data;
+import argparse
+from database import get_engine
+from partitions import is_partitioned, list_partitions, \
+    create_partitioned_table, attach_month, monthly_tables, drop_table
+from row_counts import get_count, set_count
+from load_manifest import completed_tables
+import metrics
+
+
+def get_table_count(connection, table_name, exact=False):
+    """Get the number of rows in a table (from row_counts unless exact)"""
+    return get_count(connection, table_name, exact)
+
+
+def create_customers_table(exact=False):
     """
+    Crée la table customers, partitionnée par mois, à partir des tables
+    mensuelles.
+
+    Les tables mensuelles sont toutes les tables data_YYYY_mon de la
+    base : un nouveau mois chargé par automatic_table.py est attaché sans
+    modifier le code. Un mois dont le chargement n'est pas terminé dans
+    load_manifest n'est pas attaché.
+
+    Le nombre de lignes de customers, somme de celles de ses partitions,
+    est enregistré dans row_counts avec l'attachement des partitions.
 
-    source_tables = [
-        "data_2022_oct",
-        "data_2022_nov",
-        "data_2022_dec",
-        "data_2023_jan",
-    ]
+    Args:
+        exact (bool): Compter les tables avec un vrai COUNT(*) au lieu
+            de lire row_counts.
+
+    Returns:
+        bool: True si la table a été créée.
+    """
+    # Connexion à la base de données, partagée entre les étapes
+    engine = get_engine()
 
     try:
         with engine.connect() as connection:
+            source_tables = completed_tables(
+                connection, monthly_tables(connection)
+            )
+            if not source_tables:
+                raise ValueError("Aucune table mensuelle data_YYYY_mon")
+
             # Vérifier les nombres de lignes dans les tables sources
             print("\nNombre de lignes dans les tables sources:")
-            total_source_rows = 0
+            source_counts = {}
             for table in source_tables:
-                rows = get_table_count(connection, table)
-                total_source_rows += rows
-                print(f"{table}: {rows:,} lignes")
+                source_counts[table] = get_table_count(connection, table, exact)
+                print(f"{table}: {source_counts[table]:,} lignes")
+            total_source_rows = sum(source_counts.values())
 
             print(f"\nTotal des lignes sources: {total_source_rows:,}")
 
-            # Exécuter la requête de fusion
-            connection.execute(text("DROP TABLE IF EXISTS customers"))
-            connection.execute(text(merge_query))
+            # Créer customers comme table partitionnée par mois : les tables
+            # mensuelles deviennent ses partitions, sans copie de lignes
+            if not is_partitioned(connection, "customers"):
+                drop_table(connection, "customers")
+                create_partitioned_table(
+                    connection, "customers", source_tables[0]
+                )
+
+            # Attacher uniquement les mois qui ne le sont pas encore
+            attached = set(list_partitions(connection, "customers"))
+            for table in source_tables:
+                if table not in attached:
+                    with metrics.timed("customers", f"attach_{table}"):
+                        attach_month(connection, "customers", table)
+                    print(f"Partition '{table}' attachée")
+            # Le compte de customers est la somme de ses partitions
+            partition_rows = sum(
+                source_counts[table] if table in source_counts
+                else get_table_count(connection, table, exact)
+                for table in list_partitions(connection, "customers")
+            )
+            set_count(connection, "customers", partition_rows)
             connection.commit()
 
             # Vérifier le nombre de lignes dans la nouvelle table
-            customers_count = get_table_count(connection, "customers")
+            customers_count = get_table_count(connection, "customers", exact)
             print(f"\nTable 'customers' créée avec {customers_count:,} lignes")
+            return True
 
     except Exception as e:
         print(f"Erreur lors de la création de la table: {str(e)}")
+        return False
 
 
 if __name__ == "__main__":
-    create_customers_table()
+    parser = argparse.ArgumentParser(
+        description="Crée la table customers à partir des tables mensuelles"
+    )
+    parser.add_argument(
+        "--exact", action="store_true",
+        help="compte les tables avec un vrai COUNT(*) au lieu de lire "
+             "row_counts"
+    )
+    args = parser.parse_args()
+
+    create_customers_table(args.exact)
+    metrics.export_metrics("customers_table")
@@ -1,86 +1,535 @@
-import os
-from sqlalchemy import create_engine, text
-from dotenv import load_dotenv
+import time
+import argparse
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import text
+from sqlalchemy.types import Integer, BigInteger
+from database import get_engine, dedicated_engine
+from partitions import drop_table, list_partitions, is_partitioned, \
+    monthly_tables
+from bulk_load import bulk_load
+from external_dedup import dedup_events, MB
+from verification import count_and_sample
+from load_manifest import completed_tables
+from row_counts import get_count, set_count, add_count
+from product_cache import ITEM_COLUMNS, has_unique_products
+from compact_storage import append_compact, is_compact
+from sql_queries import EVENT_COLUMNS, dedup_query, dedup_shard_query, \
+    shard_expression
+import metrics
 
+# Nombre de shards de la déduplication parallèle, chacun sur sa connexion
+DEFAULT_SHARDS = 4
 
-def remove_duplicates():
-    # Charger les variables d'environnement
-    load_dotenv()
-    DATABASE_URL = os.getenv("DATABASE_URL")
 
-    # Créer la connexion à la base de données
-    engine = create_engine(DATABASE_URL)
+def table_columns(connection, table_name):
+    """Liste les colonnes d'une table dans l'ordre de définition"""
+    result = connection.execute(text("""
+    SELECT column_name FROM information_schema.columns
+    WHERE table_name = :table ORDER BY ordinal_position
+    """), {"table": table_name})
+    return [row[0] for row in result]
+
+
+def read_events(engine, table_name, columns=EVENT_COLUMNS, chunksize=100000):
+    """Lit les événements d'une table par chunks avec un curseur serveur"""
+    query = text(f"SELECT {', '.join(columns)} FROM {table_name}")
+    with engine.connect().execution_options(stream_results=True) as conn:
+        yield from pd.read_sql(query, conn, chunksize=chunksize)
+
+
+def dedup_external(engine, source, target, memory_mb=512,
+                   columns=EVENT_COLUMNS):
+    """
+    Déduplique `source` vers `target` par tri externe côté client.
+
+    Évite le tri géant de la fonction fenêtre côté serveur : les
+    événements sont lus en flux, triés par runs sur disque dans le budget
+    mémoire, fusionnés puis rechargés avec COPY.
+
+    Args:
+        engine (Engine): L'engine de connexion à la base de données.
+        source (str): La table à dédupliquer.
+        target (str): La table à créer.
+        memory_mb (int): Le budget mémoire du tri, en Mo.
+        columns (list): Les colonnes à conserver.
+
+    Returns:
+        int: Le nombre de lignes conservées.
+    """
+    with engine.begin() as connection:
+        connection.execute(text(
+            f"CREATE TABLE {target} AS SELECT {', '.join(columns)} "
+            f"FROM {source} WITH NO DATA"
+        ))
+
+    batches = dedup_events(
+        read_events(engine, source, columns), memory_budget=memory_mb * MB
+    )
+    return bulk_load(
+        engine, target, batches,
+        {"product_id": Integer, "user_id": BigInteger,
+         "category_id": BigInteger},
+        if_exists="append",
+    )
+
+
+def shard_sizes(connection, source, shards):
+    """Compte les lignes de chaque shard de `source`, en une seule lecture"""
+    result = connection.execute(text(f"""
+    SELECT {shard_expression(shards)} AS shard, COUNT(*) FROM {source}
+    GROUP BY 1
+    """))
+    sizes = dict.fromkeys(range(shards), 0)
+    sizes.update({row[0]: row[1] for row in result})
+    return sizes
+
+
+def dedup_shard(engine, source, target, columns, shard, shards):
+    """
+    Déduplique un shard sur sa propre connexion et valide ses lignes.
+
+    Returns:
+        tuple: (lignes conservées, durée en secondes)
+    """
+    start = time.perf_counter()
+    with engine.begin() as connection:
+        rows_kept = metrics.execute_timed(
+            connection, "dedup", f"dedup_shard_{shard}",
+            dedup_shard_query(source, target, columns, shard, shards),
+        )
+    return rows_kept, time.perf_counter() - start
+
+
+def dedup_sharded(engine, source, target, shards=DEFAULT_SHARDS,
+                  columns=EVENT_COLUMNS):
+    """
+    Déduplique `source` vers `target` en plusieurs requêtes parallèles.
+
+    Les lignes sont réparties en shards par hachage de user_id : deux
+    événements identiques sont toujours dans le même shard, donc chaque
+    shard applique la règle de la seconde seul. Chaque requête tourne sur
+    sa connexion, donc dans son propre processus serveur, et ne trie
+    qu'une fraction des lignes ; toutes ajoutent leurs lignes à la même
+    table `target`, créée vide avant. Les shards ont leur propre engine,
+    d'autant de connexions qu'eux : aucun n'attend une connexion libre.
+
+    Args:
+        engine (Engine): L'engine de connexion à la base de données.
+        source (str): La table à dédupliquer.
+        target (str): La table à créer.
+        shards (int): Le nombre de shards, tous lancés en même temps.
+        columns (list): Les colonnes à conserver.
+
+    Returns:
+        int: Le nombre de lignes conservées.
+
+    Raises:
+        ValueError: Si `shards` est inférieur à 1.
+    """
+    if shards < 1:
+        raise ValueError(f"Nombre de shards invalide : {shards}")
+
+    with engine.begin() as connection:
+        connection.execute(text(
+            f"CREATE TABLE {target} AS SELECT {', '.join(columns)} "
+            f"FROM {source} WITH NO DATA"
+        ))
+        with metrics.timed("dedup", "shard_sizes"):
+            sizes = shard_sizes(connection, source, shards)
+
+    print(f"Déduplication en {shards} shards parallèles...")
+    shard_engine = dedicated_engine(shards)
+    try:
+        with ThreadPoolExecutor(max_workers=shards) as executor:
+            futures = [
+                executor.submit(
+                    dedup_shard, shard_engine, source, target, columns,
+                    shard, shards,
+                )
+                for shard in range(shards)
+            ]
+            results = [future.result() for future in futures]
+    finally:
+        shard_engine.dispose()
+
+    for shard, (rows_kept, seconds) in enumerate(results):
+        print(f"  - shard {shard + 1}/{shards}: {sizes[shard]:,} lignes, "
+              f"{sizes[shard] - rows_kept:,} doublons supprimés "
+              f"({seconds:.1f}s)")
+    return sum(rows_kept for rows_kept, _ in results)
+
+
+def verify_against_sql(connection, table_name, columns=EVENT_COLUMNS):
+    """
+    Vérifie qu'une table dédupliquée contient exactement les lignes que
+    produirait la version SQL sur customers.
+
+    Returns:
+        bool: True si les deux résultats sont identiques ligne pour ligne.
+    """
+    connection.execute(text("DROP TABLE IF EXISTS customers_dedup_check"))
+    metrics.execute_timed(
+        connection, "dedup", "verify_dedup_window",
+        dedup_query("customers", "customers_dedup_check", columns),
+    )
+
+    with metrics.timed("dedup", "verify_except_all"):
+        differences = connection.execute(text(f"""
+        SELECT
+            (SELECT COUNT(*) FROM (
+                SELECT * FROM {table_name}
+                EXCEPT ALL SELECT * FROM customers_dedup_check) a),
+            (SELECT COUNT(*) FROM (
+                SELECT * FROM customers_dedup_check
+                EXCEPT ALL SELECT * FROM {table_name}) b)
+        """)).fetchone()
+    connection.execute(text("DROP TABLE customers_dedup_check"))
+
+    if differences[0] == 0 and differences[1] == 0:
+        print("✅ Résultat identique à la version SQL")
+        return True
+    print(
+        f"❌ Différences avec la version SQL: {differences[0]:,} lignes en "
+        f"trop, {differences[1]:,} lignes manquantes"
+    )
+    return False
+
+
+def ensure_dedup_state(connection):
+    """Crée la table dedup_state qui liste les tables sources déjà
+    dédupliquées dans customers"""
+    connection.execute(text("""
+    CREATE TABLE IF NOT EXISTS dedup_state (
+        source_table TEXT PRIMARY KEY,
+        min_event_time TIMESTAMPTZ,
+        max_event_time TIMESTAMPTZ,
+        rows_in BIGINT NOT NULL,
+        rows_kept BIGINT,
+        deduped_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    )
+    """))
+
+
+def register_source(connection, table_name, rows_kept=None):
+    """
+    Enregistre une table source comme dédupliquée.
+
+    Un index BRIN sur event_time est créé au passage : il permet de lire
+    plus tard la fenêtre de bord de cette table sans la parcourir en
+    entier.
+    """
+    connection.execute(text(
+        f"CREATE INDEX IF NOT EXISTS {table_name}_event_time_brin "
+        f"ON {table_name} USING brin (event_time)"
+    ))
+    connection.execute(text(f"""
+    INSERT INTO dedup_state
+        (source_table, min_event_time, max_event_time, rows_in, rows_kept)
+    SELECT :table, MIN(event_time), MAX(event_time), COUNT(*), :kept
+    FROM {table_name}
+    ON CONFLICT (source_table) DO UPDATE SET
+        min_event_time = EXCLUDED.min_event_time,
+        max_event_time = EXCLUDED.max_event_time,
+        rows_in = EXCLUDED.rows_in,
+        rows_kept = EXCLUDED.rows_kept,
+        deduped_at = now()
+    """), {"table": table_name, "kept": rows_kept})
+
+
+def pending_sources(connection):
+    """
+    Liste, par mois, les tables data_YYYY_mon pas encore dédupliquées.
+
+    Une table dont le chargement n'est pas terminé dans load_manifest est
+    écartée : dédupliquée en l'état, elle serait notée dans dedup_state
+    et ses lignes manquantes ne seraient jamais ajoutées.
+    """
+    deduplicated = {
+        row[0] for row in
+        connection.execute(text("SELECT source_table FROM dedup_state"))
+    }
+    return [
+        table for table in completed_tables(
+            connection, monthly_tables(connection)
+        )
+        if table not in deduplicated
+    ]
+
+
+def dedup_incremental(connection, source):
+    """
+    Déduplique une nouvelle table source et ajoute ses lignes à customers.
+
+    Seules les lignes de `source` sont traitées, avec une fenêtre de bord :
+    les lignes brutes des tables déjà dédupliquées situées à 1 seconde ou
+    moins avant le premier événement de `source`. Elles servent uniquement
+    de précédent pour LAG, ce qui donne le même résultat qu'une
+    déduplication complète, pour un coût proportionnel au nouveau mois.
+
+    Si customers est déjà enrichie (fusion faite) et pas `source`, les
+    colonnes d'items des lignes ajoutées sont lues dans items, par la
+    même jointure que la fusion. Si customers est compacte, les lignes
+    sont encodées dans la table compacte en une passe (append_compact).
+
+    Args:
+        connection (Connection): La connexion à la base de données.
+        source (str): La nouvelle table mensuelle.
+
+    Returns:
+        tuple: (lignes lues, lignes ajoutées)
+    """
+    min_time, rows_in = connection.execute(text(
+        f"SELECT MIN(event_time), COUNT(*) FROM {source}"
+    )).fetchone()
+    if rows_in == 0:
+        register_source(connection, source, 0)
+        return 0, 0
+
+    # Tables déjà dédupliquées dont la fin touche la fenêtre de bord
+    neighbours = connection.execute(text("""
+    SELECT source_table, max_event_time FROM dedup_state
+    WHERE max_event_time >= CAST(:start AS timestamptz) - interval '1 second'
+    """), {"start": min_time}).fetchall()
+    for table, max_time in neighbours:
+        if max_time >= min_time:
+            raise ValueError(
+                f"{source} chevauche {table} : une déduplication complète "
+                "est nécessaire"
+            )
+
+    # Les lignes de bord ne servent que de précédent : seules les colonnes
+    # d'événement sont lues, les autres (items) sont laissées à NULL
+    source_columns = table_columns(connection, source)
+    columns = ", ".join(source_columns)
+    boundary_columns = ", ".join(
+        column if column in EVENT_COLUMNS else f"NULL AS {column}"
+        for column in source_columns
+    )
+    boundary = "".join(
+        f"SELECT {boundary_columns}, FALSE AS is_new FROM {table} "
+        "WHERE event_time >= "
+        "CAST(:start AS timestamptz) - interval '1 second' UNION ALL "
+        for table, _ in neighbours
+    )
+
+    # Colonnes d'items de customers absentes de la source : jointure items
+    customers_columns = table_columns(connection, "customers")
+    item_columns = [
+        column for column in ITEM_COLUMNS
+        if column in customers_columns and column not in source_columns
+    ]
+    if item_columns and not has_unique_products(connection):
+        raise ValueError(
+            "items doit avoir une ligne par product_id pour enrichir "
+            f"{source} : rechargez-la avec items_table.py"
+        )
+    selected = ", ".join(
+        [f"r.{column}" for column in source_columns]
+        + [f"i.{column}" for column in item_columns]
+    )
+    items_join = (
+        "LEFT JOIN items i ON r.product_id = i.product_id"
+        if item_columns else ""
+    )
+
+    new_rows_query = f"""
+    WITH candidates AS (
+        {boundary}
+        SELECT {columns}, TRUE AS is_new FROM {source}
+    ),
+    ranked_events AS (
+        SELECT *,
+            LAG(event_time) OVER (
+                PARTITION BY event_type, product_id, price, user_id, user_session
+                ORDER BY event_time
+            ) as prev_event_time
+        FROM candidates
+    )
+    SELECT {selected}
+    FROM ranked_events r
+    {items_join}
+    WHERE
+        r.is_new
+        AND (
+            r.prev_event_time IS NULL
+            OR
+            EXTRACT(EPOCH FROM (r.event_time - r.prev_event_time)) > 1
+        )
+    """
+    inserted_columns = source_columns + item_columns
+    if is_compact(connection):
+        # customers est une vue (compact_storage) : ajout ensembliste dans
+        # la table compacte plutôt que par le trigger, ligne par ligne
+        rows_kept = append_compact(
+            connection, new_rows_query, inserted_columns,
+            f"incremental_{source}", {"start": min_time},
+        )
+    else:
+        rows_kept = metrics.execute_timed(
+            connection, "dedup", f"incremental_{source}",
+            f"INSERT INTO customers ({', '.join(inserted_columns)}) "
+            f"{new_rows_query}",
+            {"start": min_time},
+        )
+    add_count(connection, "customers", rows_kept)
+
+    register_source(connection, source, rows_kept)
+    return rows_in, rows_kept
+
+
+def remove_duplicates_incremental(sources=None):
+    """
+    Ajoute à customers, dédupliquées, les tables mensuelles qui n'y sont
+    pas encore, sans retraiter l'historique.
+
+    Args:
+        sources (list): Les tables à ajouter ; par défaut toutes les tables
+            data_YYYY_mon chargées et absentes de dedup_state.
+
+    Returns:
+        bool: True si l'ajout a réussi.
+    """
+    # Connexion à la base de données, partagée entre les étapes
+    engine = get_engine()
+
+    try:
+        with engine.connect() as connection:
+            ensure_dedup_state(connection)
+            if is_partitioned(connection, "customers"):
+                raise ValueError(
+                    "customers n'est pas encore dédupliquée : lancez d'abord "
+                    "une déduplication complète"
+                )
+
+            sources = sources or pending_sources(connection)
+            if not sources:
+                print("\nAucune nouvelle table à dédupliquer")
+                return True
+
+            for source in sources:
+                rows_in, rows_kept = dedup_incremental(connection, source)
+                connection.commit()
+                print(f"\n{source}: {rows_in:,} lignes lues, "
+                      f"{rows_kept:,} ajoutées à customers, "
+                      f"{rows_in - rows_kept:,} doublons supprimés")
+            return True
+
+    except Exception as e:
+        print(f"Erreur lors de la suppression des doublons: {str(e)}")
+        return False
+
+
+def remove_duplicates(method="sql", memory_mb=512, verify=False,
+                      exact=False, shards=DEFAULT_SHARDS):
+    """
+    Supprime les doublons à 1 seconde de la table customers.
+
+    Les nombres de lignes avant et après sont lus dans row_counts : le
+    nombre de lignes conservées est celui renvoyé par l'écriture de la
+    table dédupliquée, enregistré dans la même transaction.
+
+    Args:
+        method (str): "sql" (fonction fenêtre côté serveur), "external"
+            (tri externe en flux côté client) ou "sharded" (fonction
+            fenêtre en shards parallèles, voir dedup_sharded).
+        memory_mb (int): Le budget mémoire du tri externe, en Mo.
+        verify (bool): Compare le résultat du tri externe ou en shards à
+            la version SQL.
+        exact (bool): Compter customers avec un vrai COUNT(*) au lieu de
+            lire row_counts.
+        shards (int): Le nombre de shards de la méthode "sharded".
+
+    Returns:
+        bool: True si la déduplication a réussi.
+    """
+    # Connexion à la base de données, partagée entre les étapes
+    engine = get_engine()
 
     try:
         with engine.connect() as connection:
             # Compter le nombre initial de lignes
-            result = connection.execute(text("SELECT COUNT(*) FROM customers"))
-            initial_count = result.scalar()
+            initial_count = get_count(connection, "customers", exact)
             print(f"\nNombre initial de lignes: {initial_count:,}")
 
-            # Créer une table temporaire sans doublons
-            # On considère comme doublons les événements qui ont:
-            # 1. Les mêmes valeurs pour TOUTES les colonnes
-            # 2. Se produisent dans un intervalle de 1 seconde
-            dedup_query = """
-            CREATE TABLE customers_no_duplicates AS
-            WITH ranked_events AS (
-                SELECT *,
-                    LAG(event_time) OVER (
-                        PARTITION BY event_type, product_id, price, user_id, user_session
-                        ORDER BY event_time
-                    ) as prev_event_time
-                FROM customers
-            )
-            SELECT 
-                event_time,
-                event_type,
-                product_id,
-                price,
-                user_id,
-                user_session
-            FROM ranked_events
-            WHERE 
-                prev_event_time IS NULL 
-                OR 
-                EXTRACT(EPOCH FROM (event_time - prev_event_time)) > 1;
-            """
-
             # Exécuter la déduplication
+            columns = table_columns(connection, "customers")
             connection.execute(text("DROP TABLE IF EXISTS customers_no_duplicates"))
-            connection.execute(text(dedup_query))
+            if method in ("external", "sharded"):
+                # Les lignes sont écrites par d'autres connexions
+                connection.commit()
+                if method == "external":
+                    with metrics.timed("dedup", "external_sort"):
+                        rows_kept = dedup_external(
+                            engine, "customers", "customers_no_duplicates",
+                            memory_mb, columns,
+                        )
+                else:
+                    with metrics.timed("dedup", "sharded"):
+                        rows_kept = dedup_sharded(
+                            engine, "customers", "customers_no_duplicates",
+                            shards, columns,
+                        )
+                if verify and not verify_against_sql(
+                    connection, "customers_no_duplicates", columns
+                ):
+                    connection.rollback()
+                    return False
+            else:
+                rows_kept = metrics.execute_timed(
+                    connection, "dedup", "dedup_window",
+                    dedup_query("customers", "customers_no_duplicates", columns),
+                )
+            set_count(connection, "customers_no_duplicates", rows_kept)
 
-            # Remplacer l'ancienne table par la nouvelle
-            connection.execute(text("DROP TABLE customers"))
+            # Remplacer l'ancienne table par la nouvelle (les tables
+            # mensuelles sont détachées et conservées)
+            sources = list_partitions(connection, "customers")
+            drop_table(connection, "customers")
             connection.execute(
                 text("ALTER TABLE customers_no_duplicates RENAME TO customers")
             )
+
+            # Noter les tables mensuelles déjà dédupliquées, pour le mode
+            # incrémental
+            if sources:
+                ensure_dedup_state(connection)
+                connection.execute(text("DELETE FROM dedup_state"))
+                for source in sources:
+                    register_source(connection, source)
             connection.commit()
 
             # Compter le nombre final de lignes
-            result = connection.execute(text("SELECT COUNT(*) FROM customers"))
-            final_count = result.scalar()
+            final_count = get_count(connection, "customers", exact)
 
             # Afficher les statistiques
             duplicates_removed = initial_count - final_count
             print(f"Nombre final de lignes: {final_count:,}")
             print(f"Nombre de doublons supprimés: {duplicates_removed:,}")
+            return True
 
     except Exception as e:
         print(f"Erreur lors de la suppression des doublons: {str(e)}")
+        return False
 
 
-def test_no_duplicates():
+def test_no_duplicates(fail_fast=False):
     """
     Vérifie qu'il n'y a plus de doublons dans la table 'customers' après déduplication,
     en vérifiant spécifiquement les instructions identiques séparées par moins d'une seconde.
-    """
-    # Charger les variables d'environnement
-    load_dotenv()
-    DATABASE_URL = os.getenv("DATABASE_URL")
 
-    # Créer la connexion à la base de données
-    engine = create_engine(DATABASE_URL)
+    Les violations sont comptées côté serveur et seuls quelques exemples
+    sont lus, avec un curseur serveur : la mémoire reste constante quel
+    que soit le nombre de doublons.
+
+    Args:
+        fail_fast (bool): S'arrêter à la première violation trouvée.
+
+    Returns:
+        bool: True si tous les tests sont réussis.
+    """
+    # Connexion à la base de données, partagée entre les étapes
+    engine = get_engine()
 
     try:
         with engine.connect() as connection:
@@ -98,17 +547,25 @@ def test_no_duplicates():
                 COUNT(*) > 1
             """
 
-            result = connection.execute(text(duplicate_test_query))
-            duplicates = result.fetchall()
+            with metrics.timed("dedup_check", "exact_duplicates"):
+                duplicates, samples = count_and_sample(
+                    connection, duplicate_test_query, fail_fast=fail_fast
+                )
 
             if duplicates:
-                print(
-                    f"❌ Test échoué: {len(duplicates)} groupes de doublons exacts trouvés!"
-                )
-                for dup in duplicates[:5]:  # Afficher les 5 premiers groupes
+                if fail_fast:
+                    print("❌ Test échoué: au moins un groupe de doublons exacts trouvé!")
+                else:
+                    print(
+                        f"❌ Test échoué: {duplicates:,} groupes de doublons exacts trouvés!"
+                    )
+                for dup in samples:  # Afficher les 5 premiers groupes
                     print(f"  - {dup}")
-                if len(duplicates) > 5:
-                    print(f"  ...et {len(duplicates) - 5} autres groupes")
+                if duplicates > len(samples):
+                    print(f"  ...et {duplicates - len(samples):,} autres groupes")
+                if fail_fast:
+                    print("❌ La déduplication n'a pas correctement fonctionné.")
+                    return False
             else:
                 print("✅ Test réussi: Aucun doublon exact trouvé")
 
@@ -142,20 +599,27 @@ def test_no_duplicates():
                 AND EXTRACT(EPOCH FROM (event_time - prev_event_time)) <= 1
             """
 
-            result = connection.execute(text(time_duplicate_test_query))
-            time_duplicates = result.fetchall()
+            with metrics.timed("dedup_check", "time_duplicates"):
+                time_duplicates, samples = count_and_sample(
+                    connection, time_duplicate_test_query, fail_fast=fail_fast
+                )
 
             if time_duplicates:
-                print(
-                    f"❌ Test échoué: {len(time_duplicates)} paires d'événements identiques avec moins d'une seconde d'intervalle!"
-                )
-                for dup in time_duplicates[:5]:  # Afficher les 5 premières paires
+                if fail_fast:
+                    print(
+                        "❌ Test échoué: au moins une paire d'événements identiques avec moins d'une seconde d'intervalle!"
+                    )
+                else:
+                    print(
+                        f"❌ Test échoué: {time_duplicates:,} paires d'événements identiques avec moins d'une seconde d'intervalle!"
+                    )
+                for dup in samples:  # Afficher les 5 premières paires
                     print(f"  - Événement: {dup.event_type}, Produit: {dup.product_id}")
                     print(
                         f"    Temps: {dup.event_time} et {dup.prev_event_time} (différence: {dup.time_diff_seconds:.3f}s)"
                     )
-                if len(time_duplicates) > 5:
-                    print(f"  ...et {len(time_duplicates) - 5} autres paires")
+                if time_duplicates > len(samples):
+                    print(f"  ...et {time_duplicates - len(samples):,} autres paires")
             else:
                 print(
                     "✅ Test réussi: Aucun événement identique avec moins d'une seconde d'intervalle"
@@ -164,13 +628,64 @@ def test_no_duplicates():
             # Conclusion
             if not duplicates and not time_duplicates:
                 print("✅ Tous les tests réussis! La déduplication est efficace.")
-            else:
-                print("❌ La déduplication n'a pas correctement fonctionné.")
+                return True
+            print("❌ La déduplication n'a pas correctement fonctionné.")
+            return False
 
     except Exception as e:
         print(f"Erreur lors des tests de vérification: {str(e)}")
+        return False
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Supprime les doublons à 1 seconde de customers"
+    )
+    parser.add_argument(
+        "--method", choices=["sql", "external", "sharded"], default="sql",
+        help="sql : fonction fenêtre dans PostgreSQL ; external : tri "
+             "externe en flux côté client ; sharded : fonction fenêtre "
+             "en shards parallèles par user_id (défaut : sql)"
+    )
+    parser.add_argument(
+        "--shards", type=int, default=DEFAULT_SHARDS,
+        help="nombre de shards, et de connexions, de la méthode sharded "
+             f"(défaut : {DEFAULT_SHARDS})"
+    )
+    parser.add_argument(
+        "--memory-mb", type=int, default=512,
+        help="budget mémoire du tri externe en Mo (défaut : 512)"
+    )
+    parser.add_argument(
+        "--verify", action="store_true",
+        help="compare le résultat du tri externe ou en shards à la "
+             "version SQL"
+    )
+    parser.add_argument(
+        "--fail-fast", action="store_true",
+        help="arrête la vérification à la première violation"
+    )
+    parser.add_argument(
+        "--exact", action="store_true",
+        help="compte customers avec un vrai COUNT(*) au lieu de lire "
+             "row_counts"
+    )
+    parser.add_argument(
+        "--incremental", nargs="*", metavar="TABLE",
+        help="ajoute seulement les nouvelles tables mensuelles (par défaut "
+             "celles qui ne sont pas encore dédupliquées)"
+    )
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
-    remove_duplicates()
-    test_no_duplicates()
+    args = parse_args()
+    if args.incremental is not None:
+        remove_duplicates_incremental(args.incremental)
+    else:
+        remove_duplicates(
+            args.method, args.memory_mb, args.verify, args.exact,
+            args.shards,
+        )
+        test_no_duplicates(args.fail_fast)
+    metrics.export_metrics("remove_duplicates")
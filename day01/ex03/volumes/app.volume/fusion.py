@@ -1,20 +1,36 @@
-import os
-from sqlalchemy import create_engine, text
-from dotenv import load_dotenv
+import argparse
+from sqlalchemy import text
+from database import get_engine
+from partitions import drop_table
+from verification import stream_rows
+from row_counts import get_count, set_count
+from product_cache import has_unique_products
+from sql_queries import DIALECTS, items_unique_query, fusion_query
+import metrics
 
 
-def fusion():
+def fusion(exact=False):
     """
     Fusionne les tables 'customers' et 'items' en conservant toutes les informations.
     La fusion se fait sur la colonne 'product_id' qui est commune aux deux tables.
-    Déduplique d'abord la table items pour éviter la multiplication des lignes.
-    """
-    # Charger les variables d'environnement
-    load_dotenv()
-    DATABASE_URL = os.getenv("DATABASE_URL")
 
-    # Créer la connexion à la base de données
-    engine = create_engine(DATABASE_URL)
+    items_table.py charge déjà une ligne par product_id : items est alors
+    jointe directement. Une table items plus ancienne, chargée telle
+    quelle, est d'abord dédupliquée avec la même règle (la ligne la plus
+    renseignée, puis la première chargée) pour éviter la multiplication
+    des lignes.
+
+    Les nombres de lignes sont lus dans row_counts, ou renvoyés par les
+    requêtes qui écrivent les tables.
+
+    Args:
+        exact (bool): Compter customers et items avec un vrai COUNT(*).
+
+    Returns:
+        bool: True si customers est enrichie à la fin de l'appel.
+    """
+    # Connexion à la base de données, partagée entre les étapes
+    engine = get_engine()
 
     try:
         with engine.connect() as connection:
@@ -31,62 +47,58 @@ def fusion():
             if not tables_status[1]:
                 raise Exception("La table 'items' n'existe pas")
 
+            # Les événements ont pu être enrichis dès l'ingestion
+            # (automatic_table.py --enrich) : rien à refaire dans ce cas
+            enriched_check_query = """
+            SELECT COUNT(*) FROM information_schema.columns
+            WHERE table_name = 'customers'
+              AND column_name IN ('category_id', 'category_code', 'brand')
+            """
+            if connection.execute(text(enriched_check_query)).scalar() == 3:
+                print("\nLa table 'customers' est déjà enrichie, fusion inutile.")
+                return True
+
             # Compter le nombre initial de lignes dans chaque table
-            count_customers = connection.execute(text("SELECT COUNT(*) FROM customers")).scalar()
-            count_items = connection.execute(text("SELECT COUNT(*) FROM items")).scalar()
+            count_customers = get_count(connection, "customers", exact)
+            count_items = get_count(connection, "items", exact)
             print(f"\nNombre de lignes dans customers: {count_customers:,}")
             print(f"Nombre de lignes dans items: {count_items:,}")
             
-            # 1. Créer une table temporaire items_unique avec seulement une entrée par product_id
-            print("Déduplications des items par product_id...")
-            deduplicate_items_query = """
-            CREATE TABLE items_unique AS
-            SELECT DISTINCT ON (product_id) 
-                product_id,
-                category_id,
-                category_code,
-                brand
-            FROM items
-            """
-            connection.execute(text("DROP TABLE IF EXISTS items_unique"))
-            connection.execute(text(deduplicate_items_query))
-            connection.commit()
-            
-            # Compter le nombre d'items uniques
-            count_items_unique = connection.execute(text("SELECT COUNT(*) FROM items_unique")).scalar()
-            print(f"Nombre d'items après déduplication: {count_items_unique:,} (réduction de {count_items - count_items_unique:,} lignes)")
+            # 1. Une seule entrée par product_id : items si elle est déjà
+            # dédupliquée, sinon une table temporaire items_unique
+            items_source = "items"
+            if not has_unique_products(connection):
+                print("Déduplications des items par product_id...")
+                connection.execute(text("DROP TABLE IF EXISTS items_unique"))
+                count_items_unique = metrics.execute_timed(
+                    connection, "fusion", "items_unique",
+                    items_unique_query(
+                        "items", "items_unique", DIALECTS["postgres"]
+                    ),
+                )
+                connection.commit()
+                items_source = "items_unique"
+
+                # Nombre d'items uniques, renvoyé par CREATE TABLE AS
+                print(f"Nombre d'items après déduplication: {count_items_unique:,} (réduction de {count_items - count_items_unique:,} lignes)")
 
             # 2. Créer la table 'customers_enriched' qui contiendra la fusion
             # Utiliser une jointure LEFT pour garder tous les enregistrements de 'customers'
-            # même s'il n'y a pas de correspondance dans 'items_unique'
+            # même s'il n'y a pas de correspondance dans items
             print("Fusion des tables en cours...")
-            fusion_query = """
-            CREATE TABLE customers_enriched AS
-            SELECT 
-                c.event_time,
-                c.event_type,
-                c.product_id,
-                c.price,
-                c.user_id,
-                c.user_session,
-                i.category_id,
-                i.category_code,
-                i.brand
-            FROM 
-                customers c
-            LEFT JOIN 
-                items_unique i ON c.product_id = i.product_id
-            """
-            
+
             # Supprimer la table fusion si elle existe déjà
             connection.execute(text("DROP TABLE IF EXISTS customers_enriched"))
             
-            # Exécuter la fusion
-            connection.execute(text(fusion_query))
+            # Exécuter la fusion, et enregistrer le nombre de lignes écrites
+            count_fusion = metrics.execute_timed(
+                connection, "fusion", "customers_enriched",
+                fusion_query("customers", items_source, "customers_enriched"),
+            )
+            set_count(connection, "customers_enriched", count_fusion)
             connection.commit()
             
             # Vérifier le résultat
-            count_fusion = connection.execute(text("SELECT COUNT(*) FROM customers_enriched")).scalar()
             print(f"Nombre de lignes dans la table fusionnée: {count_fusion:,}")
             
             # Vérifier que nous n'avons pas perdu de données de customers
@@ -96,9 +108,10 @@ def fusion():
                 print("✅ Toutes les données de customers ont été conservées.")
             
             # Vérifier les correspondances avec items
-            match_count = connection.execute(text("""
-            SELECT COUNT(*) FROM customers_enriched WHERE category_id IS NOT NULL
-            """)).scalar()
+            with metrics.timed("fusion", "match_count"):
+                match_count = connection.execute(text("""
+                SELECT COUNT(*) FROM customers_enriched WHERE category_id IS NOT NULL
+                """)).scalar()
             match_percent = (match_count / count_fusion) * 100 if count_fusion > 0 else 0
             print(f"Pourcentage d'enregistrements avec correspondance dans items: {match_percent:.2f}%")
             
@@ -108,28 +121,35 @@ def fusion():
             
             # Renommer la table customers_enriched en customers
             print("Remplacement de la table customers par la table enrichie...")
-            connection.execute(text("DROP TABLE IF EXISTS customers_old"))
+            drop_table(connection, "customers_old")
             connection.execute(text("ALTER TABLE customers RENAME TO customers_old"))
             connection.execute(text("ALTER TABLE customers_enriched RENAME TO customers"))
             connection.commit()
             
             print("Fusion terminée avec succès.")
+            return True
             
     except Exception as e:
         print(f"Erreur lors de la fusion: {str(e)}")
+        return False
 
 
-def test_fusion():
+def test_fusion(fail_fast=False):
     """
     Vérifie que la fusion a correctement fonctionné en examinant la structure
     et le contenu de la table fusionnée.
-    """
-    # Charger les variables d'environnement
-    load_dotenv()
-    DATABASE_URL = os.getenv("DATABASE_URL")
 
-    # Créer la connexion à la base de données
-    engine = create_engine(DATABASE_URL)
+    Les exemples sont lus avec un curseur serveur et la couverture est
+    calculée par un agrégat, sans ramener la table côté client.
+
+    Args:
+        fail_fast (bool): S'arrêter au premier test échoué.
+
+    Returns:
+        bool: True si tous les tests sont réussis.
+    """
+    # Connexion à la base de données, partagée entre les étapes
+    engine = get_engine()
 
     try:
         with engine.connect() as connection:
@@ -142,18 +162,22 @@ def test_fusion():
             ORDER BY ordinal_position
             """
             result = connection.execute(text(columns_query))
-            columns = [row[0] for row in result.fetchall()]
+            columns = [row[0] for row in result]
             
             print("Structure de la table fusionnée:")
             for col in columns:
                 print(f"  - {col}")
             
+            success = True
+
             # Vérifier si les colonnes d'items sont présentes
             items_columns = ['category_id', 'category_code', 'brand']
             missing_columns = [col for col in items_columns if col not in columns]
             
             if missing_columns:
                 print(f"❌ Test échoué: Colonnes manquantes de la table items: {', '.join(missing_columns)}")
+                # Les tests suivants ont besoin des colonnes d'items
+                return False
             else:
                 print("✅ Test réussi: Toutes les colonnes d'items ont été ajoutées")
             
@@ -163,8 +187,7 @@ def test_fusion():
             WHERE category_id IS NOT NULL 
             LIMIT 5
             """
-            result = connection.execute(text(sample_query))
-            samples = result.fetchall()
+            samples = stream_rows(connection, sample_query, 5)
             
             if samples:
                 print("\nExemples d'enregistrements fusionnés:")
@@ -172,11 +195,41 @@ def test_fusion():
                     print(f"  - Event: {sample.event_type}, Product: {sample.product_id}, Category: {sample.category_code}, Brand: {sample.brand}")
             else:
                 print("❌ Test échoué: Aucun enregistrement avec des données d'items trouvé")
+                if fail_fast:
+                    return False
+                success = False
+
+            # Taux de couverture calculé côté serveur
+            coverage_query = """
+            SELECT COUNT(*) AS total, COUNT(category_id) AS enriched
+            FROM customers
+            """
+            coverage = connection.execute(text(coverage_query)).fetchone()
+            if coverage.total:
+                ratio = coverage.enriched / coverage.total
+                print(f"\nLignes enrichies: {coverage.enriched:,}/{coverage.total:,} ({ratio:.1%})")
+            return success
                 
     except Exception as e:
         print(f"Erreur lors du test de la fusion: {str(e)}")
+        return False
 
 
 if __name__ == "__main__":
-    fusion()
-    test_fusion()
+    parser = argparse.ArgumentParser(
+        description="Ajoute les colonnes d'items à la table customers"
+    )
+    parser.add_argument(
+        "--fail-fast", action="store_true",
+        help="arrête la vérification au premier test échoué"
+    )
+    parser.add_argument(
+        "--exact", action="store_true",
+        help="compte customers et items avec un vrai COUNT(*) au lieu de "
+             "lire row_counts"
+    )
+    args = parser.parse_args()
+
+    fusion(args.exact)
+    test_fusion(args.fail_fast)
+    metrics.export_metrics("fusion")
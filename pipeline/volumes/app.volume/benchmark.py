@@ -0,0 +1,386 @@
+import io
+import os
+import json
+import time
+import argparse
+import resource
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from datetime import datetime, timezone
+from multiprocessing import get_context
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+from synthetic import generate_dataset
+
+# Étapes mesurées, dans l'ordre où elles doivent s'enchaîner
+STAGES = [
+    "process_csv_file",
+    "create_items_table",
+    "create_customers_table",
+    "remove_duplicates",
+    "fusion",
+]
+BACKENDS = ["postgres", "duckdb"]
+# Base DuckDB des mesures, dans le dossier du jeu de données
+DUCKDB_FILE = "benchmark.duckdb"
+RESULTS_FILE = "benchmark_results.jsonl"
+# Baisse de débit, par rapport à la mesure précédente, signalée comme
+# régression (les petites échelles sont bruitées)
+REGRESSION_THRESHOLD = 0.2
+
+
+def count_rows(engine, tables):
+    with engine.connect() as connection:
+        return sum(
+            connection.execute(text(f"SELECT COUNT(*) FROM {t}")).scalar()
+            for t in tables
+        )
+
+
+def postgres_stages(csv_files, items_csv):
+    """
+    Étapes mesurées sur PostgreSQL.
+
+    Returns:
+        tuple: (étape -> fonction, fonction qui compte les lignes de
+            tables)
+    """
+    from database import get_engine
+    from load_manifest import ensure_manifest
+    from automatic_table import process_csv_file
+    from items_table import create_items_table
+    from customers_table import create_customers_table
+    from remove_duplicates import remove_duplicates
+    from fusion import fusion
+
+    engine = get_engine()
+
+    def ingest():
+        ensure_manifest(engine)
+        for path in csv_files:
+            process_csv_file(path, engine)
+
+    stages = {
+        "process_csv_file": ingest,
+        "create_items_table": lambda: create_items_table(engine, items_csv),
+        "create_customers_table": create_customers_table,
+        "remove_duplicates": remove_duplicates,
+        "fusion": fusion,
+    }
+    return stages, lambda tables: count_rows(engine, tables)
+
+
+def duckdb_stages(csv_files, monthly_tables, items_csv, database):
+    """Étapes mesurées sur DuckDB (voir postgres_stages)"""
+    import duckdb_backend as duck
+
+    connection = duck.connect(database)
+    stages = {
+        "process_csv_file": lambda: duck.ingest_files(connection, csv_files),
+        "create_items_table": lambda: duck.create_items_table(
+            connection, items_csv
+        ),
+        "create_customers_table": lambda: duck.create_customers_table(
+            connection, monthly_tables
+        ),
+        "remove_duplicates": lambda: duck.remove_duplicates(connection),
+        "fusion": lambda: duck.fusion(connection),
+    }
+    return stages, lambda tables: sum(
+        duck.count_rows(connection, table) for table in tables
+    )
+
+
+def measure_stage(name, dataset_dir, backend="postgres"):
+    """
+    Exécute une étape dans un processus neuf et mesure son coût.
+
+    Le pic de mémoire (RSS) est celui du processus client : le travail fait
+    par PostgreSQL lui-même n'y apparaît pas, seulement dans la durée.
+    Avec DuckDB, tout le travail est fait dans le processus et compté.
+
+    Args:
+        name (str): L'étape, parmi STAGES.
+        dataset_dir (str): Le dossier du jeu de données synthétique.
+        backend (str): Le moteur, parmi BACKENDS.
+
+    Returns:
+        dict: Le résultat de la mesure.
+    """
+    from compressed_input import csv_stem, is_csv, find_input
+
+    customer_dir = os.path.join(dataset_dir, "customer")
+    csv_files = sorted(
+        os.path.join(customer_dir, f) for f in os.listdir(customer_dir)
+        if is_csv(f)
+    )
+    monthly_tables = [csv_stem(path) for path in csv_files]
+    items_csv = find_input(os.path.join(dataset_dir, "item", "item.csv"))
+    if backend == "duckdb":
+        stages, count_tables = duckdb_stages(
+            csv_files, monthly_tables, items_csv,
+            os.path.join(dataset_dir, DUCKDB_FILE),
+        )
+    else:
+        stages, count_tables = postgres_stages(csv_files, items_csv)
+
+    # Lignes traitées par l'étape : ses entrées pour la déduplication,
+    # ses sorties pour les autres
+    if name == "remove_duplicates":
+        rows = count_tables(["customers"])
+
+    output = io.StringIO()
+    start = time.perf_counter()
+    with redirect_stdout(output):
+        try:
+            success = stages[name]() is not False
+        except Exception as e:
+            print(f"Erreur dans l'étape {name} : {str(e)}")
+            success = False
+    seconds = time.perf_counter() - start
+
+    if name == "process_csv_file":
+        rows = count_tables(monthly_tables)
+    elif name == "create_items_table":
+        rows = count_tables(["items"])
+    elif name != "remove_duplicates":
+        rows = count_tables(["customers"])
+
+    return {
+        "stage": name,
+        "backend": backend,
+        "success": success,
+        "rows": rows,
+        "seconds": round(seconds, 3),
+        "rows_per_second": round(rows / seconds) if seconds > 0 else None,
+        # ru_maxrss est en Ko sous Linux
+        "peak_rss_mb": round(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1
+        ),
+        "output": output.getvalue(),
+    }
+
+
+def reset_database(admin_url, url):
+    """Recrée la base de benchmark, vide"""
+    name = make_url(url).database
+    engine = create_engine(admin_url, isolation_level="AUTOCOMMIT")
+    with engine.connect() as connection:
+        connection.execute(text(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)'))
+        connection.execute(text(f'CREATE DATABASE "{name}"'))
+    engine.dispose()
+
+
+def drop_database(admin_url, url):
+    name = make_url(url).database
+    engine = create_engine(admin_url, isolation_level="AUTOCOMMIT")
+    with engine.connect() as connection:
+        connection.execute(text(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)'))
+    engine.dispose()
+
+
+def load_results(path):
+    """Lit les résultats des exécutions précédentes"""
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def previous_result(results, scale, stage, backend):
+    """Renvoie la dernière mesure réussie d'une étape à cette échelle"""
+    for result in reversed(results):
+        # Les mesures sans moteur datent d'avant DuckDB : PostgreSQL
+        if (result["scale"] == scale and result["stage"] == stage
+                and result.get("backend", "postgres") == backend
+                and result["success"]):
+            return result
+    return None
+
+
+def print_result(result, previous):
+    """Affiche une mesure et son écart avec la précédente"""
+    if not result["success"]:
+        print(f"  {result['stage']:<24} ÉCHEC")
+        return
+
+    line = (f"  {result['stage']:<24} {result['seconds']:>8.2f}s "
+            f"{result['rows_per_second'] or 0:>12,} lignes/s "
+            f"{result['peak_rss_mb']:>8.1f} Mo")
+    if previous is not None and previous["rows_per_second"]:
+        change = result["rows_per_second"] / previous["rows_per_second"] - 1
+        line += f"  ({change:+.0%} débit"
+        line += f", {result['peak_rss_mb'] - previous['peak_rss_mb']:+.1f} Mo)"
+        if change < -REGRESSION_THRESHOLD:
+            line += "  <-- régression"
+    print(line)
+
+
+def run_backend(backend, scale, args, dataset_dir, results):
+    """
+    Mesure toutes les étapes d'un moteur sur le jeu de données.
+
+    Returns:
+        list: Les mesures, jusqu'à la première étape en échec.
+    """
+    print(f"\n  {backend} :")
+    measured = []
+    for stage_name in STAGES:
+        # Un processus neuf par étape : le pic de RSS est le sien
+        with ProcessPoolExecutor(
+            max_workers=1, mp_context=get_context("spawn")
+        ) as executor:
+            result = executor.submit(
+                measure_stage, stage_name, dataset_dir, backend
+            ).result()
+
+        output = result.pop("output")
+        result.update({
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "scale": scale,
+            "duplicate_rate": args.duplicate_rate,
+            "overlap": args.overlap,
+        })
+        print_result(
+            result, previous_result(results, scale, stage_name, backend)
+        )
+        measured.append(result)
+        if not result["success"]:
+            print(output)
+            break
+    return measured
+
+
+def compare_backends(measured, dataset_dir, url):
+    """
+    Compare PostgreSQL et DuckDB sur un même jeu de données : la table
+    customers finale doit être identique ligne pour ligne, puis le
+    rapport des durées de chaque étape est affiché.
+
+    Returns:
+        bool: True si les deux moteurs donnent le même résultat.
+    """
+    import duckdb_backend as duck
+
+    engine = create_engine(url)
+    try:
+        with duck.connect(os.path.join(dataset_dir, DUCKDB_FILE)) as connection:
+            identical = duck.compare_with_postgres(connection, engine)
+    finally:
+        engine.dispose()
+
+    seconds = {
+        (result["backend"], result["stage"]): result["seconds"]
+        for result in measured
+    }
+    print("  Durée PostgreSQL / DuckDB :")
+    for stage_name in STAGES:
+        postgres = seconds.get(("postgres", stage_name))
+        duckdb = seconds.get(("duckdb", stage_name))
+        if postgres and duckdb:
+            print(f"    {stage_name:<22} {postgres / duckdb:>6.1f}x")
+    return identical
+
+
+def run_scale(scale, args, url, results):
+    """
+    Génère un jeu de données et mesure toutes les étapes à cette échelle,
+    avec chaque moteur demandé.
+
+    Returns:
+        list: Les mesures de l'échelle.
+    """
+    measured = []
+    with tempfile.TemporaryDirectory(dir=args.workdir) as dataset_dir:
+        print(f"\nÉchelle {scale:,} événements par mois : génération...")
+        generate_dataset(
+            dataset_dir, scale, duplicate_rate=args.duplicate_rate,
+            overlap=args.overlap, seed=args.seed,
+        )
+        if "postgres" in args.backends:
+            reset_database(args.admin_url, url)
+
+        for backend in args.backends:
+            measured.extend(
+                run_backend(backend, scale, args, dataset_dir, results)
+            )
+
+        # Les deux moteurs sont allés au bout : comparer leurs résultats
+        finished = [
+            result for result in measured
+            if result["stage"] == STAGES[-1] and result["success"]
+        ]
+        if len(finished) == len(BACKENDS) == len(args.backends):
+            identical = compare_backends(measured, dataset_dir, url)
+            for result in measured:
+                result["identical_results"] = identical
+    return measured
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Mesure la durée, le débit et le pic mémoire de chaque "
+                    "étape sur des données synthétiques"
+    )
+    parser.add_argument(
+        "--scales", type=int, nargs="+", default=[100000, 1000000],
+        help="événements par mois pour chaque échelle "
+             "(défaut : 100000 1000000)"
+    )
+    parser.add_argument(
+        "--backends", nargs="+", choices=BACKENDS, default=BACKENDS,
+        help="moteurs mesurés sur les mêmes données ; avec les deux, les "
+             "tables customers finales sont comparées "
+             "(défaut : postgres duckdb)"
+    )
+    parser.add_argument("--duplicate-rate", type=float, default=0.05)
+    parser.add_argument("--overlap", type=float, default=0.8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--workdir", default=None,
+        help="dossier des CSV générés (défaut : dossier temporaire)"
+    )
+    parser.add_argument(
+        "--output", default=RESULTS_FILE,
+        help=f"fichier des résultats, complété à chaque exécution "
+             f"(défaut : {RESULTS_FILE})"
+    )
+    parser.add_argument(
+        "--keep", action="store_true",
+        help="conserve la base de benchmark à la fin"
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    load_dotenv()
+
+    # Les mesures tournent dans une base dédiée, jamais dans la vraie
+    args.admin_url = os.getenv("DATABASE_URL")
+    admin = make_url(args.admin_url)
+    url = admin.set(database=f"{admin.database}_bench")
+    url = url.render_as_string(hide_password=False)
+    os.environ["DATABASE_URL"] = url
+
+    results = load_results(args.output)
+    try:
+        for scale in args.scales:
+            measured = run_scale(scale, args, url, results)
+            with open(args.output, "a") as f:
+                for result in measured:
+                    f.write(json.dumps(result) + "\n")
+            results.extend(measured)
+    except Exception as e:
+        print(f"Erreur lors du benchmark : {str(e)}")
+    finally:
+        if not args.keep and "postgres" in args.backends:
+            drop_database(args.admin_url, url)
+
+    print(f"\nRésultats ajoutés à {args.output}")
+
+
+if __name__ == "__main__":
+    main()
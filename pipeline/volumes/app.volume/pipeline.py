@@ -0,0 +1,453 @@
+import os
+import time
+import argparse
+from sqlalchemy import text
+from database import get_engine
+from dag import stage, file_fingerprints, run_pipeline, FAILED, BLOCKED
+from load_manifest import SKIP, ensure_manifest, plan_load, table_exists, \
+    completed_tables
+from chunk_sizing import DEFAULT_MEMORY_MB
+from automatic_table import ingest_directory, process_csv_file
+from items_table import create_items_table
+from customers_table import create_customers_table
+from remove_duplicates import DEFAULT_SHARDS, remove_duplicates, \
+    remove_duplicates_incremental, ensure_dedup_state
+from fusion import fusion
+from compact_storage import COMPACT_TABLE, compact_customers, is_compact
+from indexes import index_tables
+from partitions import MONTHLY_TABLE, is_partitioned, month_bounds, \
+    monthly_tables as database_months
+from file_watch import SETTLE_SECONDS, POLL_SECONDS, file_watcher, \
+    stable_files, mark_handled
+from compressed_input import csv_stem, is_csv, find_input
+import metrics
+
+CUSTOMER_DIR = "/customer"
+ITEMS_CSV = "/item/item.csv"
+
+
+def customer_files():
+    files = sorted(f for f in os.listdir(CUSTOMER_DIR) if is_csv(f))
+    return [os.path.join(CUSTOMER_DIR, f) for f in files]
+
+
+def monthly_tables():
+    return [csv_stem(path) for path in customer_files()]
+
+
+def build_stages(engine, args):
+    """
+    Déclare les étapes du pipeline et leurs dépendances :
+
+        ingest_customers -> index_sources -> customers -> dedup
+        ingest_items ----^        |                         |
+                                  |                   analyze_dedup
+                                  v                         |
+                                fusion <--------------------+
+                                  |
+                             (compact)
+                                  |
+                            index_customers
+
+    Les index ne sont créés qu'une fois les tables chargées, en
+    parallèle, et chaque étape d'index se termine par un VACUUM (ANALYZE)
+    pour que l'étape suivante soit planifiée avec des statistiques à jour
+    et puisse lire les index seuls.
+
+    L'étape compact n'existe qu'avec --compact : customers devient alors
+    une vue sur une table compacte (voir compact_storage), qui reçoit les
+    index de customers.
+    """
+    def index_stage(name, plan):
+        return lambda: index_tables(
+            engine, plan(), args.index_workers, stage=name
+        )
+
+    def customers_indexes():
+        with engine.connect() as connection:
+            if is_compact(connection):
+                # La clé de déduplication porte sur les colonnes texte,
+                # remplacées par des codes dans la table compacte
+                return {COMPACT_TABLE: ["event_time_brin", "product_id"]}
+        return {"customers": ["event_time_brin", "product_id", "dedup_key"]}
+
+    compact_stages = [
+        stage(
+            "compact",
+            lambda: compact_customers(args.exact),
+            deps=["fusion"],
+            outputs=["customers", COMPACT_TABLE],
+        ),
+    ] if args.compact else []
+
+    return [
+        stage(
+            "ingest_customers",
+            lambda: ingest_directory(
+                engine, CUSTOMER_DIR, args.ingest_workers, stage=args.stage,
+                queue_size=args.queue_size, writers=args.writers_per_file,
+                memory_mb=args.ingest_memory_mb, exact=args.exact,
+                drop_duplicates=args.drop_duplicates,
+            ),
+            inputs=lambda: file_fingerprints(customer_files()),
+            outputs=monthly_tables(),
+        ),
+        stage(
+            "ingest_items",
+            lambda: create_items_table(
+                engine, find_input(ITEMS_CSV), args.stage, args.queue_size,
+                args.writers_per_file, args.ingest_memory_mb, args.exact,
+            ),
+            inputs=lambda: file_fingerprints([find_input(ITEMS_CSV)]),
+            outputs=["items"],
+        ),
+        stage(
+            "index_sources",
+            # Clé de déduplication sur chaque mois (l'index de la table
+            # partitionnée customers les réutilisera) ; items a déjà sa
+            # clé primaire sur product_id
+            index_stage("index_sources", lambda: {
+                **{
+                    table: ["event_time_brin", "dedup_key"]
+                    for table in monthly_tables()
+                },
+                "items": [],
+            }),
+            deps=["ingest_customers", "ingest_items"],
+            outputs=monthly_tables() + ["items"],
+        ),
+        stage(
+            "customers",
+            lambda: create_customers_table(args.exact),
+            deps=["index_sources"],
+            outputs=["customers"],
+        ),
+        stage(
+            "dedup",
+            lambda: remove_duplicates(
+                args.dedup_method, args.memory_mb, exact=args.exact,
+                shards=args.dedup_shards,
+            ),
+            deps=["customers"],
+            inputs=lambda: [args.dedup_method],
+            outputs=["customers"],
+        ),
+        stage(
+            "analyze_dedup",
+            # Statistiques seulement : la fusion lit toute la table, et un
+            # index partirait avec elle dans customers_old
+            index_stage("analyze_dedup", lambda: {"customers": []}),
+            deps=["dedup"],
+            outputs=["customers"],
+        ),
+        stage(
+            "fusion",
+            lambda: fusion(args.exact),
+            deps=["analyze_dedup", "index_sources"],
+            outputs=["customers"],
+        ),
+        *compact_stages,
+        stage(
+            "index_customers",
+            index_stage("index_customers", customers_indexes),
+            deps=["compact"] if args.compact else ["fusion"],
+            outputs=["customers"],
+        ),
+    ]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Enchaîne l'ingestion, la table customers, la "
+                    "déduplication et la fusion, en ignorant les étapes "
+                    "déjà à jour"
+    )
+    parser.add_argument(
+        "--force", nargs="*", metavar="ETAPE",
+        help="relance ces étapes même si elles sont à jour (toutes si "
+             "aucune n'est donnée)"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=2,
+        help="nombre d'étapes indépendantes lancées en parallèle "
+             "(défaut : 2)"
+    )
+    parser.add_argument(
+        "--ingest-workers", type=int, default=1,
+        help="nombre de fichiers CSV chargés en parallèle (défaut : 1)"
+    )
+    parser.add_argument(
+        "--stage", action="store_true",
+        help="charge les CSV depuis leur copie Parquet (dossier .staging)"
+    )
+    parser.add_argument(
+        "--queue-size", type=int, default=0,
+        help="nombre de chunks lus d'avance pendant l'écriture du "
+             "précédent (défaut : 0, lecture et écriture en séquence)"
+    )
+    parser.add_argument(
+        "--writers-per-file", type=int, default=1,
+        help="nombre de connexions qui écrivent un même fichier en "
+             "parallèle (défaut : 1)"
+    )
+    parser.add_argument(
+        "--ingest-memory-mb", type=int, default=DEFAULT_MEMORY_MB,
+        help="budget mémoire de chaque ingestion en Mo ; la taille des "
+             f"chunks s'y ajuste (défaut : {DEFAULT_MEMORY_MB})"
+    )
+    parser.add_argument(
+        "--drop-duplicates", action="store_true",
+        help="retire les doublons exacts des événements dès l'ingestion"
+    )
+    parser.add_argument(
+        "--index-workers", type=int, default=4,
+        help="nombre d'index construits en parallèle (défaut : 4)"
+    )
+    parser.add_argument(
+        "--dedup-method", choices=["sql", "external", "sharded"],
+        default="sql",
+        help="méthode de déduplication (défaut : sql)"
+    )
+    parser.add_argument(
+        "--dedup-shards", type=int, default=DEFAULT_SHARDS,
+        help="nombre de requêtes parallèles de la méthode sharded, une "
+             f"par connexion (défaut : {DEFAULT_SHARDS})"
+    )
+    parser.add_argument(
+        "--memory-mb", type=int, default=512,
+        help="budget mémoire du tri externe en Mo (défaut : 512)"
+    )
+    parser.add_argument(
+        "--exact", action="store_true",
+        help="vérifie les nombres de lignes avec de vrais COUNT(*) au lieu "
+             "de lire row_counts"
+    )
+    parser.add_argument(
+        "--compact", action="store_true",
+        help="stocke customers sous forme compacte (codes entiers, prix en "
+             "centimes) derrière une vue du même nom, après la fusion"
+    )
+    parser.add_argument(
+        "--watch", action="store_true",
+        help="reste actif et intègre chaque nouveau fichier mensuel à "
+             "customers (chargé, dédupliqué et enrichi) dès qu'il est "
+             "complet, sans retraiter les mois déjà présents"
+    )
+    parser.add_argument(
+        "--poll-seconds", type=float, default=POLL_SECONDS,
+        help=f"intervalle entre deux examens des dossiers en mode --watch "
+             f"(défaut : {POLL_SECONDS})"
+    )
+    parser.add_argument(
+        "--settle-seconds", type=float, default=SETTLE_SECONDS,
+        help="délai sans modification après lequel un fichier est "
+             f"considéré complet (défaut : {SETTLE_SECONDS})"
+    )
+    parser.add_argument(
+        "--backend", choices=["postgres", "duckdb"], default="postgres",
+        help="moteur des étapes : postgres (DATABASE_URL) ou duckdb, dans "
+             "le processus ; avec duckdb, toutes les étapes sont relancées "
+             "et les options d'ingestion sont ignorées (défaut : postgres)"
+    )
+    parser.add_argument(
+        "--duckdb-database", default="pipeline.duckdb",
+        help="fichier de la base DuckDB, ou :memory: "
+             "(défaut : pipeline.duckdb)"
+    )
+    return parser.parse_args()
+
+
+def loaded_months(connection):
+    """Tables mensuelles dont le chargement est terminé (load_manifest)"""
+    return completed_tables(connection, database_months(connection))
+
+
+def integrated_months(engine):
+    """
+    Tables mensuelles déjà dédupliquées dans customers, et complètes : un
+    mois dont le chargement n'est pas terminé est à reprendre.
+    """
+    with engine.begin() as connection:
+        ensure_dedup_state(connection)
+        result = connection.execute(
+            text("SELECT source_table FROM dedup_state")
+        )
+        return set(completed_tables(connection, [row[0] for row in result]))
+
+
+def integrate_months(engine, args):
+    """
+    Ajoute à customers, dédupliqués et enrichis, les mois chargés qui n'y
+    sont pas encore.
+
+    Tant que customers n'a jamais été dédupliquée, la chaîne complète
+    (customers, dedup, fusion) est lancée une fois. Ensuite, seuls les
+    nouveaux mois sont lus, avec leur fenêtre de bord, et enrichis depuis
+    items au moment de l'ajout (voir dedup_incremental) : les mois déjà
+    présents ne sont pas retraités.
+
+    Returns:
+        bool: True si customers est à jour.
+    """
+    with engine.connect() as connection:
+        if not loaded_months(connection):
+            print("\nAucun mois chargé pour l'instant")
+            return True
+        deduplicated = (
+            table_exists(engine, "customers")
+            and not is_partitioned(connection, "customers")
+        )
+    if not deduplicated:
+        print("\ncustomers n'est pas encore dédupliquée : chaîne complète")
+        return (
+            create_customers_table(args.exact)
+            and remove_duplicates(
+                args.dedup_method, args.memory_mb, exact=args.exact,
+                shards=args.dedup_shards,
+            )
+            and fusion(args.exact)
+            and (not args.compact or compact_customers(args.exact))
+        )
+    # La fusion ne refait rien si customers est déjà enrichie
+    return remove_duplicates_incremental() and fusion(args.exact)
+
+
+def ingest_ready(engine, watcher, ready, items_csv, args):
+    """
+    Charge les fichiers devenus complets : items d'abord, puis les mois
+    dans l'ordre chronologique.
+
+    Un mois déjà dédupliqué dans customers n'est pas rechargé : si son
+    fichier a changé, seul un pipeline complet (--force) peut le
+    retraiter. Un fichier dont le chargement échoue n'est pas marqué
+    traité : il est repris au prochain examen, et son mois reste hors de
+    customers d'ici là (voir pending_sources).
+    """
+    if items_csv in ready:
+        create_items_table(
+            engine, items_csv, args.stage, args.queue_size,
+            args.writers_per_file, args.ingest_memory_mb, args.exact,
+        )
+        mark_handled(watcher, items_csv)
+
+    months = []
+    for path in ready:
+        if path == items_csv:
+            continue
+        if MONTHLY_TABLE.fullmatch(csv_stem(path)):
+            months.append(path)
+        else:
+            print(f"\n⚠️ {path} ignoré : nom attendu data_YYYY_mon.csv")
+            mark_handled(watcher, path)
+    months.sort(key=lambda path: month_bounds(csv_stem(path)))
+
+    integrated = integrated_months(engine)
+    for path in months:
+        table_name = csv_stem(path)
+        try:
+            if table_name not in integrated:
+                process_csv_file(
+                    path, engine, stage=args.stage,
+                    queue_size=args.queue_size,
+                    writers=args.writers_per_file,
+                    memory_mb=args.ingest_memory_mb, exact=args.exact,
+                    drop_duplicates=args.drop_duplicates,
+                )
+            elif plan_load(engine, path, table_name)[0] != SKIP:
+                print(f"\n⚠️ {path} a changé mais {table_name} est déjà "
+                      "dans customers : relancez le pipeline avec --force")
+        except Exception as e:
+            print(f"Erreur lors du chargement de {path} : {str(e)}")
+            continue
+        mark_handled(watcher, path)
+
+
+def watch(engine, args):
+    """
+    Surveille les CSV d'entrée et intègre chaque nouveau mois à customers
+    dès que son fichier est complet.
+
+    Chaque examen ne fait qu'un stat par fichier. Quand des fichiers sont
+    devenus complets (voir file_watch), ils sont chargés puis customers
+    est mise à jour par integrate_months, et les mesures sont exportées.
+    Une erreur (base indisponible...) est affichée et la surveillance
+    continue : les mois non intégrés le seront au prochain fichier.
+    """
+    watcher = file_watcher(args.settle_seconds)
+    print(f"Surveillance de {CUSTOMER_DIR} et {ITEMS_CSV} toutes les "
+          f"{args.poll_seconds}s (Ctrl+C pour arrêter)")
+    try:
+        while True:
+            items_csv = find_input(ITEMS_CSV)
+            ready = stable_files(watcher, [items_csv] + customer_files())
+            if ready:
+                try:
+                    ingest_ready(engine, watcher, ready, items_csv, args)
+                    if integrate_months(engine, args):
+                        print("\ncustomers à jour, en attente de nouveaux "
+                              "fichiers...")
+                except Exception as e:
+                    print(f"Erreur lors de l'intégration : {str(e)}")
+                metrics.export_metrics("watch")
+                metrics.clear_logs()
+            time.sleep(args.poll_seconds)
+    except KeyboardInterrupt:
+        print("\nSurveillance arrêtée")
+
+
+def run_duckdb(args):
+    """Exécute les étapes dans DuckDB, sans PostgreSQL"""
+    # Import local : duckdb n'est nécessaire qu'avec --backend duckdb
+    from duckdb_backend import run_pipeline as run_duckdb_pipeline
+
+    durations = run_duckdb_pipeline(
+        args.duckdb_database, customer_files(), find_input(ITEMS_CSV)
+    )
+    if durations is None:
+        print("Pipeline incomplet")
+        return
+
+    print("\nRésumé du pipeline (DuckDB) :")
+    for name, seconds in durations.items():
+        print(f"  - {name} : {seconds:.1f}s")
+
+    metrics.export_metrics("pipeline")
+    print(f"Mesures écrites dans {metrics.METRICS_DIR}/pipeline.json")
+
+
+def main():
+    args = parse_args()
+    if args.backend == "duckdb":
+        run_duckdb(args)
+        return
+    engine = get_engine()
+    if args.watch:
+        try:
+            ensure_manifest(engine)
+            watch(engine, args)
+        except Exception as e:
+            print(f"Erreur lors de la surveillance : {str(e)}")
+        return
+
+    try:
+        # Les deux ingestions démarrent en parallèle : le manifeste est créé
+        # avant, deux CREATE TABLE IF NOT EXISTS simultanés peuvent échouer
+        ensure_manifest(engine)
+        stages = build_stages(engine, args)
+        status = run_pipeline(engine, stages, args.force, args.workers)
+    except Exception as e:
+        print(f"Erreur lors de l'exécution du pipeline : {str(e)}")
+        return
+
+    print("\nRésumé du pipeline :")
+    for s in stages:
+        print(f"  - {s['name']} : {status[s['name']]}")
+    if any(state in (FAILED, BLOCKED) for state in status.values()):
+        print("Pipeline incomplet")
+
+    metrics.export_metrics("pipeline")
+    print(f"Mesures écrites dans {metrics.METRICS_DIR}/pipeline.json")
+
+
+if __name__ == "__main__":
+    main()